@@ -15,6 +15,8 @@ Usage:
   python run_service_daemon_v2.py --daemon           # Run continuously
   python run_service_daemon_v2.py --interval 300     # Custom interval
   python run_service_daemon_v2.py --no-auto-update   # Disable git auto-update
+  python run_service_daemon_v2.py --daemon --idle    # Start cycles on IMAP IDLE push
+  python run_service_daemon_v2.py --no-imap-session  # Fetch via run_agent.py subprocess
 """
 import sys
 import time
@@ -75,7 +77,8 @@ class CatalogDrivenService:
     """Generic workflow executor driven by processing_catalog.json"""
     
     def __init__(self, interval: int = 60, dry_run: bool = False, auto_update: bool = True,
-                 update_interval: int = 600, git_branch: str = 'main'):
+                 update_interval: int = 600, git_branch: str = 'main', idle: bool = False,
+                 imap_session: bool = True):
         self.interval = interval
         self.dry_run = dry_run
         self.running = True
@@ -86,6 +89,14 @@ class CatalogDrivenService:
         self.git_branch = git_branch
         self.needs_restart = False
         self.update_thread = None
+        self.idle = idle
+        self.idle_thread = None
+        self.new_mail_event = threading.Event()
+        self.use_imap_session = imap_session
+        self.imap_session = None
+        self.agent_config = None
+        self.agent_components = None
+        self.last_cold_tiering = None
         
         # Load configurations
         self.app_config = self._load_application_config()
@@ -99,10 +110,13 @@ class CatalogDrivenService:
         self.failed_dir = self.storage_base / 'failed'
         self.sent_dir = self.storage_base / 'sent'
         
+        # Flat state folders or per-mail bundles (storage.layout)
+        from utils.storage_layout import create_layout
+        self.layout = create_layout(self.storage_base,
+                                    self.app_config.get('storage', {}).get('layout', 'flat'))
+        
         # Ensure directories exist
-        for directory in [self.mail_dir, self.classified_dir, self.processed_dir,
-                         self.failed_dir, self.sent_dir]:
-            directory.mkdir(parents=True, exist_ok=True)
+        self.layout.ensure_directories()
         
         # Setup signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
@@ -175,8 +189,11 @@ class CatalogDrivenService:
         print(f"Script Location:  {SCRIPT_DIR}")
         print(f"Working Dir:      {WORKING_DIR}")
         print(f"Storage Base:     {self.storage_base}")
+        print(f"Storage Layout:   {self.layout.name}")
         print(f"Interval:         {self.interval}s")
         print(f"Dry Run:          {self.dry_run}")
+        print(f"IMAP IDLE:        {self.idle}")
+        print(f"IMAP Session:     {'persistent' if self.use_imap_session else 'per cycle (subprocess)'}")
         print(f"Auto-Update:      {self.auto_update}")
         if self.auto_update:
             print(f"Update Interval:  {self.update_interval}s ({self.update_interval // 60} min)")
@@ -227,6 +244,38 @@ class CatalogDrivenService:
         self.update_thread = threading.Thread(target=update_loop, daemon=True)
         self.update_thread.start()
     
+    def _start_idle_listener(self):
+        """Start IMAP IDLE thread - wakes the daemon as soon as mail arrives"""
+        def idle_loop():
+            try:
+                from run_agent import load_config
+                from agents.imap_idle import IMAPIdleListener
+                
+                listener = IMAPIdleListener(
+                    load_config(),
+                    on_new_mail=lambda fetcher: self.new_mail_event.set(),
+                    trigger_on_connect=False
+                )
+                
+                print(f"{GREEN}[IDLE] Listening for new mail (push mode){NC}")
+                if not listener.run(should_stop=lambda: not self.running):
+                    print(f"{YELLOW}[IDLE] Server lacks IDLE - polling every {self.interval}s{NC}")
+            except Exception as e:
+                print(f"{RED}[IDLE] Listener failed: {e} - polling every {self.interval}s{NC}")
+        
+        self.idle_thread = threading.Thread(target=idle_loop, daemon=True)
+        self.idle_thread.start()
+    
+    def _wait_for_next_cycle(self):
+        """Sleep up to interval seconds, wake early on IDLE notification"""
+        elapsed = 0
+        while elapsed < self.interval and self.running:
+            if self.new_mail_event.wait(timeout=1):
+                print(f"{CYAN}[IDLE] New mail reported - starting cycle{NC}")
+                break
+            elapsed += 1
+        self.new_mail_event.clear()
+    
     def _check_and_pull_updates(self, repo_path: Path) -> bool:
         """Check for updates and pull if available"""
         try:
@@ -344,15 +393,63 @@ class CatalogDrivenService:
         
         if self.dry_run:
             print(f"  {YELLOW}[DRY RUN] Skipping mail fetch{NC}")
-            return len(list(self.mail_dir.glob('*.eml')))
+            return len(self.layout.mails('new'))
         
-        success = self._run_script('run_agent.py')
+        if self.use_imap_session:
+            self._fetch_via_session()
+        else:
+            success = self._run_script('run_agent.py')
         
-        mail_count = len(list(self.mail_dir.glob('*.eml')))
+        mail_count = len(self.layout.mails('new'))
         print(f"  {CYAN}→ {mail_count} mail(s) in queue{NC}")
         
         return mail_count
     
+    def _fetch_via_session(self):
+        """
+        Fetch over the long-lived IMAP session instead of a run_agent.py
+        subprocess - an idle cycle costs one NOOP
+        """
+        try:
+            if self.imap_session is None:
+                from run_agent import load_config, create_components, run_accounts
+                from agents.imap_session import IMAPSession
+                
+                self.agent_config = load_config()
+                if self.agent_config.get('accounts'):
+                    # Several accounts: concurrent per-cycle ingestion instead of one session
+                    run_accounts(self.agent_config)
+                    return
+                
+                self.agent_components = create_components(self.agent_config)
+                self.imap_session = IMAPSession(self.agent_config)
+            
+            if not self.imap_session.ensure_connected():
+                print(f"  {YELLOW}IMAP session unavailable (reconnect pending){NC}")
+                return
+            
+            if not self.imap_session.has_new_mail():
+                print(f"  {CYAN}No new mail (NOOP){NC}")
+                return
+            
+            from run_agent import process_mailbox
+            processed = self.imap_session.process(
+                lambda fetcher: process_mailbox(fetcher, self.agent_config, self.agent_components)
+            )
+            print(f"  {GREEN}✓ Fetched {processed} new mail(s){NC}")
+            
+        except Exception as e:
+            print(f"  {RED}✗ IMAP session error: {e}{NC}")
+    
+    def _close_imap_session(self):
+        """Log out the persistent IMAP session"""
+        if self.imap_session:
+            try:
+                self.imap_session.close()
+            except Exception as e:
+                print(f"{YELLOW}Could not close IMAP session: {e}{NC}")
+            self.imap_session = None
+    
     def classify_mails(self) -> List[Dict]:
         """
         Classify mails - HARDCODED because it's infrastructure
@@ -361,19 +458,7 @@ class CatalogDrivenService:
         print(f"\n{CYAN}[STEP 2] Classifying mails...{NC}")
         
         # Get unclassified mails
-        mail_files = list(self.mail_dir.glob('*.eml'))
-        
-        unclassified = []
-        for mail_file in mail_files:
-            mail_parts = mail_file.stem.split('_')
-            if len(mail_parts) >= 2:
-                mail_timestamp = f"{mail_parts[0]}_{mail_parts[1]}"
-            else:
-                mail_timestamp = mail_file.stem
-            
-            classification_file = self.classified_dir / f"{mail_timestamp}_identifier.json"
-            if not classification_file.exists():
-                unclassified.append(mail_file)
+        unclassified = self.layout.mails('new', without_artifact='identifier')
         
         if not unclassified:
             print(f"  {YELLOW}No unclassified mails found{NC}")
@@ -391,13 +476,15 @@ class CatalogDrivenService:
             print(f"  {RED}Classification failed{NC}")
             return []
         
-        # Load all classification JSONs
+        # Load the classification JSONs of all queued mails
         classifications = []
-        for json_file in self.classified_dir.glob('*_identifier.json'):
+        for mail_file in self.layout.mails('new', with_artifact='identifier'):
+            json_file = self.layout.artifact_path(mail_file, 'identifier')
             try:
                 with open(json_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     data['_json_path'] = json_file
+                    data['_mail_path'] = mail_file
                     classifications.append(data)
             except Exception as e:
                 print(f"  {RED}Failed to load {json_file.name}: {e}{NC}")
@@ -456,12 +543,16 @@ class CatalogDrivenService:
         
         timestamp = '_'.join(json_path.stem.split('_')[:2])
         
-        mail_files = list(self.mail_dir.glob(f"{timestamp}_*.eml"))
-        if not mail_files:
+        mail_file = classification.get('_mail_path') or self.layout.find_mail(timestamp, 'new')
+        if not mail_file or not mail_file.exists():
             print(f"  {YELLOW}No mail file found for {timestamp}{NC}")
             return False
         
-        mail_file = mail_files[0]
+        # Envelope only - the header block is enough for routing output
+        from agents.mail_parser import MailParser
+        headers = MailParser().parse_headers(mail_file)
+        if headers:
+            print(f"  {CYAN}From: {headers['from'][:60]} | Subject: {headers['subject'][:60]}{NC}")
         
         # Execute each step in sequence FROM CATALOG
         for step_name in sequence:
@@ -519,16 +610,16 @@ class CatalogDrivenService:
         # For extraction processors, use run_extract_all.py with --latest
         if processor['id'].endswith('_extraction'):
             json_type = processor['id'].replace('_extraction', '')
-            output_path = self.processed_dir / f"{timestamp}_{json_type}.json"
+            output_path = self.layout.artifact_path(mail_file, json_type)
             
-            if output_path.exists():
+            if self.layout.has_artifact(mail_file, json_type):
                 print(f"    {GREEN}✓ Already exists: {output_path.name}{NC}")
                 return True
             
             args = ['--latest']
             success = self._run_script('run_extract_all.py', args, timeout=execution.get('timeout', 300))
             
-            if output_path.exists():
+            if self.layout.has_artifact(mail_file, json_type):
                 print(f"    {GREEN}✓ Created: {output_path.name}{NC}")
                 return True
             else:
@@ -541,8 +632,8 @@ class CatalogDrivenService:
             required_jsons = ['problem', 'asset']
             
             for json_type in required_jsons:
-                json_path = self.processed_dir / f"{timestamp}_{json_type}.json"
-                if not json_path.exists():
+                json_path = self.layout.artifact_path(mail_file, json_type)
+                if not self.layout.has_artifact(mail_file, json_type):
                     print(f"    {RED}✗ Missing prerequisite: {json_path.name}{NC}")
                     return False
             
@@ -569,12 +660,8 @@ class CatalogDrivenService:
     
     def _auto_archive(self, mail_file: Path) -> bool:
         """Built-in action: move mail to archive"""
-        archive_dir = self.storage_base / 'archived'
-        archive_dir.mkdir(parents=True, exist_ok=True)
-        
         try:
-            dest = archive_dir / mail_file.name
-            mail_file.rename(dest)
+            self.layout.set_state(mail_file, 'archived')
             print(f"    {GREEN}✓ Archived: {mail_file.name}{NC}")
             return True
         except Exception as e:
@@ -584,9 +671,9 @@ class CatalogDrivenService:
     def _move_to_sent(self, mail_file: Path):
         """Move processed mail to sent directory"""
         try:
-            dest = self.sent_dir / mail_file.name
-            if mail_file.exists():
-                mail_file.rename(dest)
+            # Only if no script has moved it on already (flat: file gone, bundle: state changed)
+            if mail_file.exists() and self.layout.state_of(mail_file) == 'new':
+                self.layout.set_state(mail_file, 'sent')
                 print(f"  {GREEN}→ Moved to sent: {mail_file.name}{NC}")
         except Exception as e:
             print(f"  {YELLOW}Could not move to sent: {e}{NC}")
@@ -594,13 +681,36 @@ class CatalogDrivenService:
     def _handle_failure(self, mail_file: Path):
         """Move failed mail to failed directory"""
         try:
-            dest = self.failed_dir / mail_file.name
-            if mail_file.exists():
-                mail_file.rename(dest)
+            if mail_file.exists() and self.layout.state_of(mail_file) == 'new':
+                self.layout.set_state(mail_file, 'failed')
                 print(f"  {RED}→ Moved to failed: {mail_file.name}{NC}")
         except Exception as e:
             print(f"  {RED}Could not move to failed: {e}{NC}")
     
+    def _tier_cold_storage(self):
+        """Pack old sent/archived/failed mails into cold storage - at most once a day"""
+        from utils.cold_storage import ColdStore, tier_config
+        
+        settings = tier_config(self.app_config.get('storage', {}))
+        if self.dry_run or not settings['enabled']:
+            return
+        if self.last_cold_tiering and time.time() - self.last_cold_tiering < 86400:
+            return
+        self.last_cold_tiering = time.time()
+        
+        print(f"\n{CYAN}[COLD STORAGE] Packing mails older than {settings['after_days']} days...{NC}")
+        try:
+            store = ColdStore(self.storage_base)
+            stats = store.tier(self.layout, settings['after_days'], settings['codec'])
+            store.close()
+            if stats['mails']:
+                print(f"  {GREEN}✓ Packed {stats['mails']} mail(s): "
+                      f"{stats['size'] // 1024} KB -> {stats['packed'] // 1024} KB{NC}")
+            else:
+                print(f"  {CYAN}Nothing to pack{NC}")
+        except Exception as e:
+            print(f"  {RED}✗ Cold storage tiering failed: {e}{NC}")
+    
     def process_cycle(self) -> Dict[str, int]:
         """Execute one complete processing cycle"""
         self.cycle_count += 1
@@ -677,24 +787,29 @@ class CatalogDrivenService:
     def run_once(self):
         """Run one processing cycle and exit"""
         self.process_cycle()
+        self._close_imap_session()
         print(f"{GREEN}✓ Single cycle completed{NC}\n")
     
     def run_daemon(self):
         """Run continuously in daemon mode"""
         print(f"{GREEN}Starting daemon mode (press Ctrl+C to stop)...{NC}\n")
         
+        if self.idle and not self.dry_run:
+            self._start_idle_listener()
+        
         while self.running:
             try:
                 self.process_cycle()
+                self._tier_cold_storage()
                 
                 if self.running:
-                    print(f"{CYAN}Waiting {self.interval} seconds before next cycle...{NC}")
+                    if self.idle:
+                        print(f"{CYAN}Waiting for new mail (max {self.interval} seconds)...{NC}")
+                    else:
+                        print(f"{CYAN}Waiting {self.interval} seconds before next cycle...{NC}")
                     print(f"{YELLOW}Press Ctrl+C to stop{NC}\n")
                     
-                    elapsed = 0
-                    while elapsed < self.interval and self.running:
-                        time.sleep(1)
-                        elapsed += 1
+                    self._wait_for_next_cycle()
                     
             except KeyboardInterrupt:
                 print(f"\n{YELLOW}Keyboard interrupt received{NC}")
@@ -712,6 +827,7 @@ class CatalogDrivenService:
                         time.sleep(1)
                         elapsed += 1
         
+        self._close_imap_session()
         print(f"\n{GREEN}Service daemon stopped gracefully{NC}\n")
 
 
@@ -731,6 +847,10 @@ def main():
                        help='Git update check interval in seconds (default: 600 = 10 min)')
     parser.add_argument('--git-branch', default='main',
                        help='Git branch to track for updates (default: main)')
+    parser.add_argument('--idle', action='store_true',
+                       help='Start cycles on IMAP IDLE push instead of waiting the full interval')
+    parser.add_argument('--no-imap-session', action='store_true',
+                       help='Fetch via run_agent.py subprocess (new IMAP login every cycle)')
     
     args = parser.parse_args()
     
@@ -740,7 +860,9 @@ def main():
             dry_run=args.dry_run,
             auto_update=not args.no_auto_update,
             update_interval=args.update_interval,
-            git_branch=args.git_branch
+            git_branch=args.git_branch,
+            idle=args.idle,
+            imap_session=not args.no_imap_session
         )
         
         if args.daemon:
@@ -19,9 +19,11 @@ class AttachmentHandler:
         self.file_handler = file_handler
         self.max_size_bytes = max_size_mb * 1024 * 1024
     
-    def extract_attachments(self, attachments: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    def extract_attachments(self, attachments: List[Dict[str, Any]], mail_id: str = None,
+                            mail_file: str = None) -> List[Dict[str, str]]:
         """
-        Extract and save all attachments
+        Extract and save all attachments to the blob store
+        With mail_id, a manifest listing the mail's attachments is written
         Returns list of saved attachment metadata
         """
         saved = []
@@ -36,35 +38,72 @@ class AttachmentHandler:
                     )
                     continue
                 
-                # Extract content
-                content = att['part'].get_payload(decode=True)
-                if not content:
-                    logger.warning(f"Empty attachment: {att['filename']}")
-                    continue
-                
                 # Categorize
                 category = self.file_handler.categorize_attachment(
                     att['filename'], 
                     att['content_type']
                 )
                 
-                # Save
-                filepath = self.file_handler.save_attachment(
-                    att['filename'], 
-                    content, 
-                    category
-                )
+                payload = att['payload'] if 'payload' in att else None
+                spill_path = payload.path if payload is not None else None
+                if spill_path is not None:
+                    # Spilled by the streaming parse: decoded and hashed already, move the file
+                    if not spill_path.stat().st_size:
+                        logger.warning(f"Empty attachment: {att['filename']}")
+                        continue
+                    filepath = self.file_handler.save_attachment_file(
+                        att['filename'],
+                        spill_path,
+                        payload.sha256
+                    )
+                elif payload is not None:
+                    # Decode chunk by chunk from the raw mail into the blob store
+                    filepath = self.file_handler.save_attachment_stream(
+                        att['filename'],
+                        payload.iter_decoded()
+                    )
+                    if filepath is None:
+                        logger.warning(f"Empty attachment: {att['filename']}")
+                        continue
+                else:
+                    content = att['part'].get_payload(decode=True)
+                    if not content:
+                        logger.warning(f"Empty attachment: {att['filename']}")
+                        continue
+                    
+                    # Save
+                    filepath = self.file_handler.save_attachment(
+                        att['filename'], 
+                        content
+                    )
                 
                 saved.append({
                     'original_name': att['filename'],
                     'saved_path': str(filepath),
                     'category': category,
-                    'size': att['size'],
-                    'mime_type': att['content_type']
+                    'size': filepath.stat().st_size,
+                    'mime_type': att['content_type'],
+                    'sha256': filepath.name
                 })
                 
             except Exception as e:
                 logger.error(f"Failed to extract attachment '{att.get('filename', 'unknown')}': {e}")
         
         logger.info(f"Extracted {len(saved)}/{len(attachments)} attachments")
+        
+        if mail_id and saved:
+            self.file_handler.save_attachment_manifest(
+                mail_id,
+                [
+                    {
+                        'filename': entry['original_name'],
+                        'content_type': entry['mime_type'],
+                        'category': entry['category'],
+                        'size': entry['size'],
+                        'sha256': entry['sha256']
+                    }
+                    for entry in saved
+                ],
+                mail_file
+            )
         return saved
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Body Reducer
+Strips quoted reply history, signatures, disclaimers and forwarded-header
+blocks (German/English) from a mail body before it goes into LLM prompts
+"""
+import re
+from typing import Dict, List, Any, Tuple
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# === Reply history (everything from here on is the quoted thread) ===
+_ORIGINAL_MESSAGE_RE = re.compile(
+    r'^\s*-{2,}\s*(original message|ursprüngliche nachricht|originalnachricht)\s*-{2,}\s*$', re.I)
+_REPLY_HEADER_RES = [
+    re.compile(r'^\s*on\s.{4,250}\swrote:\s*$', re.I),                 # On Mon, ... Jane <j@x> wrote:
+    re.compile(r'^\s*am\s.{4,250}\sschrieb\s.{1,250}:\s*$', re.I),     # Am 01.02.2025 um 10:00 schrieb Max:
+    re.compile(r'^\s*.{1,150}\sschrieb am\s.{4,100}:\s*$', re.I),      # Max Muster schrieb am 01.02.2025:
+]
+# Outlook header block: "From: / Sent: / To: / Subject:" or "Von: / Gesendet: / An: / Betreff:"
+_HEADER_FROM_RE = re.compile(r'^\s*\**(from|von)\s*:\**\s*\S', re.I)
+_HEADER_LINE_RE = re.compile(
+    r'^\s*\**(from|von|sent|gesendet|date|datum|to|an|cc|subject|betreff)\s*:\**(\s|$)', re.I)
+
+# === Forwarded messages (the content is kept, only the header block goes) ===
+_FORWARD_RE = re.compile(
+    r'^\s*(-{2,}\s*(forwarded message|weitergeleitete nachricht)\s*-{2,}'
+    r'|(begin forwarded message|anfang der weitergeleiteten nachricht):)\s*$', re.I)
+
+_QUOTE_LINE_RE = re.compile(r'^\s*>')
+_SIGNATURE_DELIMITER_RE = re.compile(r'^--\s?$')
+_CLOSING_RE = re.compile(
+    r'^\s*(mit )?(freundlichen|besten|viele|liebe|herzliche|beste|schöne|sonnige)?\s*'
+    r'(grüßen|grüße|gruß|grüssen|grüsse|gruss)\s*[,!.]?\s*$'
+    r'|^\s*(mfg|vg|lg|bg)\s*[,!.]?\s*$'
+    r'|^\s*((best|kind|warm|many thanks and)\s+)?regards\s*[,!.]?\s*$'
+    r'|^\s*(best|cheers|thanks|thank you|sincerely|yours sincerely)\s*[,!.]?\s*$',
+    re.I)
+# Log lines, stack frames and error codes are content, never signature
+_LOG_LINE_RE = re.compile(
+    r'^\s*(at\s+(line\s+\d|[\w$.<>]+\()'                       # at line 5 / at com.x.Y.z(
+    r'|file ".+", line \d+'                                      # Python traceback
+    r'|traceback|caused by|\[?(trace|debug|info|warn|warning|error|fatal)\]?\s*:'
+    r'|\S*(error|exception)\b'
+    r'|\d{4}-\d{2}-\d{2}[ t]\d{2}:\d{2})', re.I)
+_ERROR_CODE_RE = re.compile(r'\b[A-Z]{2,5}-\d{3,}\b')  # ORA-01555, HTTP-500
+# "P.S." / "PS:" / "Nachtrag:" - content written below the sign-off
+_POSTSCRIPT_RE = re.compile(r'^\s*(p\.?\s?s\.?|nachtrag)\s*[:.]?(\s|$)', re.I)
+_GREETING_RE = re.compile(
+    r'^\s*(hallo|hi|hey|hello|dear|moin|servus|guten (morgen|tag|abend)|'
+    r'sehr geehrte[rs]?|liebe[rs]?)\b.{0,80}$', re.I)
+_DISCLAIMER_RE = re.compile(
+    r'confidential|vertraulich|intended recipient|beabsichtigte[rn]? empfänger|'
+    r'disclaimer|haftungsausschluss|amtsgericht|handelsregister|\bHRB\b|'
+    r'sitz der gesellschaft|geschäftsführ|ust-?id|registergericht|'
+    r'consider the environment|denken sie an die umwelt',
+    re.I)
+# Typical opening of a legal notice paragraph
+_LEGAL_SHAPE_RE = re.compile(
+    r'^\s*(disclaimer|haftungsausschluss|rechtlicher hinweis|legal notice|'
+    r'diese (e-?mail|nachricht)|this (e-?mail|message)|the information (contained|in this))',
+    re.I)
+
+# Signature blocks longer than this are probably content
+_MAX_SIGNATURE_LINES = 25
+# A closing not preceded by a blank line must be this close to the end
+_CLOSING_TAIL_LINES = 3
+# Longer lines are prose, not contact details
+_MAX_SIGNATURE_LINE_CHARS = 80
+# One legal keyword is only enough in a paragraph of notice length
+_MIN_DISCLAIMER_CHARS = 200
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (4 characters per token)"""
+    return (len(text) + 3) // 4
+
+class BodyReducer:
+    def reduce(self, text: str) -> Dict[str, Any]:
+        """
+        Reduce a plain-text mail body
+
+        Returns:
+            {
+                'text': reduced body,
+                'removed': [{'start', 'end', 'kind'}, ...]  (offsets into the original),
+                'tokens_before', 'tokens_after', 'tokens_saved'
+            }
+            kind is one of quote, forward_header, signature, disclaimer
+        """
+        text = text or ''
+        lines = text.splitlines(keepends=True)
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line))
+
+        # One label per line: None = keep
+        removed = [None] * len(lines)
+
+        self._mark_forward_headers(lines, removed)
+        head_end = self._mark_reply_history(lines, removed)
+        self._mark_quote_lines(lines, removed)
+        trailer_start = self._mark_signature(lines, removed, head_end)
+        if trailer_start is not None:
+            self._mark_disclaimers(lines, removed, trailer_start)
+
+        spans = self._spans(removed, offsets)
+        reduced = ''.join(line for line, label in zip(lines, removed) if label is None)
+        reduced = re.sub(r'\n{3,}', '\n\n', reduced).strip()
+
+        if not reduced and text.strip():
+            # Never hand an empty prompt to the LLM
+            return self._unchanged(text)
+
+        result = {
+            'text': reduced,
+            'removed': spans,
+            'tokens_before': estimate_tokens(text),
+            'tokens_after': estimate_tokens(reduced)
+        }
+        result['tokens_saved'] = result['tokens_before'] - result['tokens_after']
+
+        if spans:
+            logger.debug(f"Body reduced: {result['tokens_before']} -> {result['tokens_after']} tokens "
+                        f"({', '.join(sorted({s['kind'] for s in spans}))})")
+        return result
+
+    @staticmethod
+    def _unchanged(text: str) -> Dict[str, Any]:
+        tokens = estimate_tokens(text)
+        return {'text': text.strip(), 'removed': [], 'tokens_before': tokens,
+                'tokens_after': tokens, 'tokens_saved': 0}
+
+    @staticmethod
+    def _has_content(lines: List[str], removed: List, end: int) -> bool:
+        return any(line.strip() and removed[i] is None for i, line in enumerate(lines[:end]))
+
+    def _mark_reply_history(self, lines: List[str], removed: List) -> int:
+        """
+        Cut the quoted thread below the newest message
+
+        Returns:
+            Index of the first line after the newest message (len(lines) if none)
+        """
+        for i, line in enumerate(lines):
+            if removed[i] is not None:
+                continue
+            start, header_end = self._reply_start(lines, i)
+            if start is None:
+                continue
+
+            if self._has_content(lines, removed, start):
+                for j in range(start, len(lines)):
+                    removed[j] = 'quote'
+                return start
+
+            # Nothing above it: the mail is effectively a forward - only drop the header
+            for j in range(start, header_end):
+                removed[j] = 'forward_header'
+
+        return len(lines)
+
+    @staticmethod
+    def _reply_start(lines: List[str], i: int) -> Tuple[Any, int]:
+        """(start, header_end) if a reply-history block begins at line i"""
+        line = lines[i].strip()
+        if not line:
+            return None, i
+
+        if _ORIGINAL_MESSAGE_RE.match(line):
+            end = i + 1
+            while end < len(lines) and _HEADER_LINE_RE.match(lines[end]):
+                end += 1
+            return i, end
+
+        # Reply headers are sometimes wrapped onto a second line
+        joined = line + (' ' + lines[i + 1].strip() if i + 1 < len(lines) else '')
+        for regex in _REPLY_HEADER_RES:
+            if regex.match(line):
+                return i, i + 1
+            if len(line) < 250 and regex.match(joined):
+                return i, i + 2
+
+        if _HEADER_FROM_RE.match(line):
+            end = i + 1
+            while end < len(lines) and end - i < 8 and _HEADER_LINE_RE.match(lines[end]):
+                end += 1
+            if end - i >= 3:
+                return i, end
+
+        return None, i
+
+    @staticmethod
+    def _mark_forward_headers(lines: List[str], removed: List):
+        """Forward marker line plus the header lines directly below it"""
+        for i, line in enumerate(lines):
+            if not _FORWARD_RE.match(line):
+                continue
+
+            removed[i] = 'forward_header'
+            j = i + 1
+            while j < len(lines) and not lines[j].strip():
+                j += 1
+            while j < len(lines) and (_HEADER_LINE_RE.match(lines[j]) or
+                                      (lines[j].startswith((' ', '\t')) and lines[j].strip())):
+                removed[j] = 'forward_header'
+                j += 1
+
+    def _mark_quote_lines(self, lines: List[str], removed: List):
+        """Inline '>' quote blocks (interleaved replies)"""
+        candidates = [i for i, line in enumerate(lines)
+                      if removed[i] is None and _QUOTE_LINE_RE.match(line)]
+        if not candidates:
+            return
+
+        # Keep them if the mail consists of nothing else
+        candidate_set = set(candidates)
+        if not any(line.strip() and removed[i] is None and i not in candidate_set
+                   for i, line in enumerate(lines)):
+            return
+
+        for i in candidates:
+            removed[i] = 'quote'
+
+    def _mark_signature(self, lines: List[str], removed: List, head_end: int):
+        """
+        '-- ' delimiter, or closing phrase + name followed by a short block
+
+        Returns:
+            Index of the delimiter / closing line (start of the trailing
+            block), None if no sign-off was found
+        """
+        kept = [i for i in range(head_end) if removed[i] is None]
+        if not kept:
+            return None
+
+        for i in kept:
+            if _SIGNATURE_DELIMITER_RE.match(lines[i].rstrip('\r\n')):
+                block = [j for j in kept if j >= i]
+                if len(block) <= _MAX_SIGNATURE_LINES:
+                    for j in block:
+                        removed[j] = 'signature'
+                    return i
+
+        non_empty = [i for i in kept if lines[i].strip()]
+        # Closing phrase among the last lines of the newest message
+        for position, i in enumerate(non_empty):
+            if len(non_empty) - position > _MAX_SIGNATURE_LINES:
+                continue
+            if not _CLOSING_RE.match(lines[i]):
+                continue
+            # "Thanks" in the middle of the text: only a sign-off if it starts a
+            # paragraph or is one of the last lines, and no content follows directly
+            starts_paragraph = i == kept[0] or not lines[i - 1].strip()
+            if not starts_paragraph and len(non_empty) - position > _CLOSING_TAIL_LINES:
+                continue
+            if position + 1 < len(non_empty) and self._is_content_line(lines[non_empty[position + 1]]):
+                continue
+
+            # Keep the closing and the name line below it, then drop signature-like
+            # paragraphs up to the first one that is content again (P.S., prose)
+            rest = non_empty[position + 2:]
+            for paragraph in self._paragraphs(lines, removed, rest[0] if rest else head_end, head_end):
+                if not all(self._is_signature_line(lines[j]) for j in paragraph):
+                    break
+                for j in paragraph:
+                    removed[j] = 'signature'
+            return i
+
+        return None
+
+    @staticmethod
+    def _is_content_line(line: str) -> bool:
+        """Log line, stack frame or error code"""
+        return bool(_LOG_LINE_RE.match(line) or _ERROR_CODE_RE.search(line))
+
+    def _is_signature_line(self, line: str) -> bool:
+        """Short name/contact line - not a postscript, a sentence or a log line"""
+        stripped = line.strip()
+        if _POSTSCRIPT_RE.match(stripped) or len(stripped) > _MAX_SIGNATURE_LINE_CHARS:
+            return False
+        if self._is_content_line(stripped):
+            return False
+        return not (len(stripped.split()) >= 8 and stripped[-1] in '.!?:')
+
+    @staticmethod
+    def _paragraphs(lines: List[str], removed: List, start: int, end: int) -> List[List[int]]:
+        """Kept non-empty lines in [start, end), grouped by blank lines"""
+        paragraphs, paragraph = [], []
+        for i in range(start, end):
+            if removed[i] is not None:
+                continue
+            if lines[i].strip():
+                paragraph.append(i)
+            elif paragraph:
+                paragraphs.append(paragraph)
+                paragraph = []
+        if paragraph:
+            paragraphs.append(paragraph)
+        return paragraphs
+
+    def _mark_disclaimers(self, lines: List[str], removed: List, trailer_start: int):
+        """
+        Legal/confidentiality paragraphs in the trailing block below the sign-off
+
+        A paragraph needs two different legal markers, or one marker and the
+        length or opening of a legal notice. The first paragraph with content
+        (after the greeting) is never removed.
+        """
+        protected = None
+        for paragraph in self._paragraphs(lines, removed, 0, len(lines)):
+            if len(paragraph) == 1 and _GREETING_RE.match(lines[paragraph[0]]):
+                continue
+            protected = paragraph[0]
+            break
+
+        for paragraph in self._paragraphs(lines, removed, trailer_start + 1, len(lines)):
+            if paragraph[0] == protected:
+                continue
+            text = ' '.join(lines[i].strip() for i in paragraph)
+            markers = {match.group(0).lower() for match in _DISCLAIMER_RE.finditer(text)}
+            if len(markers) >= 2 or (markers and (len(text) >= _MIN_DISCLAIMER_CHARS or
+                                                  _LEGAL_SHAPE_RE.match(text))):
+                for i in paragraph:
+                    removed[i] = 'disclaimer'
+
+    @staticmethod
+    def _spans(removed: List, offsets: List[int]) -> List[Dict[str, Any]]:
+        """Merge consecutive removed lines of one kind into offset spans"""
+        spans = []
+        for i, kind in enumerate(removed):
+            if kind is None:
+                continue
+            if spans and spans[-1]['kind'] == kind and spans[-1]['end'] == offsets[i]:
+                spans[-1]['end'] = offsets[i + 1]
+            else:
+                spans.append({'start': offsets[i], 'end': offsets[i + 1], 'kind': kind})
+        return spans
+
+def reduce_body(text: str) -> Dict[str, Any]:
+    """Convenience wrapper around BodyReducer().reduce()"""
+    return BodyReducer().reduce(text)
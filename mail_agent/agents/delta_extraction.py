@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Delta Extraction
+Incremental extraction for replies in a known thread: the LLM gets only the
+new (unquoted) text and a compact summary of the thread's existing
+problem/solution/asset record, answers with a patch, and the patch is
+merged into a copy of that record
+"""
+import copy
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Identity/bookkeeping fields: not shown to the LLM, never patched
+# (stamp_identity() sets them for the mail the merged record is saved for)
+PROTECTED_KEYS = ('schema_version', 'type', 'id', 'mail_id', 'timestamp',
+                  'created_at', 'problem_ids', 'asset_id')
+
+# Long free text is cut in the summary - the LLM only needs the gist
+SUMMARY_TEXT_LIMIT = 300
+
+def _compact(value: Any, text_limit: int) -> Any:
+    """Drop empty values and shorten long strings"""
+    if isinstance(value, dict):
+        compact = {}
+        for key, item in value.items():
+            item = _compact(item, text_limit)
+            if item not in (None, '', [], {}):
+                compact[key] = item
+        return compact
+    if isinstance(value, list):
+        return [item for item in (_compact(item, text_limit) for item in value)
+                if item not in (None, '', [], {})]
+    if isinstance(value, str) and len(value) > text_limit:
+        return value[:text_limit].rstrip() + ' …'
+    return value
+
+def summarize_record(record: Dict[str, Any], text_limit: int = SUMMARY_TEXT_LIMIT) -> str:
+    """One-line JSON summary of an existing record (no ids, no empty fields)"""
+    visible = {key: value for key, value in record.items() if key not in PROTECTED_KEYS}
+    return json.dumps(_compact(visible, text_limit), ensure_ascii=False, separators=(',', ':'))
+
+def build_delta_input(summary: str, new_text: str) -> str:
+    """Mail body for the delta prompt: existing record + new content"""
+    return (f"BESTEHENDER DATENSATZ (Zusammenfassung):\n{summary}\n\n"
+            f"NEUE NACHRICHT IM THREAD (ohne Zitate):\n{new_text}")
+
+def parse_patch(text: str) -> Optional[Dict[str, Any]]:
+    """JSON object from an LLM answer (tolerates surrounding text), None if invalid"""
+    if not text:
+        return None
+
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        return None
+
+    try:
+        patch = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        logger.warning(f"Invalid patch JSON: {e}")
+        return None
+
+    if not isinstance(patch, dict):
+        return None
+    # The prompt asks for {"patch": {...}}, bare objects are accepted too
+    if isinstance(patch.get('patch'), dict):
+        patch = patch['patch']
+    return patch
+
+def merge_patch(record: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply a patch to a copy of the record
+
+    Like a JSON Merge Patch (RFC 7386), except:
+      - null sets the field to null instead of deleting it (schema keeps all keys)
+      - lists of strings are extended with the new entries (no duplicates),
+        lists of objects (e.g. steps) are replaced as a whole
+      - PROTECTED_KEYS on the top level are left untouched
+    """
+    merged = copy.deepcopy(record)
+    for key, value in patch.items():
+        if key in PROTECTED_KEYS:
+            continue
+        merged[key] = _merge_value(merged.get(key), value)
+    return merged
+
+def _merge_value(current: Any, value: Any) -> Any:
+    if isinstance(value, dict) and isinstance(current, dict):
+        merged = dict(current)
+        for key, item in value.items():
+            merged[key] = _merge_value(current.get(key), item)
+        return merged
+
+    if isinstance(value, list) and isinstance(current, list) and _is_flat(current) and _is_flat(value):
+        return current + [item for item in value if item not in current]
+
+    return copy.deepcopy(value)
+
+def _is_flat(items: List[Any]) -> bool:
+    return all(not isinstance(item, (dict, list)) for item in items)
+
+def _mail_id(mail_path: Path) -> Optional[str]:
+    """Hex UUID of the mail file name, same rule as agents/llm_request.extract_mail_id"""
+    parts = Path(mail_path).stem.split('@')[0].split('_')
+    candidate = (parts[-1] if len(parts) >= 3 else parts[0]).replace('-', '').lower()
+    if len(candidate) >= 32 and all(c in '0123456789abcdef' for c in candidate[:32]):
+        return candidate[:32]
+    return None
+
+def _mail_time(mail_path: Path) -> Optional[str]:
+    """ISO8601 UTC time from the YYYYMMDD_HHMMSS prefix (local time) of the mail file"""
+    parts = Path(mail_path).stem.split('_')
+    try:
+        received = datetime.strptime(f"{parts[0]}_{parts[1]}", '%Y%m%d_%H%M%S')
+    except (IndexError, ValueError):
+        return None
+    return received.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def stamp_identity(record: Dict[str, Any], mail_path: Path) -> Dict[str, Any]:
+    """
+    Replace the identity fields taken over from the base record with the
+    ones of the current mail (what a full extraction would have produced):
+    mail_id, prob_/sol_ id, the own problem in problem_ids and the timestamp.
+    asset_id references an asset, not a mail - it is kept.
+    """
+    old_mail_id = record.get('mail_id')
+    mail_id = _mail_id(mail_path)
+    mail_time = _mail_time(mail_path)
+    record_type = record.get('type')
+
+    if mail_id:
+        if 'mail_id' in record:
+            record['mail_id'] = mail_id
+        if record_type == 'n2k_problem':
+            old_mail_id = old_mail_id or str(record.get('id', '')).replace('prob_', '', 1)
+            record['id'] = f"prob_{mail_id}"
+        elif record_type == 'n2k_solution':
+            old_mail_id = old_mail_id or str(record.get('id', '')).replace('sol_', '', 1)
+            record['id'] = f"sol_{mail_id}"
+        if isinstance(record.get('problem_ids'), list):
+            own = f"prob_{old_mail_id}" if old_mail_id else None
+            problem_ids = [f"prob_{mail_id}" if pid == own else pid for pid in record['problem_ids']]
+            record['problem_ids'] = list(dict.fromkeys(problem_ids))
+
+    if mail_time:
+        if 'timestamp' in record:
+            record['timestamp'] = mail_time
+        # Assets keep created_at of the first mention
+        if 'updated_at' in record:
+            record['updated_at'] = mail_time
+    return record
+
+def previous_record(thread_index, message_id: str, json_type: str,
+                    file_handler=None) -> Optional[Path]:
+    """
+    Newest existing record of this type from an earlier message of the thread
+
+    Args:
+        thread_index: utils.thread_index.ThreadIndex
+        file_handler: utils.file_handler.FileHandler - also finds records
+                      packed into cold storage
+    """
+    row = thread_index.get(message_id)
+    if not row:
+        return None
+
+    for artifact in reversed(thread_index.thread_artifacts(row['thread_id'], json_type)):
+        # Only records of mails before this one (re-runs of older mails stay full)
+        if artifact['message_id'] == message_id or (row['date'] and (artifact['date'] or '') > row['date']):
+            continue
+        path = Path(artifact['path'])
+        if path.exists() or (file_handler and file_handler.stored_file_exists(path)):
+            return path
+    return None
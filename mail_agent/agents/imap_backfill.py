@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Parallel IMAP Backfill
+Initial sync of large mailboxes: UID space split into ranges, fetched over
+several throttled connections, progress checkpointed per range
+"""
+import imaplib
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+from agents.imap_fetcher import IMAPFetcher
+
+logger = get_logger()
+
+# handler(fetcher, uid_list, checkpoint, on_failure) -> processed count
+BackfillHandler = Callable[[IMAPFetcher, List[bytes], Callable[[str], None], Callable[[str], None]], int]
+
+class IMAPBackfill:
+    def __init__(self, config: dict, handler: BackfillHandler,
+                 connections: int = None, range_size: int = None, dry_run: bool = False):
+        """
+        Args:
+            config: Mail agent config (imap.sync_mode must be 'uid')
+            handler: Processes one list of UIDs over the given fetcher and
+                     calls checkpoint(uid) for every processed message,
+                     on_failure(uid) for every failed one
+            connections: Parallel IMAP connections (imap.backfill_connections)
+            range_size: UIDs per range (imap.backfill_range_size)
+            dry_run: Do not persist range progress
+        """
+        self.config = config
+        self.handler = handler
+        self.dry_run = dry_run
+
+        imap_config = config['imap']
+        self.connections = max(1, int(connections or imap_config.get('backfill_connections', 4)))
+        self.range_size = max(1, int(range_size or imap_config.get('backfill_range_size', 1000)))
+        # Throttle: minimum gap between two logins, so the server's
+        # per-user connection limit / rate limit is not tripped
+        self.connect_interval = float(imap_config.get('backfill_connect_interval', 2.0))
+        self.reconnect_delay = int(imap_config.get('reconnect_delay', 30))
+        self.max_attempts = 3
+
+        self.uidvalidity = None
+        self.sync_state = None
+        self.base_key = None
+        self._connect_lock = threading.Lock()
+        self._last_connect = 0.0
+        self._stats_lock = threading.Lock()
+        self.processed = 0
+        self.ranges_done = 0
+        self.ranges_total = 0
+
+    def run(self) -> Optional[int]:
+        """
+        Backfill everything up to the current highest UID
+
+        Returns:
+            Number of processed messages, None if the mailbox was not reachable
+        """
+        probe = self._open()
+        if probe is None:
+            return None
+
+        if not probe.use_uid:
+            logger.error("Backfill needs imap.sync_mode 'uid'")
+            probe.disconnect()
+            return None
+
+        try:
+            highest = probe.highest_uid()
+        finally:
+            probe.disconnect()
+
+        # Range bounds are aligned to range_size, so they are identical on every run
+        ranges = [(first, min(first + self.range_size - 1, highest))
+                  for first in range(1, highest + 1, self.range_size)]
+        pending = queue.Queue()
+        for first, last in ranges:
+            if not self._range_complete(first, last):
+                pending.put((first, last))
+
+        self.ranges_total = len(ranges)
+        self.ranges_done = self.ranges_total - pending.qsize()
+        logger.info(f"Backfill of '{probe.mailbox}' up to UID {highest}: "
+                    f"{pending.qsize()}/{self.ranges_total} range(s) of {self.range_size} UIDs open, "
+                    f"{self.connections} connection(s)")
+
+        workers = [
+            threading.Thread(target=self._worker, args=(pending,), name=f'imap-backfill-{i + 1}')
+            for i in range(min(self.connections, pending.qsize()))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self.ranges_done == self.ranges_total:
+            logger.info(f"✓ Backfill complete ({self.processed} message(s))")
+            if not self.dry_run:
+                # Live sync continues above the backfilled UIDs
+                self.sync_state.advance(self.base_key, self.uidvalidity, highest)
+        else:
+            logger.warning(f"Backfill incomplete: {self.ranges_done}/{self.ranges_total} range(s) - "
+                           f"run again to resume")
+
+        return self.processed
+
+    def _worker(self, pending: queue.Queue):
+        """Take ranges from the queue until it is empty, one connection per worker"""
+        fetcher = None
+
+        while True:
+            try:
+                first, last = pending.get_nowait()
+            except queue.Empty:
+                break
+
+            for attempt in range(1, self.max_attempts + 1):
+                if fetcher is None:
+                    fetcher = self._open()
+                    if fetcher is None:
+                        time.sleep(self.reconnect_delay)
+                        continue
+
+                try:
+                    count, complete = self._backfill_range(fetcher, first, last)
+                except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+                    logger.warning(f"Range {first}-{last} interrupted ({e}), "
+                                   f"attempt {attempt}/{self.max_attempts}")
+                    self._drop(fetcher)
+                    fetcher = None
+                    continue
+
+                with self._stats_lock:
+                    self.processed += count
+                    if complete:
+                        self.ranges_done += 1
+                        logger.info(f"Range {first}-{last} done: {count} message(s) "
+                                    f"[{self.ranges_done}/{self.ranges_total}]")
+                    else:
+                        logger.warning(f"Range {first}-{last}: {count} message(s), failed "
+                                       f"message(s) left - retried on the next run")
+                break
+            else:
+                logger.error(f"Giving up on range {first}-{last} for this run")
+
+        if fetcher is not None:
+            fetcher.disconnect()
+
+    def _backfill_range(self, fetcher: IMAPFetcher, first: int, last: int) -> Tuple[int, bool]:
+        """
+        Process the open part of one range plus its earlier failures
+
+        Returns:
+            (processed count, True if the range is complete - no failed
+            messages left to retry)
+        """
+        key = self._range_key(first)
+        state = self.sync_state.get(key)
+        if state.get('uidvalidity') != self.uidvalidity:
+            state = {}
+            if not self.dry_run:
+                # Failures are recorded in the range entry, so it has to exist
+                self.sync_state.reset(key, self.uidvalidity)
+        done = state.get('last_uid', 0)
+
+        start = max(first, done + 1)
+        uid_list = fetcher.search_failed_uids(key, state.get('failed_uids', {}), done)
+        if start <= last:
+            uid_list += fetcher.search_uid_range(start, last)
+
+        def checkpoint(message_id: str):
+            self.sync_state.advance(key, self.uidvalidity, int(message_id))
+
+        def on_failure(message_id: str):
+            fetcher.mark_failed(message_id, key)
+
+        count = self.handler(fetcher, uid_list, checkpoint, on_failure) if uid_list else 0
+
+        # Fetch errors are logged, not raised - make sure the connection survived
+        status, _ = fetcher.connection.noop()
+        if status != 'OK':
+            raise fetcher.connection.abort(f"NOOP failed after range {first}-{last}")
+        if fetcher.fetch_incomplete:
+            # Retry resumes at the range checkpoint, which stopped before the gap
+            raise fetcher.connection.abort(f"incomplete fetch in range {first}-{last}")
+
+        if self.dry_run:
+            return count, True
+        # Also covers UIDs that were never assigned or already expunged;
+        # failed UIDs stay in the range entry and keep it open
+        self.sync_state.advance(key, self.uidvalidity, last)
+        return count, self._range_complete(first, last)
+
+    def _range_complete(self, first: int, last: int) -> bool:
+        state = self.sync_state.get(self._range_key(first))
+        return (state.get('uidvalidity') == self.uidvalidity and state.get('last_uid', 0) >= last
+                and not state.get('failed_uids'))
+
+    def _range_key(self, first: int) -> str:
+        return f"{self.base_key}#backfill/{self.range_size}/{first}"
+
+    def _open(self) -> Optional[IMAPFetcher]:
+        """Throttled connect + select; all fetchers share one state store"""
+        with self._connect_lock:
+            wait = self._last_connect + self.connect_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_connect = time.monotonic()
+
+        fetcher = IMAPFetcher(self.config)
+        if not fetcher.connect():
+            return None
+        if not fetcher.select_mailbox():
+            fetcher.disconnect()
+            return None
+
+        if self.sync_state is None:
+            # First connection defines the mailbox generation for this run
+            self.sync_state = fetcher.sync_state
+            self.uidvalidity = fetcher.uidvalidity
+            self.base_key = fetcher._state_key()
+        elif fetcher.uidvalidity != self.uidvalidity:
+            logger.error(f"UIDVALIDITY changed during backfill "
+                         f"({self.uidvalidity} -> {fetcher.uidvalidity}) - restart the backfill")
+            fetcher.disconnect()
+            return None
+
+        fetcher.sync_state = self.sync_state
+        return fetcher
+
+    @staticmethod
+    def _drop(fetcher: IMAPFetcher):
+        """Forget a broken connection without a LOGOUT round trip"""
+        try:
+            fetcher.connection.shutdown()
+        except Exception:
+            pass
+        fetcher.connection = None
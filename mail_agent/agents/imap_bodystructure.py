@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - IMAP FETCH response and BODYSTRUCTURE parsing
+Used for the two-phase (structure first, selected parts second) fetch mode
+"""
+from typing import List, Tuple, Dict, Any, Iterator, Optional
+
+_ATOM_END = b' ()"{\r\n'
+
+def _join_response(msg_data: list) -> bytes:
+    """
+    Re-join imaplib's FETCH data into one byte stream
+
+    imaplib splits a response at every literal: (b'... {12}', b'<12 bytes>')
+    followed by the rest of the line. Joining keeps the {n} marker so the
+    tokenizer knows how many bytes to take verbatim.
+    """
+    parts = []
+    for item in msg_data:
+        if isinstance(item, tuple):
+            parts.append(item[0])
+            parts.append(item[1])
+        elif item:
+            parts.append(item)
+    return b''.join(parts)
+
+class _Tokenizer:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def at_end(self) -> bool:
+        self._skip_space()
+        return self.pos >= len(self.data)
+
+    def _skip_space(self):
+        while self.pos < len(self.data) and self.data[self.pos] in b' \r\n':
+            self.pos += 1
+
+    def read_value(self):
+        """Read one value: list, quoted string, literal, NIL or atom"""
+        self._skip_space()
+        char = self.data[self.pos:self.pos + 1]
+
+        if char == b'(':
+            self.pos += 1
+            values = []
+            while True:
+                self._skip_space()
+                if self.data[self.pos:self.pos + 1] == b')':
+                    self.pos += 1
+                    return values
+                if self.pos >= len(self.data):
+                    raise ValueError("unterminated list in FETCH response")
+                values.append(self.read_value())
+
+        if char == b'"':
+            self.pos += 1
+            out = bytearray()
+            while self.data[self.pos:self.pos + 1] != b'"':
+                if self.data[self.pos:self.pos + 1] == b'\\':
+                    self.pos += 1
+                out += self.data[self.pos:self.pos + 1]
+                self.pos += 1
+                if self.pos >= len(self.data):
+                    raise ValueError("unterminated quoted string in FETCH response")
+            self.pos += 1
+            return bytes(out)
+
+        if char == b'{':
+            end = self.data.index(b'}', self.pos)
+            size = int(self.data[self.pos + 1:end])
+            start = end + 1
+            self.pos = start + size
+            return self.data[start:self.pos]
+
+        # Atom - section specs like BODY[1.MIME] may contain spaces inside []
+        start = self.pos
+        while self.pos < len(self.data):
+            c = self.data[self.pos:self.pos + 1]
+            if c == b'[':
+                self.pos = self.data.index(b']', self.pos) + 1
+                continue
+            if c in _ATOM_END:
+                break
+            self.pos += 1
+        atom = self.data[start:self.pos]
+        if not atom:
+            raise ValueError(f"unexpected byte {char!r} in FETCH response")
+        return None if atom.upper() == b'NIL' else atom
+
+def parse_fetch_response(msg_data: list) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    Parse a (multi-message) FETCH response into (sequence_number, items)
+
+    items maps upper-cased item names (b'UID', b'BODYSTRUCTURE',
+    b'BODY[1.MIME]', ...) to their parsed values.
+    """
+    tokens = _Tokenizer(_join_response(msg_data))
+    messages = []
+
+    while not tokens.at_end():
+        seq = tokens.read_value()
+        values = tokens.read_value()
+        if not isinstance(values, list):
+            raise ValueError(f"malformed FETCH response after {seq!r}")
+
+        items = {}
+        for i in range(0, len(values) - 1, 2):
+            key = values[i].upper() if isinstance(values[i], bytes) else values[i]
+            items[key] = values[i + 1]
+        messages.append((int(seq), items))
+
+    return messages
+
+def _text(value) -> str:
+    return value.decode('utf-8', errors='replace') if isinstance(value, bytes) else ''
+
+def _params(value) -> Dict[str, str]:
+    """("CHARSET" "utf-8" "NAME" "x.pdf") -> {'charset': 'utf-8', 'name': 'x.pdf'}"""
+    if not isinstance(value, list):
+        return {}
+    return {_text(value[i]).lower(): _text(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+def parse_bodystructure(value: list, section: str = '') -> Dict[str, Any]:
+    """
+    Convert a parsed BODYSTRUCTURE list into a part tree
+
+    Each node: section ('' for the root, '1', '2.1', ...), type, subtype,
+    params, encoding, size (encoded octets), disposition, filename, children
+    """
+    if value and isinstance(value[0], list):
+        # multipart: (child)(child)... "subtype" (params) (disposition) ...
+        children = []
+        i = 0
+        while i < len(value) and isinstance(value[i], list):
+            child_section = f"{section}.{i + 1}" if section else str(i + 1)
+            children.append(parse_bodystructure(value[i], child_section))
+            i += 1
+
+        rest = value[i:]
+        return {
+            'section': section,
+            'type': 'multipart',
+            'subtype': _text(rest[0]).lower() if rest else 'mixed',
+            'params': _params(rest[1]) if len(rest) > 1 else {},
+            'encoding': '7bit',
+            'size': sum(c['size'] for c in children),
+            'disposition': None,
+            'filename': None,
+            'children': children
+        }
+
+    main_type = _text(value[0]).lower()
+    sub_type = _text(value[1]).lower()
+    params = _params(value[2])
+
+    # Position of the disposition depends on the body type (RFC 3501 7.4.2)
+    if main_type == 'text':
+        disp_index = 9
+    elif main_type == 'message' and sub_type == 'rfc822':
+        disp_index = 11
+    else:
+        disp_index = 8
+
+    disposition = None
+    filename = params.get('name')
+    if len(value) > disp_index and isinstance(value[disp_index], list):
+        disp = value[disp_index]
+        disposition = _text(disp[0]).lower()
+        disp_params = _params(disp[1]) if len(disp) > 1 else {}
+        filename = disp_params.get('filename', filename)
+
+    return {
+        'section': section or '1',
+        'type': main_type,
+        'subtype': sub_type,
+        'params': params,
+        'encoding': _text(value[5]).lower() or '7bit',
+        'size': int(value[6]) if value[6] else 0,
+        'disposition': disposition,
+        'filename': filename,
+        'children': []
+    }
+
+def iter_leaves(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield all non-multipart parts (message/rfc822 counts as a leaf)"""
+    if node['children']:
+        for child in node['children']:
+            yield from iter_leaves(child)
+    else:
+        yield node
+
+def estimate_decoded_size(node: Dict[str, Any]) -> int:
+    """Decoded size from the encoded octet count"""
+    if node['encoding'] == 'base64':
+        return node['size'] * 3 // 4
+    return node['size']
+
+def is_body_text(node: Dict[str, Any]) -> bool:
+    """text/plain or text/html that is not an attachment"""
+    return (node['type'] == 'text'
+            and node['subtype'] in ('plain', 'html')
+            and node['disposition'] != 'attachment')
+
+def find_boundary(node: Dict[str, Any]) -> Optional[bytes]:
+    """Multipart boundary from the Content-Type parameters"""
+    boundary = node['params'].get('boundary')
+    return boundary.encode('utf-8') if boundary else None
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - IMAP COMPRESS=DEFLATE (RFC 4978)
+imaplib connection classes that can switch the stream to raw DEFLATE
+"""
+import imaplib
+import zlib
+from typing import Dict, Any
+
+# imaplib only sends commands it knows
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+# Same line limit as imaplib.IMAP4.readline
+_MAXLINE = imaplib._MAXLINE
+
+# Consumed bytes are dropped from the front of the buffer once there are
+# this many of them and they make up more than half of it
+_COMPACT_BYTES = 64 * 1024
+
+class _DeflateMixin:
+    """
+    Replaces imaplib's read/readline/send once compression is active
+
+    Until start_compression() succeeds the connection behaves exactly like
+    the plain imaplib class. Byte counters: wire_* are compressed bytes on
+    the socket, decoded_* the IMAP protocol bytes.
+    """
+    compressing = False
+    wire_bytes_in = 0
+    wire_bytes_out = 0
+    decoded_bytes_in = 0
+    decoded_bytes_out = 0
+
+    def start_compression(self, level: int = 6) -> bool:
+        """
+        Negotiate COMPRESS DEFLATE
+
+        Returns:
+            True if the stream is compressed from now on
+        """
+        if self.compressing:
+            return True
+
+        typ, _ = self._simple_command('COMPRESS', 'DEFLATE')
+        if typ != 'OK':
+            return False
+
+        # RFC 4978: raw DEFLATE (no zlib header) in both directions
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        # Inflated bytes, consumed up to _offset (no copy per read)
+        self._inflated = bytearray()
+        self._offset = 0
+        self.compressing = True
+        return True
+
+    def read(self, size):
+        if not self.compressing:
+            return super().read(size)
+
+        while len(self._inflated) - self._offset < size:
+            self._fill()
+        return self._consume(self._offset + size)
+
+    def readline(self):
+        if not self.compressing:
+            return super().readline()
+
+        scan = self._offset
+        while True:
+            end = self._inflated.find(b'\n', scan)
+            if end >= 0:
+                break
+            if len(self._inflated) - self._offset > _MAXLINE:
+                raise self.error("got more than %d bytes" % _MAXLINE)
+            # Only the newly inflated bytes need to be searched
+            scan = len(self._inflated)
+            self._fill()
+
+        return self._consume(end + 1)
+
+    def send(self, data):
+        if not self.compressing:
+            return super().send(data)
+
+        # SYNC_FLUSH: the server must see every command immediately
+        wire = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.decoded_bytes_out += len(data)
+        self.wire_bytes_out += len(wire)
+        self.sock.sendall(wire)
+
+    def recv_decoded(self) -> bytes:
+        """Already inflated bytes, or one blocking socket read (IDLE helper)"""
+        # A chunk may end mid-block and inflate to nothing yet
+        while len(self._inflated) == self._offset:
+            self._fill()
+        return self._consume(len(self._inflated))
+
+    def has_buffered(self) -> bool:
+        """Inflated bytes that were not consumed yet (invisible to select)"""
+        return len(self._inflated) > self._offset
+
+    def _consume(self, end: int) -> bytes:
+        """Bytes from the read offset up to end; compacts the buffer now and then"""
+        data = bytes(self._inflated[self._offset:end])
+        self._offset = end
+        if self._offset == len(self._inflated):
+            self._inflated.clear()
+            self._offset = 0
+        elif self._offset >= _COMPACT_BYTES and self._offset * 2 > len(self._inflated):
+            del self._inflated[:self._offset]
+            self._offset = 0
+        return data
+
+    def _fill(self):
+        """Read one chunk from the socket and inflate it"""
+        chunk = self.sock.recv(16384)
+        if not chunk:
+            raise self.abort('socket error: EOF')
+        self.wire_bytes_in += len(chunk)
+        inflated = self._decompressor.decompress(chunk)
+        self.decoded_bytes_in += len(inflated)
+        self._inflated += inflated
+
+    def transfer_stats(self) -> Dict[str, Any]:
+        """Wire vs. decoded byte counters since compression started"""
+        saved = 1 - self.wire_bytes_in / self.decoded_bytes_in if self.decoded_bytes_in else 0.0
+        return {
+            'compressed': self.compressing,
+            'wire_bytes_in': self.wire_bytes_in,
+            'decoded_bytes_in': self.decoded_bytes_in,
+            'wire_bytes_out': self.wire_bytes_out,
+            'decoded_bytes_out': self.decoded_bytes_out,
+            'saved_in': round(saved, 3)
+        }
+
+class IMAP4Deflate(_DeflateMixin, imaplib.IMAP4):
+    pass
+
+class IMAP4_SSLDeflate(_DeflateMixin, imaplib.IMAP4_SSL):
+    pass
@@ -2,8 +2,12 @@
 """
 Nice2Know Mail Agent - IMAP Fetcher
 """
-import imaplib
-from typing import List, Tuple
+import os
+import re
+import time
+import select
+import tempfile
+from typing import List, Tuple, Optional, Callable, Iterator
 import sys
 from pathlib import Path
 
@@ -12,9 +16,136 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from utils.logger import get_logger
 from utils.credentials import get_credentials
+from utils.sync_state import SyncStateStore
+from agents.multi_account import source_tag
+from agents.imap_compress import IMAP4Deflate, IMAP4_SSLDeflate
+from agents.imap_bodystructure import (
+    parse_fetch_response, parse_bodystructure, iter_leaves,
+    estimate_decoded_size, is_body_text, find_boundary
+)
 
 logger = get_logger()
 
+# UID item inside a FETCH response line, e.g. b'12 (UID 345 RFC822 {1234}'
+_UID_RE = re.compile(rb'UID (\d+)')
+# Untagged mailbox size updates, e.g. b'* 17 EXISTS'
+_MAILBOX_UPDATE_RE = re.compile(rb'^\* (\d+) (EXISTS|EXPUNGE)', re.IGNORECASE)
+
+# Upper bound of ids per STORE/MOVE/COPY command line
+_POST_PROCESS_CHUNK = 500
+
+# Failed messages are fetched again this often before they are given up
+_MAX_FAILED_ATTEMPTS = 3
+
+def _build_message_sets(id_list: List[bytes], batch_size: int) -> List[Tuple[str, List[bytes]]]:
+    """
+    Split ids into batches and compress each batch into an IMAP message set
+    e.g. [1, 2, 3, 7, 9, 10] -> '1:3,7,9:10'
+    """
+    batches = []
+    for i in range(0, len(id_list), batch_size):
+        batch = id_list[i:i + batch_size]
+        numbers = sorted(int(n) for n in batch)
+        
+        ranges = []
+        start = prev = numbers[0]
+        for n in numbers[1:]:
+            if n == prev + 1:
+                prev = n
+                continue
+            ranges.append(f"{start}:{prev}" if start != prev else str(start))
+            start = prev = n
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        
+        batches.append((','.join(ranges), batch))
+    return batches
+
+def _split_fetch_response(msg_data: list, by_uid: bool = False) -> List[Tuple[str, bytes]]:
+    """
+    Split a multi-message FETCH response into (id, raw_email) pairs
+
+    imaplib returns one (header, literal) tuple per message followed by the
+    rest of the response line, e.g. b' FLAGS (\\Seen))'. Depending on the
+    server the UID item may come before or after the literal.
+    """
+    messages = []
+    for i, item in enumerate(msg_data):
+        if not isinstance(item, tuple):
+            continue
+        
+        header, raw_email = item[0], item[1]
+        if by_uid:
+            match = _UID_RE.search(header)
+            if not match and i + 1 < len(msg_data) and isinstance(msg_data[i + 1], bytes):
+                match = _UID_RE.search(msg_data[i + 1])
+            if not match:
+                logger.warning(f"FETCH response without UID: {header[:60]!r}")
+                continue
+            message_id = match.group(1)
+        else:
+            message_id = header.split(b' ', 1)[0]
+        
+        messages.append((message_id.decode('utf-8'), raw_email))
+    return messages
+
+def _iter_subparts(node: dict):
+    """All parts below the root (containers and leaves), depth first"""
+    for child in node['children']:
+        yield child
+        yield from _iter_subparts(child)
+
+def _mark_omitted(mime_header: bytes, size: int) -> bytes:
+    """Append X-N2K-Omitted (estimated decoded size) to a header block (which ends with a blank line)"""
+    return mime_header.rstrip(b'\r\n') + f'\r\nX-N2K-Omitted: {size}\r\n\r\n'.encode('ascii')
+
+def _rebuild_multipart(node: dict, parts: dict, wanted: set) -> bytes:
+    """Reassemble a multipart body from fetched MIME headers and sections"""
+    boundary = find_boundary(node)
+    if not boundary:
+        raise ValueError(f"multipart part {node['section'] or 'root'} without boundary")
+    
+    out = []
+    for child in node['children']:
+        mime_header = parts[f'BODY[{child["section"]}.MIME]'.encode('ascii')]
+        out.append(b'--' + boundary + b'\r\n')
+        
+        if child['children']:
+            out.append(mime_header)
+            out.append(_rebuild_multipart(child, parts, wanted))
+        elif child['section'] in wanted:
+            out.append(mime_header)
+            out.append(parts[f'BODY[{child["section"]}]'.encode('ascii')])
+        else:
+            out.append(_mark_omitted(mime_header, estimate_decoded_size(child)))
+        out.append(b'\r\n')
+    
+    out.append(b'--' + boundary + b'--\r\n')
+    return b''.join(out)
+
+class SpooledMessage:
+    """
+    Handle to a fetched message that lives in the spool directory
+    
+    The consumer either adopts the file (FileHandler.adopt_mail) or
+    calls discard(); only read_bytes() loads the message into memory.
+    """
+    __slots__ = ('message_id', 'path', 'size')
+    
+    def __init__(self, message_id: str, path: Path, size: int):
+        self.message_id = message_id
+        self.path = path
+        self.size = size
+    
+    def read_bytes(self) -> bytes:
+        return self.path.read_bytes()
+    
+    def discard(self):
+        """Remove the spool file (no-op once it was adopted or removed)"""
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
 class IMAPFetcher:
     def __init__(self, config: dict):
         self.config = config
@@ -22,22 +153,50 @@ class IMAPFetcher:
         # Load secrets directly with new structure
         creds = get_credentials()
         mail_secrets = creds._secrets.get('mail', {})
+        # Multi-account configs (agents.multi_account) carry the account name
+        account = self.imap_config.get('account')
+        if account:
+            mail_secrets = mail_secrets.get('accounts', {}).get(account, mail_secrets)
         self.credentials = {
             'username': mail_secrets.get('imap_username', ''),
             'password': mail_secrets.get('imap_password', '')
         }
         self.connection = None
+        
+        # Sync mode: 'search' (SEARCH UNSEEN/ALL by sequence number) or
+        # 'uid' (incremental UID n+1:* with persisted checkpoint)
+        self.use_uid = self.imap_config.get('sync_mode', 'search') == 'uid'
+        self.batch_size = max(1, int(self.imap_config.get('fetch_batch_size', 50)))
+        # Fetch mode: 'full' (RFC822) or 'selective' (BODYSTRUCTURE first,
+        # then only text parts and attachments below the size limit)
+        self.selective_fetch = self.imap_config.get('fetch_mode', 'full') == 'selective'
+        max_size_mb = config.get('storage', {}).get('max_attachment_size_mb', 50)
+        self.max_part_bytes = max_size_mb * 1024 * 1024
+        self.last_fetch_stats = {}
+        self.mailbox = None
+        self.uidvalidity = None
+        self.exists_count = 0
+        self._idle_buffer = b''
+        self.fetch_incomplete = False
+        
+        storage_base = Path(config.get('storage', {}).get('base_path', './storage'))
+        self.sync_state = SyncStateStore.shared(storage_base / 'state' / 'imap_sync_state.json')
+        # Streaming fetch: messages go to disk as they arrive, memory is
+        # bounded by spool_batch_mb per FETCH (or one message if larger)
+        self.spool_dir = storage_base / 'mails' / '.spool'
+        self.spool_batch_bytes = int(self.imap_config.get('spool_batch_mb', 8)) * 1024 * 1024
     
     def connect(self) -> bool:
         """Establish IMAP connection"""
         try:
+            # Plain imaplib behaviour until COMPRESS DEFLATE is negotiated
             if self.imap_config['use_ssl']:
-                self.connection = imaplib.IMAP4_SSL(
+                self.connection = IMAP4_SSLDeflate(
                     self.imap_config['host'],
                     self.imap_config['port']
                 )
             else:
-                self.connection = imaplib.IMAP4(
+                self.connection = IMAP4Deflate(
                     self.imap_config['host'],
                     self.imap_config['port']
                 )
@@ -48,6 +207,10 @@ class IMAPFetcher:
                 self.credentials['password']
             )
             
+            # Servers often advertise more (IDLE, MOVE, ...) after LOGIN
+            self._refresh_capabilities()
+            self._start_compression()
+            
             logger.info(f"✓ Connected to {self.imap_config['host']}:{self.imap_config['port']}")
             return True
             
@@ -67,6 +230,9 @@ class IMAPFetcher:
             status, messages = self.connection.select(mailbox)
             if status == 'OK':
                 count = int(messages[0])
+                self.mailbox = mailbox
+                self.uidvalidity = self._read_uidvalidity()
+                self.exists_count = count
                 logger.info(f"Selected mailbox '{mailbox}' ({count} messages)")
                 return True
             else:
@@ -86,70 +252,748 @@ class IMAPFetcher:
             return []
         
         try:
-            # Search criteria
-            search_criteria = 'UNSEEN' if unseen_only else 'ALL'
-            status, message_ids = self.connection.search(None, search_criteria)
+            if self.use_uid:
+                id_list = self._search_new_uids(limit, unseen_only)
+            else:
+                id_list = self._search_sequence_numbers(limit, unseen_only)
             
-            if status != 'OK':
-                logger.warning("No messages found")
+            if not id_list:
                 return []
             
-            id_list = message_ids[0].split()
+            if self.selective_fetch:
+                return self._fetch_selective(id_list)
+            return self._fetch_batched(id_list)
             
-            if not id_list:
-                logger.info("No messages to fetch")
-                return []
+        except Exception as e:
+            logger.error(f"Message fetch error: {e}")
+            return []
+    
+    def iter_messages(self, limit: int = None, unseen_only: bool = True) -> Iterator[SpooledMessage]:
+        """
+        Streaming variant of fetch_messages
+        
+        Fetches in groups bounded by RFC822.SIZE, writes every message to
+        the spool directory and yields a SpooledMessage per message, so a
+        large backlog never sits in memory as a whole.
+        """
+        if not self.connection:
+            logger.error("No active IMAP connection")
+            return
+        
+        try:
+            if self.use_uid:
+                id_list = self._search_new_uids(limit, unseen_only)
+            else:
+                id_list = self._search_sequence_numbers(limit, unseen_only)
+        except Exception as e:
+            logger.error(f"Message fetch error: {e}")
+            return
+        
+        yield from self.iter_ids(id_list)
+    
+    def iter_ids(self, id_list: List[bytes]) -> Iterator[SpooledMessage]:
+        """
+        Stream an explicit id list (UIDs in uid sync mode) through the spool
+        
+        In uid mode a failed FETCH ends the stream before the first missing
+        UID (fetch_incomplete is set), so the checkpoint never skips it.
+        """
+        self.fetch_incomplete = False
+        if not id_list:
+            return
+        
+        groups = self._group_by_size(id_list)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._clean_spool()
+        
+        for group in groups:
+            if self.selective_fetch:
+                messages = self._fetch_selective(group)
+            else:
+                messages = self._fetch_batched(group)
             
-            # Apply limit
-            if limit and limit > 0:
-                id_list = id_list[-limit:]  # Get most recent N messages
+            # Spool the whole group first, then release the bytes
+            handles = [self._spool(message_id, raw_email) for message_id, raw_email in messages]
+            del messages
             
-            logger.info(f"Fetching {len(id_list)} message(s)...")
+            if self.use_uid and len(handles) < len(group):
+                fetched = {handle.message_id for handle in handles}
+                first_missing = min(int(n) for n in group if n.decode('utf-8') not in fetched)
+                logger.warning(f"UID {first_missing} could not be fetched - "
+                               f"stopping here, retried next run")
+                for handle in handles:
+                    if int(handle.message_id) > first_missing:
+                        handle.discard()
+                handles = [handle for handle in handles if int(handle.message_id) < first_missing]
+                self.fetch_incomplete = True
             
-            messages = []
-            for num in id_list:
+            for i, handle in enumerate(handles):
                 try:
-                    status, msg_data = self.connection.fetch(num, '(RFC822)')
-                    if status == 'OK':
-                        raw_email = msg_data[0][1]
-                        message_id = num.decode('utf-8')
-                        messages.append((message_id, raw_email))
-                        logger.debug(f"Fetched message ID {message_id}")
-                    else:
-                        logger.warning(f"Failed to fetch message {num}")
-                except Exception as e:
-                    logger.error(f"Error fetching message {num}: {e}")
+                    yield handle
+                except GeneratorExit:
+                    # Consumer stopped early - drop what it never saw
+                    for pending in handles[i + 1:]:
+                        pending.discard()
+                    raise
             
-            return messages
+            if self.fetch_incomplete:
+                return
+    
+    def _group_by_size(self, id_list: List[bytes]) -> List[List[bytes]]:
+        """Split ids into FETCH groups of at most spool_batch_bytes / batch_size"""
+        sizes = {}
+        for message_set, _ in _build_message_sets(id_list, self.batch_size):
+            try:
+                status, msg_data = self._fetch_command(message_set, 'RFC822.SIZE')
+                if status != 'OK':
+                    continue
+                for seq, items in parse_fetch_response(msg_data):
+                    message_id = items.get(b'UID', b'').decode('ascii') if self.use_uid else str(seq)
+                    sizes[message_id] = int(items.get(b'RFC822.SIZE') or 0)
+            except Exception as e:
+                logger.warning(f"Could not read sizes for {message_set}: {e}")
+        
+        groups = []
+        group, group_bytes = [], 0
+        for num in id_list:
+            size = sizes.get(num.decode('utf-8'), 0)
+            if group and (group_bytes + size > self.spool_batch_bytes or len(group) >= self.batch_size):
+                groups.append(group)
+                group, group_bytes = [], 0
+            group.append(num)
+            group_bytes += size
+        if group:
+            groups.append(group)
+        return groups
+    
+    def _clean_spool(self, max_age: int = 86400):
+        """Remove spool files left behind by a crashed run"""
+        cutoff = time.time() - max_age
+        for path in self.spool_dir.glob('*.eml'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    logger.info(f"Removed stale spool file {path.name}")
+            except OSError:
+                pass
+    
+    def _spool(self, message_id: str, raw_email: bytes) -> SpooledMessage:
+        """Write one message to the spool directory"""
+        fd, path = tempfile.mkstemp(dir=self.spool_dir, prefix=f"{message_id}_", suffix='.eml')
+        size = len(raw_email)
+        with os.fdopen(fd, 'wb') as f:
+            source = source_tag(self.imap_config)
+            if source:
+                # Tag the stored mail with its origin for downstream routing
+                header = f"X-N2K-Source: {source}\r\n".encode('utf-8')
+                f.write(header)
+                size += len(header)
+            f.write(raw_email)
+        return SpooledMessage(message_id, Path(path), size)
+    
+    def search_uid_range(self, first_uid: int, last_uid: int) -> List[bytes]:
+        """All UIDs in first_uid:last_uid (inclusive), oldest first"""
+        status, data = self.connection.uid('SEARCH', None, f'UID {first_uid}:{last_uid}')
+        if status != 'OK':
+            raise self.connection.error(f"UID SEARCH {first_uid}:{last_uid} failed")
+        
+        # Unlike n:*, a closed range never matches UIDs outside of it
+        return sorted((uid for uid in data[0].split() if first_uid <= int(uid) <= last_uid), key=int)
+    
+    def highest_uid(self) -> int:
+        """Highest UID currently in the selected mailbox (0 if empty)"""
+        status, data = self.connection.uid('SEARCH', None, 'UID *')
+        if status != 'OK' or not data or not data[0]:
+            return 0
+        return max(int(uid) for uid in data[0].split())
+    
+    def _search_sequence_numbers(self, limit: int = None, unseen_only: bool = True) -> List[bytes]:
+        """SEARCH UNSEEN/ALL, returns the most recent N sequence numbers"""
+        # Search criteria
+        search_criteria = 'UNSEEN' if unseen_only else 'ALL'
+        status, message_ids = self.connection.search(None, search_criteria)
+        
+        if status != 'OK':
+            logger.warning("No messages found")
+            return []
+        
+        id_list = message_ids[0].split()
+        
+        if not id_list:
+            logger.info("No messages to fetch")
+            return []
+        
+        # Apply limit
+        if limit and limit > 0:
+            id_list = id_list[-limit:]  # Get most recent N messages
+        
+        logger.info(f"Fetching {len(id_list)} message(s)...")
+        return id_list
+    
+    def _search_new_uids(self, limit: int = None, unseen_only: bool = True) -> List[bytes]:
+        """
+        Find messages above the persisted UID checkpoint
+        Returns: List of UIDs, oldest first
+        """
+        if self.uidvalidity is None:
+            logger.error("UIDVALIDITY unknown - select a mailbox first")
+            return []
+        
+        key = self._state_key()
+        checkpoint = self.sync_state.get(key)
+        
+        if checkpoint.get('uidvalidity') != self.uidvalidity:
+            if checkpoint:
+                logger.warning(
+                    f"UIDVALIDITY changed for '{self.mailbox}' "
+                    f"({checkpoint.get('uidvalidity')} -> {self.uidvalidity}), full resync"
+                )
+            else:
+                logger.info(f"No sync checkpoint for '{self.mailbox}', initial sync")
+            self.sync_state.reset(key, self.uidvalidity)
+            last_uid = 0
+        else:
+            last_uid = checkpoint.get('last_uid', 0)
+        
+        criteria = f'UID {last_uid + 1}:*'
+        if unseen_only:
+            criteria += ' UNSEEN'
+        
+        status, data = self.connection.uid('SEARCH', None, criteria)
+        if status != 'OK':
+            logger.warning("UID search failed")
+            return []
+        
+        # 'n+1:*' always matches the highest UID, even if it is <= n
+        uid_list = [uid for uid in data[0].split() if int(uid) > last_uid]
+        
+        # Messages below the checkpoint whose processing failed earlier
+        # (failed UIDs above it are found by the search itself)
+        retry_list = self.search_failed_uids(key, checkpoint.get('failed_uids', {}), last_uid)
+        
+        if not uid_list and not retry_list:
+            logger.info(f"No new messages above UID {last_uid}")
+            return []
+        
+        # Oldest first, so the checkpoint can only move forward
+        uid_list.sort(key=int)
+        id_list = retry_list + uid_list
+        if limit and limit > 0:
+            id_list = id_list[:limit]
+        
+        retried = min(len(retry_list), len(id_list))
+        if retried:
+            logger.info(f"Retrying {retried} failed message(s) below UID {last_uid}")
+        logger.info(f"Fetching {len(id_list) - retried} new message(s) above UID {last_uid}...")
+        return id_list
+    
+    def search_failed_uids(self, key: str, failed: dict, last_uid: int) -> List[bytes]:
+        """Failed UIDs up to last_uid that still exist in the mailbox, oldest first"""
+        uids = sorted(int(uid) for uid in failed if int(uid) <= last_uid)
+        if not uids:
+            return []
+        
+        status, data = self.connection.uid('SEARCH', None, 'UID ' + ','.join(str(uid) for uid in uids))
+        if status != 'OK':
+            logger.warning("UID search for failed messages failed")
+            return []
+        
+        existing = {int(uid) for uid in data[0].split()}
+        gone = [uid for uid in uids if uid not in existing]
+        if gone:
+            logger.info(f"{len(gone)} failed message(s) no longer in '{self.mailbox}', not retried")
+            self.sync_state.drop_failed(key, gone)
+        return [str(uid).encode('utf-8') for uid in uids if uid in existing]
+    
+    def _fetch_batched(self, id_list: List[bytes]) -> List[Tuple[str, bytes]]:
+        """
+        Fetch messages with one FETCH command per message set (e.g. '1:50')
+        instead of one round trip per message
+        Returns: List of (message_id, raw_email_bytes) in id_list order
+        """
+        fetched = {}
+        total_bytes = 0
+        started = time.monotonic()
+        wire_start = self._wire_bytes_in()
+        
+        for message_set, batch in _build_message_sets(id_list, self.batch_size):
+            try:
+                status, msg_data = self._fetch_command(message_set, 'RFC822')
+                
+                if status != 'OK':
+                    logger.warning(f"Failed to fetch message set {message_set}")
+                    continue
+                
+                for message_id, raw_email in _split_fetch_response(msg_data, self.use_uid):
+                    fetched[message_id] = raw_email
+                    total_bytes += len(raw_email)
+                    logger.debug(f"Fetched message ID {message_id}")
+                
+                missing = [m.decode('utf-8') for m in batch if m.decode('utf-8') not in fetched]
+                if missing:
+                    logger.warning(f"Server returned no data for message(s) {', '.join(missing)}")
+            except Exception as e:
+                logger.error(f"Error fetching message set {message_set}: {e}")
+        
+        messages = []
+        for num in id_list:
+            message_id = num.decode('utf-8')
+            if message_id in fetched:
+                messages.append((message_id, fetched[message_id]))
+        
+        self._record_fetch_stats(len(messages), total_bytes, time.monotonic() - started,
+                                 self._wire_bytes_in() - wire_start)
+        return messages
+    
+    def _fetch_command(self, message_set: str, items: str):
+        """FETCH by UID or sequence number; UID mode always asks for the UID item"""
+        if self.use_uid:
+            return self.connection.uid('FETCH', message_set, f'(UID {items})')
+        return self.connection.fetch(message_set, f'({items})')
+    
+    def _fetch_selective(self, id_list: List[bytes]) -> List[Tuple[str, bytes]]:
+        """
+        Two-phase fetch: ENVELOPE and BODYSTRUCTURE for a whole message set,
+        then per message only the headers, text parts and attachments below
+        max_attachment_size_mb via BODY.PEEK[section]
+        Returns: List of (message_id, rebuilt_raw_email_bytes) in id_list order
+        """
+        fetched = {}
+        total_bytes = 0
+        skipped_bytes = 0
+        started = time.monotonic()
+        wire_start = self._wire_bytes_in()
+        
+        for message_set, batch in _build_message_sets(id_list, self.batch_size):
+            try:
+                status, msg_data = self._fetch_command(
+                    message_set, 'RFC822.SIZE ENVELOPE BODYSTRUCTURE'
+                )
+                if status != 'OK':
+                    logger.warning(f"Failed to fetch structure for message set {message_set}")
+                    continue
+                structures = parse_fetch_response(msg_data)
+            except Exception as e:
+                logger.error(f"Error fetching structure for message set {message_set}: {e}")
+                continue
             
+            for seq, items in structures:
+                message_id = (items.get(b'UID') or b'').decode('ascii') if self.use_uid else str(seq)
+                if not message_id or b'BODYSTRUCTURE' not in items:
+                    continue
+                
+                try:
+                    raw_email, skipped = self._fetch_selected_parts(message_id, items)
+                except Exception as e:
+                    logger.warning(f"Selective fetch failed for {message_id} ({e}), fetching in full")
+                    raw_email, skipped = self._fetch_full(message_id), 0
+                
+                if raw_email:
+                    fetched[message_id] = raw_email
+                    total_bytes += len(raw_email)
+                    skipped_bytes += skipped
+        
+        messages = []
+        for num in id_list:
+            message_id = num.decode('utf-8')
+            if message_id in fetched:
+                messages.append((message_id, fetched[message_id]))
+        
+        if skipped_bytes:
+            logger.info(f"Selective fetch skipped {skipped_bytes / 1024 / 1024:.2f} MB of oversized attachments")
+        self._record_fetch_stats(len(messages), total_bytes, time.monotonic() - started,
+                                 self._wire_bytes_in() - wire_start)
+        return messages
+    
+    def _fetch_selected_parts(self, message_id: str, items: dict) -> Tuple[bytes, int]:
+        """
+        Download the wanted sections of one message and rebuild the MIME tree
+        Oversized parts keep their MIME headers plus 'X-N2K-Omitted: <bytes>'
+        but no body.
+        
+        Returns:
+            (raw_email_bytes, skipped_encoded_bytes)
+        """
+        root = parse_bodystructure(items[b'BODYSTRUCTURE'])
+        multipart = bool(root['children'])
+        
+        wanted = set()
+        skipped = 0
+        for leaf in iter_leaves(root):
+            if is_body_text(leaf) or estimate_decoded_size(leaf) <= self.max_part_bytes:
+                wanted.add(leaf['section'])
+            else:
+                skipped += leaf['size']
+                logger.info(
+                    f"Skipping part {leaf['section']} of {message_id} "
+                    f"({leaf['filename'] or leaf['type'] + '/' + leaf['subtype']}, "
+                    f"~{estimate_decoded_size(leaf) / 1024 / 1024:.2f} MB)"
+                )
+        
+        if not skipped:
+            # Nothing to leave out - one plain fetch is cheaper than many sections
+            return self._fetch_full(message_id), 0
+        
+        sections = ['BODY.PEEK[HEADER]']
+        if multipart:
+            sections += [f'BODY.PEEK[{node["section"]}.MIME]' for node in _iter_subparts(root)]
+            sections += [f'BODY.PEEK[{section}]' for section in sorted(wanted)]
+        elif wanted:
+            sections.append('BODY.PEEK[TEXT]')
+        
+        status, data = self._fetch_command(message_id, ' '.join(sections))
+        if status != 'OK':
+            raise self.connection.error(f"section fetch failed: {status}")
+        parts = parse_fetch_response(data)[0][1]
+        
+        header = parts[b'BODY[HEADER]']
+        if not multipart:
+            if wanted:
+                return header + parts[b'BODY[TEXT]'], skipped
+            return _mark_omitted(header, estimate_decoded_size(root)), skipped
+        
+        return header + _rebuild_multipart(root, parts, wanted), skipped
+    
+    def _fetch_full(self, message_id: str) -> Optional[bytes]:
+        """Single-message RFC822 fetch"""
+        status, msg_data = self._fetch_command(message_id, 'RFC822')
+        if status != 'OK':
+            return None
+        for _, raw_email in _split_fetch_response(msg_data, self.use_uid):
+            return raw_email
+        return None
+    
+    def _record_fetch_stats(self, count: int, total_bytes: int, seconds: float, wire_bytes: int = None):
+        """Store and log fetch throughput (wire_bytes: compressed bytes received)"""
+        seconds = max(seconds, 1e-6)
+        self.last_fetch_stats = {
+            'messages': count,
+            'bytes': total_bytes,
+            'seconds': round(seconds, 3),
+            'messages_per_s': round(count / seconds, 2),
+            'bytes_per_s': round(total_bytes / seconds, 1)
+        }
+        
+        wire_info = ''
+        if self._compressing() and wire_bytes is not None:
+            self.last_fetch_stats['wire_bytes'] = wire_bytes
+            wire_info = f", {wire_bytes / 1024:.1f} KB on the wire"
+        
+        logger.info(
+            f"Fetched {count} message(s), {total_bytes / 1024:.1f} KB{wire_info} in {seconds:.2f}s "
+            f"({self.last_fetch_stats['messages_per_s']} msg/s, "
+            f"{self.last_fetch_stats['bytes_per_s'] / 1024:.1f} KB/s)"
+        )
+    
+    def _start_compression(self):
+        """Enable COMPRESS=DEFLATE if configured and advertised"""
+        if not self.imap_config.get('compress', True):
+            return
+        if 'COMPRESS=DEFLATE' not in getattr(self.connection, 'capabilities', ()):
+            return
+        
+        try:
+            if self.connection.start_compression():
+                logger.info("✓ IMAP compression enabled (DEFLATE)")
+            else:
+                logger.warning("Server refused COMPRESS DEFLATE")
         except Exception as e:
-            logger.error(f"Message fetch error: {e}")
-            return []
+            logger.warning(f"Could not enable IMAP compression: {e}")
     
-    def mark_as_read(self, message_id: str):
-        """Mark message as read/seen"""
+    def _compressing(self) -> bool:
+        return getattr(self.connection, 'compressing', False)
+    
+    def _wire_bytes_in(self) -> int:
+        return getattr(self.connection, 'wire_bytes_in', 0)
+    
+    def transfer_stats(self) -> dict:
+        """Wire vs. decoded bytes of the current connection (empty without compression)"""
+        if not self._compressing():
+            return {}
+        return self.connection.transfer_stats()
+    
+    def checkpoint(self, message_id: str):
+        """Record a message as processed (UID sync mode only)"""
+        if not self.use_uid or self.uidvalidity is None:
+            return
+        
         try:
-            self.connection.store(message_id, '+FLAGS', '\\Seen')
-            logger.debug(f"Marked message {message_id} as read")
+            if self.sync_state.advance(self._state_key(), self.uidvalidity, int(message_id)):
+                logger.debug(f"Sync checkpoint for '{self.mailbox}' -> UID {message_id}")
         except Exception as e:
-            logger.error(f"Failed to mark message {message_id} as read: {e}")
+            logger.error(f"Failed to save sync checkpoint for UID {message_id}: {e}")
     
-    def move_to_folder(self, message_id: str, target_folder: str = 'processed'):
-        """Move message to another IMAP folder"""
+    def mark_failed(self, message_id: str, key: str = None):
+        """
+        Record a message whose processing failed (UID sync mode only)
+        
+        A later success moves the checkpoint past it, so it is kept in the
+        sync state and fetched again by the next runs.
+        
+        Args:
+            key: Sync state entry (default: this mailbox, backfill uses its range keys)
+        """
+        if not self.use_uid or self.uidvalidity is None:
+            return
+        
+        key = key or self._state_key()
         try:
-            # Copy to target folder
-            result = self.connection.copy(message_id, target_folder)
-            if result[0] == 'OK':
-                # Mark original as deleted (but don't expunge yet)
-                self.connection.store(message_id, '+FLAGS', '\\Deleted')
-                logger.info(f"Moved message {message_id} to '{target_folder}'")
-                return True
+            attempts = self.sync_state.mark_failed(key, self.uidvalidity, int(message_id))
+            if attempts >= _MAX_FAILED_ATTEMPTS:
+                logger.error(f"UID {message_id} failed {attempts} times - giving up")
+                self.sync_state.drop_failed(key, [int(message_id)])
+            elif attempts:
+                logger.warning(f"UID {message_id} failed (attempt {attempts}), retried next run")
             else:
-                logger.warning(f"Failed to copy message {message_id} to '{target_folder}'")
-                return False
+                logger.warning(f"UID {message_id} failed - no sync state for '{key}', not retried")
         except Exception as e:
-            logger.error(f"Failed to move message {message_id}: {e}")
+            logger.error(f"Failed to record failed UID {message_id}: {e}")
+    
+    def supports_idle(self) -> bool:
+        """Check if the server advertises IDLE (RFC 2177)"""
+        return bool(self.connection) and 'IDLE' in self.connection.capabilities
+    
+    def idle_wait(self, timeout: int, should_stop: Callable[[], bool] = None) -> bool:
+        """
+        Block in IDLE until the server reports new mail
+        
+        Args:
+            timeout: Seconds before IDLE is ended (re-issue well before the
+                     server's inactivity timeout, RFC 2177 suggests < 29 min)
+            should_stop: Optional callback, checked about once per second
+        
+        Returns:
+            True if EXISTS grew (new mail), False on timeout/stop
+        
+        Raises:
+            imaplib.IMAP4.abort / OSError if the connection dropped
+        """
+        conn = self.connection
+        
+        # EXISTS may already have arrived with an earlier command response
+        if self._pending_new_mail():
+            return True
+        
+        # IDLE responses are read straight from the socket: imaplib's buffered
+        # file object cannot tell whether a complete line is already waiting
+        self._idle_buffer = b''
+        tag = conn._new_tag()
+        conn.send(tag + b' IDLE\r\n')
+        new_mail = False
+        line = self._idle_readline(timeout=None)
+        while line.startswith(b'* '):
+            new_mail = self._handle_untagged_line(line) or new_mail
+            line = self._idle_readline(timeout=None)
+        if not line.startswith(b'+'):
+            raise conn.error(f"IDLE rejected: {line.strip()!r}")
+        
+        logger.debug(f"IDLE started on '{self.mailbox}' (timeout {timeout}s)")
+        
+        deadline = time.monotonic() + timeout
+        while not new_mail:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (should_stop and should_stop()):
+                break
+            line = self._idle_readline(timeout=min(remaining, 1.0))
+            if line is not None:
+                new_mail = self._handle_untagged_line(line)
+        
+        # Leave IDLE and consume everything up to the tagged completion
+        conn.send(b'DONE\r\n')
+        while True:
+            line = self._idle_readline(timeout=None)
+            if line.startswith(tag):
+                if not line.startswith(tag + b' OK'):
+                    logger.warning(f"IDLE ended with: {line.strip()!r}")
+                break
+            if self._handle_untagged_line(line):
+                new_mail = True
+        
+        if new_mail:
+            logger.info(f"IDLE: new mail in '{self.mailbox}' ({self.exists_count} messages)")
+        return new_mail
+    
+    def _pending_new_mail(self) -> bool:
+        """Consume untagged EXPUNGE/EXISTS collected by imaplib"""
+        _, expunged = self.connection.response('EXPUNGE')
+        if expunged and expunged[0] is not None:
+            self.exists_count = max(0, self.exists_count - len(expunged))
+        
+        _, exists = self.connection.response('EXISTS')
+        if exists and exists[-1] is not None:
+            count = int(exists[-1])
+            grew = count > self.exists_count
+            self.exists_count = count
+            return grew
+        return False
+    
+    def _handle_untagged_line(self, line: bytes) -> bool:
+        """Track mailbox size from an untagged line, True if EXISTS grew"""
+        if not line:
+            raise self.connection.abort("connection closed during IDLE")
+        if line.startswith(b'* BYE'):
+            raise self.connection.abort(f"server closed connection: {line.strip()!r}")
+        
+        match = _MAILBOX_UPDATE_RE.match(line)
+        if not match:
             return False
+        
+        if match.group(2).upper() == b'EXPUNGE':
+            self.exists_count = max(0, self.exists_count - 1)
+            return False
+        
+        count = int(match.group(1))
+        grew = count > self.exists_count
+        self.exists_count = count
+        return grew
+    
+    def _idle_readline(self, timeout: Optional[float]) -> Optional[bytes]:
+        """
+        Read one response line during IDLE
+        
+        Returns:
+            The line, or None if no complete line arrived within timeout
+            (timeout=None blocks until a line is complete)
+        """
+        while b'\n' not in self._idle_buffer:
+            if not self._wait_readable(timeout):
+                return None
+            chunk = self._recv_chunk()
+            if not chunk:
+                raise self.connection.abort("connection closed during IDLE")
+            self._idle_buffer += chunk
+        
+        line, _, self._idle_buffer = self._idle_buffer.partition(b'\n')
+        return line + b'\n'
+    
+    def _recv_chunk(self) -> bytes:
+        """Read whatever the server sent (at least one byte, blocking)"""
+        if self._compressing():
+            return self.connection.recv_decoded()
+        return self.connection.sock.recv(4096)
+    
+    def _wait_readable(self, timeout: Optional[float]) -> bool:
+        """Wait until the server sent something (without consuming it)"""
+        if self._compressing() and self.connection.has_buffered():
+            return True
+        sock = self.connection.sock
+        if hasattr(sock, 'pending') and sock.pending():
+            return True
+        readable, _, _ = select.select([sock], [], [], timeout)
+        return bool(readable)
+    
+    def _refresh_capabilities(self):
+        """Re-read CAPABILITY after authentication"""
+        try:
+            status, data = self.connection.capability()
+            if status == 'OK' and data and data[-1]:
+                self.connection.capabilities = tuple(data[-1].decode('ascii').upper().split())
+        except Exception as e:
+            logger.debug(f"Could not refresh capabilities: {e}")
+    
+    def _read_uidvalidity(self) -> Optional[int]:
+        """Read UIDVALIDITY from the untagged SELECT response"""
+        try:
+            _, data = self.connection.response('UIDVALIDITY')
+            if data and data[0]:
+                return int(data[0])
+        except Exception as e:
+            logger.warning(f"Could not read UIDVALIDITY: {e}")
+        return None
+    
+    def _state_key(self) -> str:
+        """Checkpoint key: one entry per account and mailbox"""
+        return f"{self.credentials['username']}@{self.imap_config['host']}/{self.mailbox}"
+    
+    def _command(self, command: str, *args):
+        """Run STORE/COPY/MOVE by UID or by sequence number depending on sync mode"""
+        if self.use_uid:
+            return self.connection.uid(command, *args)
+        if command == 'MOVE':
+            # imaplib has no move() - MOVE is known to it, so xatom passes it through
+            return self.connection.xatom(command, *args)
+        return getattr(self.connection, command.lower())(*args)
+    
+    def _has_capability(self, name: str) -> bool:
+        return name in getattr(self.connection, 'capabilities', ())
+    
+    def mark_as_read(self, message_id: str):
+        """Mark message as read/seen"""
+        self.mark_as_read_bulk([message_id])
+    
+    def mark_as_read_bulk(self, message_ids: List[str]) -> bool:
+        """Mark messages as read/seen with one STORE per message set"""
+        ok = True
+        for message_set, _ in _build_message_sets(message_ids, _POST_PROCESS_CHUNK):
+            try:
+                status, _ = self._command('STORE', message_set, '+FLAGS.SILENT', '\\Seen')
+                if status != 'OK':
+                    logger.warning(f"Failed to mark {message_set} as read")
+                    ok = False
+            except Exception as e:
+                logger.error(f"Failed to mark {message_set} as read: {e}")
+                ok = False
+        
+        if ok and message_ids:
+            logger.debug(f"Marked {len(message_ids)} message(s) as read")
+        return ok
+    
+    def move_to_folder(self, message_id: str, target_folder: str = 'processed'):
+        """Move message to another IMAP folder"""
+        return self.move_messages([message_id], target_folder)
+    
+    def move_messages(self, message_ids: List[str], target_folder: str = 'processed') -> bool:
+        """
+        Move messages to another IMAP folder in bulk
+        
+        Uses one MOVE (RFC 6851) per message set if the server supports it,
+        otherwise COPY + STORE \\Deleted + expunge of exactly these messages
+        (UID EXPUNGE with UIDPLUS, plain EXPUNGE otherwise).
+        Call this once per cycle after all messages were fetched - in
+        sequence-number mode the expunge renumbers the mailbox.
+        
+        Returns:
+            True if all messages were moved
+        """
+        if not message_ids:
+            return True
+        
+        use_move = self._has_capability('MOVE')
+        ok = True
+        needs_expunge = False
+        
+        # Highest ids first: a MOVE/EXPUNGE only renumbers sequence numbers above it
+        ordered = sorted(message_ids, key=int)
+        message_sets = _build_message_sets(ordered, _POST_PROCESS_CHUNK)
+        
+        for message_set, batch in reversed(message_sets):
+            try:
+                if use_move:
+                    status, _ = self._command('MOVE', message_set, target_folder)
+                else:
+                    status, _ = self._command('COPY', message_set, target_folder)
+                    if status == 'OK':
+                        status, _ = self._command('STORE', message_set, '+FLAGS.SILENT', '\\Deleted')
+                        if status == 'OK':
+                            if self.use_uid and self._has_capability('UIDPLUS'):
+                                # Expunge exactly these messages
+                                self.connection.uid('EXPUNGE', message_set)
+                            else:
+                                needs_expunge = True
+                
+                if status == 'OK':
+                    logger.info(f"Moved {len(batch)} message(s) to '{target_folder}'")
+                else:
+                    logger.warning(f"Failed to move {message_set} to '{target_folder}'")
+                    ok = False
+            except Exception as e:
+                logger.error(f"Failed to move {message_set}: {e}")
+                ok = False
+        
+        if needs_expunge:
+            self.expunge_deleted()
+        
+        return ok
     
     def expunge_deleted(self):
         """Permanently remove messages marked as deleted"""
@@ -176,6 +1020,13 @@ class IMAPFetcher:
     def disconnect(self):
         """Close IMAP connection"""
         if self.connection:
+            stats = self.transfer_stats()
+            if stats.get('decoded_bytes_in'):
+                logger.info(
+                    f"IMAP transfer: {stats['decoded_bytes_in'] / 1024:.1f} KB decoded, "
+                    f"{stats['wire_bytes_in'] / 1024:.1f} KB on the wire "
+                    f"({stats['saved_in']:.0%} saved)"
+                )
             try:
                 self.connection.close()
                 self.connection.logout()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - IMAP IDLE Listener
+Keeps one authenticated connection open and reacts to new mail immediately
+"""
+import imaplib
+import time
+from typing import Callable
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+from agents.imap_fetcher import IMAPFetcher
+
+logger = get_logger()
+
+class IMAPIdleListener:
+    def __init__(self, config: dict, on_new_mail: Callable[[IMAPFetcher], None],
+                 trigger_on_connect: bool = True):
+        """
+        Args:
+            config: Mail agent config (imap.idle_timeout, imap.reconnect_delay)
+            on_new_mail: Called with the connected fetcher whenever the
+                         server reports EXISTS
+            trigger_on_connect: Also call on_new_mail after every (re)connect,
+                                to catch mail that arrived while offline
+        """
+        self.config = config
+        self.on_new_mail = on_new_mail
+        self.trigger_on_connect = trigger_on_connect
+
+        imap_config = config['imap']
+        # Re-issue IDLE before typical server timeouts (RFC 2177: 29 min)
+        self.idle_timeout = int(imap_config.get('idle_timeout', 1500))
+        self.reconnect_delay = int(imap_config.get('reconnect_delay', 30))
+
+        self.fetcher = IMAPFetcher(config)
+        self.connected = False
+
+    def run(self, should_stop: Callable[[], bool] = None) -> bool:
+        """
+        Listen until should_stop() returns True
+
+        Returns:
+            False if the server does not support IDLE (caller should poll),
+            True after a regular stop
+        """
+        should_stop = should_stop or (lambda: False)
+
+        try:
+            while not should_stop():
+                if not self.connected:
+                    if not self._connect():
+                        self._sleep(self.reconnect_delay, should_stop)
+                        continue
+
+                    if not self.fetcher.supports_idle():
+                        logger.warning(f"Server {self.config['imap']['host']} does not advertise IDLE")
+                        return False
+
+                    if self.trigger_on_connect:
+                        self.on_new_mail(self.fetcher)
+
+                try:
+                    if self.fetcher.idle_wait(self.idle_timeout, should_stop):
+                        self.on_new_mail(self.fetcher)
+                except (imaplib.IMAP4.abort, OSError) as e:
+                    logger.warning(f"IDLE connection lost: {e} - reconnecting in {self.reconnect_delay}s")
+                    self._drop_connection()
+                    self._sleep(self.reconnect_delay, should_stop)
+
+            return True
+        finally:
+            self.close()
+
+    def close(self):
+        """Log out if still connected"""
+        if self.connected:
+            self.fetcher.disconnect()
+            self.connected = False
+
+    def _connect(self) -> bool:
+        """Connect and select the configured mailbox"""
+        if not self.fetcher.connect():
+            return False
+        if not self.fetcher.select_mailbox():
+            self.fetcher.disconnect()
+            return False
+
+        self.connected = True
+        return True
+
+    def _drop_connection(self):
+        """Forget a broken connection without a LOGOUT round trip"""
+        try:
+            self.fetcher.connection.shutdown()
+        except Exception:
+            pass
+        self.fetcher.connection = None
+        self.connected = False
+
+    @staticmethod
+    def _sleep(seconds: int, should_stop: Callable[[], bool]):
+        """Sleep in 1s steps so a stop request is honoured quickly"""
+        for _ in range(seconds):
+            if should_stop():
+                break
+            time.sleep(1)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Persistent IMAP Session
+Long-lived, self-healing connection for the service daemon
+"""
+import imaplib
+import time
+from typing import Callable
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+from agents.imap_fetcher import IMAPFetcher
+
+logger = get_logger()
+
+class IMAPSession:
+    def __init__(self, config: dict, max_resume_attempts: int = 3):
+        """
+        Args:
+            config: Mail agent config (imap.reconnect_delay is the backoff
+                    base, imap.reconnect_max_delay its upper bound)
+            max_resume_attempts: Reconnects per process() call before giving up
+        """
+        self.config = config
+        self.fetcher = IMAPFetcher(config)
+        self.max_resume_attempts = max_resume_attempts
+
+        imap_config = config['imap']
+        self.backoff_base = int(imap_config.get('reconnect_delay', 30))
+        self.backoff_max = int(imap_config.get('reconnect_max_delay', 600))
+
+        self.connected = False
+        self.failures = 0
+        self.next_attempt = 0.0
+        # First cycle after (re)connect always fetches
+        self.needs_full_check = True
+
+        if not self.fetcher.use_uid:
+            logger.warning("IMAP session without sync_mode 'uid' cannot resume by UID")
+
+    def ensure_connected(self) -> bool:
+        """
+        Health check via NOOP, reconnect with exponential backoff
+
+        Returns:
+            True if the session is usable
+        """
+        if self.connected:
+            if self._healthy():
+                return True
+            logger.warning("IMAP session unhealthy - reconnecting")
+            self._drop_connection()
+
+        now = time.monotonic()
+        if now < self.next_attempt:
+            logger.info(f"IMAP reconnect backoff: next attempt in {self.next_attempt - now:.0f}s")
+            return False
+
+        if self.fetcher.connect() and self.fetcher.select_mailbox():
+            self.connected = True
+            self.failures = 0
+            self.needs_full_check = True
+            return True
+
+        if self.fetcher.connection:
+            self._drop_connection()
+
+        self.failures += 1
+        delay = min(self.backoff_base * 2 ** (self.failures - 1), self.backoff_max)
+        self.next_attempt = now + delay
+        logger.warning(f"IMAP connect failed ({self.failures}x) - backing off {delay}s")
+        return False
+
+    def has_new_mail(self) -> bool:
+        """True if the last NOOP (or any earlier response) reported new mail"""
+        if self.needs_full_check:
+            return True
+        return self.fetcher._pending_new_mail()
+
+    def process(self, handler: Callable[[IMAPFetcher], int]) -> int:
+        """
+        Run handler(fetcher) over the session
+
+        If the connection drops mid-batch, reconnect and run the handler
+        again - in UID sync mode it resumes after the last checkpointed UID.
+
+        Returns:
+            Total value returned by handler (processed messages)
+        """
+        total = 0
+
+        for attempt in range(self.max_resume_attempts + 1):
+            if not self.ensure_connected():
+                break
+
+            try:
+                total += handler(self.fetcher)
+            except (imaplib.IMAP4.abort, OSError) as e:
+                logger.warning(f"IMAP connection lost during batch: {e}")
+                self._drop_connection()
+                continue
+
+            # Fetch errors are logged, not raised - verify the batch really finished
+            if self._healthy():
+                # EXISTS reported meanwhile stays queued for has_new_mail()
+                self.needs_full_check = False
+                break
+
+            logger.warning(f"IMAP connection lost during batch - resuming "
+                           f"(attempt {attempt + 1}/{self.max_resume_attempts})")
+            self._drop_connection()
+
+        return total
+
+    def close(self):
+        """Log out if connected"""
+        if self.connected:
+            self.fetcher.disconnect()
+            self.connected = False
+
+    def _healthy(self) -> bool:
+        """NOOP round trip"""
+        try:
+            status, _ = self.fetcher.connection.noop()
+            return status == 'OK'
+        except Exception as e:
+            logger.debug(f"NOOP failed: {e}")
+            return False
+
+    def _drop_connection(self):
+        """Forget a broken connection without a LOGOUT round trip"""
+        try:
+            self.fetcher.connection.shutdown()
+        except Exception:
+            pass
+        self.fetcher.connection = None
+        self.connected = False
@@ -2,11 +2,13 @@
 """
 Nice2Know Mail Agent - Email Parser with S/MIME Support
 """
-import email
+import io
+import re
+import shutil
 from email import policy
-from email.header import decode_header
-from datetime import datetime
-from typing import Dict, List, Any
+from email.parser import BytesHeaderParser
+from html.parser import HTMLParser
+from typing import Dict, List, Any, Tuple
 import sys
 from pathlib import Path
 
@@ -14,93 +16,366 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from utils.logger import get_logger
+from agents.mail_stream import StreamingParse, SPILL_HEADER, SPILL_SIZE_HEADER
+from agents.parsed_mail import ParsedMail, PartRef, MailSource, decode_header_value, parse_date
 
 logger = get_logger()
 
-class MailParser:
+SMIME_TYPES = ('application/pkcs7-signature',
+               'application/x-pkcs7-signature',
+               'application/pkcs7-mime',
+               'application/x-pkcs7-mime')
+
+# Parser engines: 'default' builds rich header objects, 'compat32' keeps raw
+# strings (faster) and relies on the explicit RFC 2047 decoding below
+PARSER_ENGINES = {
+    'default': policy.default,
+    'compat32': policy.compat32
+}
+
+# Characters ignored inside base64 payloads
+_WHITESPACE = str.maketrans('', '', ' \t\r\n')
+
+# === HTML -> text for LLM input ===
+
+# Content dropped completely
+_HTML_SKIP_TAGS = {'script', 'style', 'head', 'title', 'noscript', 'template', 'svg', 'object', 'xml'}
+# Elements that start/end a paragraph
+_HTML_BLOCK_TAGS = {'p', 'div', 'section', 'article', 'header', 'footer', 'blockquote', 'pre',
+                    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'table', 'hr', 'address'}
+_HTML_VOID_TAGS = {'br', 'hr', 'img', 'meta', 'link', 'input', 'col', 'area', 'base', 'wbr', 'source'}
+_SPACE_RE = re.compile(r'[ \t\r\f\v\u00a0]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+_SOURCE_SPACE_RE = re.compile(r'\s+')
+
+class _HTMLTextExtractor(HTMLParser):
+    """
+    Streaming HTML to plain text converter
+    
+    Keeps paragraphs, list items ('- ' / '1. '), table rows (cells joined
+    by ' | ') and link targets; drops style/script, comments, conditional
+    Outlook markup and embedded (data:) images.
+    """
+    
     def __init__(self):
-        pass
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.skip_depth = 0
+        self.pre_depth = 0
+        self.lists = []        # stack of [tag, counter]
+        self.row_cells = None  # cell texts of the current table row
+        self.link_href = None
+        self.link_start = 0
+    
+    def _in_cell(self) -> bool:
+        return bool(self.row_cells)
+    
+    def _emit(self, text: str):
+        if self._in_cell():
+            self.row_cells[-1] += text
+        else:
+            self.out.append(text)
+    
+    def _newline(self, count: int = 1):
+        # Line breaks inside a cell would tear the row apart
+        self._emit(' ' if self._in_cell() else '\n' * count)
+    
+    def _position(self) -> int:
+        return len(self.row_cells[-1]) if self._in_cell() else len(self.out)
     
-    def parse(self, raw_email: bytes) -> Dict[str, Any]:
+    def _text_since(self, position: int) -> str:
+        return self.row_cells[-1][position:] if self._in_cell() else ''.join(self.out[position:])
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in _HTML_SKIP_TAGS:
+            self.skip_depth += 1
+            return
+        if self.skip_depth:
+            return
+        
+        if tag == 'br':
+            self._newline()
+        elif tag in ('ul', 'ol'):
+            self.lists.append([tag, 0])
+            self._newline()
+        elif tag == 'li':
+            self._newline()
+            indent = '  ' * max(len(self.lists) - 1, 0)
+            if self.lists and self.lists[-1][0] == 'ol':
+                self.lists[-1][1] += 1
+                self._emit(f"{indent}{self.lists[-1][1]}. ")
+            else:
+                self._emit(f"{indent}- ")
+        elif tag == 'tr':
+            self.row_cells = []
+        elif tag in ('td', 'th'):
+            if self.row_cells is None:
+                self.row_cells = []
+            self.row_cells.append('')
+        elif tag == 'a':
+            href = (dict(attrs).get('href') or '').strip()
+            if href.startswith(('http://', 'https://')):
+                self.link_href = href
+                self.link_start = self._position()
+        elif tag == 'img':
+            # src is never copied - data: URIs and tracking pixels vanish
+            alt = (dict(attrs).get('alt') or '').strip()
+            if alt:
+                self._emit(f"[{alt}]")
+        elif tag in _HTML_BLOCK_TAGS:
+            if tag == 'pre':
+                self.pre_depth += 1
+            self._newline(2)
+    
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _HTML_VOID_TAGS:
+            self.handle_endtag(tag)
+    
+    def handle_endtag(self, tag):
+        if tag in _HTML_SKIP_TAGS:
+            if self.skip_depth:
+                self.skip_depth -= 1
+            return
+        if self.skip_depth:
+            return
+        
+        if tag in ('ul', 'ol'):
+            if self.lists:
+                self.lists.pop()
+            self._newline()
+        elif tag == 'tr':
+            cells = [_SPACE_RE.sub(' ', cell).strip() for cell in (self.row_cells or [])]
+            self.row_cells = None
+            if any(cells):
+                self.out.append('\n' + ' | '.join(cells))
+        elif tag == 'a' and self.link_href:
+            # Only add the target if the link text does not already show it
+            if self.link_href.rstrip('/') not in self._text_since(self.link_start):
+                self._emit(f" ({self.link_href})")
+            self.link_href = None
+        elif tag in _HTML_BLOCK_TAGS:
+            if tag == 'pre' and self.pre_depth:
+                self.pre_depth -= 1
+            self._newline(2)
+    
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if not self.pre_depth:
+            # Source formatting is not layout
+            data = _SOURCE_SPACE_RE.sub(' ', data)
+        self._emit(data)
+    
+    def text(self) -> str:
+        if self.row_cells:
+            # Unclosed last row
+            self.handle_endtag('tr')
+        lines = [_SPACE_RE.sub(' ', line).strip() for line in ''.join(self.out).split('\n')]
+        return _BLANK_LINES_RE.sub('\n\n', '\n'.join(lines)).strip()
+
+def html_to_text(html: str) -> str:
+    """Convert an HTML mail body to compact plain text for LLM prompts"""
+    if not html:
+        return ''
+    
+    extractor = _HTMLTextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception as e:
+        logger.warning(f"HTML conversion incomplete: {e}")
+    return extractor.text()
+
+class MailParser:
+    def __init__(self, engine: str = 'default', spill_threshold_kb: int = 1024, spill_dir: str = None):
+        """
+        Args:
+            engine: 'default' (email.policy.default) or 'compat32' (fast path)
+            spill_threshold_kb: parse_file() writes attachment payloads larger
+                                than this to temporary files
+            spill_dir: Parent directory for spill files (default: system temp)
+        """
+        if engine not in PARSER_ENGINES:
+            logger.warning(f"Unknown parser engine '{engine}', using 'default'")
+            engine = 'default'
+        self.engine = engine
+        self.policy = PARSER_ENGINES[engine]
+        self.spill_threshold = int(spill_threshold_kb) * 1024
+        self.spill_dir = spill_dir
+    
+    def parse(self, raw_email: bytes) -> ParsedMail:
         """
         Parse raw email bytes into structured data
-        Returns dict with metadata and content
+        Returns a ParsedMail (dict-compatible) with metadata and content
         """
         try:
-            msg = email.message_from_bytes(raw_email, policy=policy.default)
+            stream = StreamingParse(raw_email, self.policy, spill_threshold=None).run()
+            return self._build(stream, MailSource(data=raw_email))
             
-            parsed = {
+        except Exception as e:
+            logger.error(f"Mail parsing failed: {e}")
+            return None
+    
+    def parse_file(self, mail_path: Path) -> ParsedMail:
+        """
+        Streaming parse of an .eml file
+        
+        The file is fed to the parser in chunks; attachment payloads above
+        the spill threshold are decoded into temporary files, so memory use
+        does not grow with the attachment size. Body text and the other
+        attachments are read from the file when accessed. Call release()
+        when done.
+        
+        Returns:
+            ParsedMail with sha256 of the file and spill_dir (None if
+            nothing was spilled)
+        """
+        stream = StreamingParse(mail_path, self.policy, self.spill_threshold, self.spill_dir)
+        try:
+            stream.run()
+            parsed = self._build(stream, MailSource(path=mail_path))
+        except Exception as e:
+            logger.error(f"Mail parsing failed: {e}")
+            if stream.spill_dir:
+                shutil.rmtree(stream.spill_dir, ignore_errors=True)
+            return None
+        
+        if stream.spilled:
+            logger.info(f"Spilled {stream.spilled} large part(s) to {stream.spill_dir}")
+        return parsed
+    
+    @staticmethod
+    def release(parsed: ParsedMail):
+        """Remove the spill files of a parse_file() result"""
+        spill_dir = getattr(parsed, 'spill_dir', None)
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+            parsed.spill_dir = None
+    
+    def _build(self, stream: StreamingParse, mail: MailSource) -> ParsedMail:
+        """ParsedMail from a streaming parse - the message tree is not kept"""
+        msg = stream.message
+        text_parts, attachments = self._walk_parts(msg, mail, self._locate_leaves(msg, stream.leaves))
+        
+        parsed = ParsedMail(
+            mail,
+            [(name, value) for name, value in msg.raw_items()
+             if name not in (SPILL_HEADER, SPILL_SIZE_HEADER)],
+            text_parts,
+            attachments,
+            stream.raw_size,
+            msg.get_content_type() == 'multipart/signed',
+            sha256=stream.sha256,
+            spill_dir=stream.spill_dir
+        )
+        
+        logger.info(f"Parsed mail: {parsed.subject[:50]}... "
+                   f"({len(attachments)} attachments, "
+                   f"S/MIME: {parsed.smime_signed})")
+        return parsed
+    
+    @staticmethod
+    def _locate_leaves(msg, leaves: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """
+        Map tree leaves to the byte ranges found by the streaming parse
+        
+        Both list the non-multipart parts in document order. If they
+        disagree (unusual structures), the parts keep their tree payload.
+        """
+        tree_leaves = [part for part in msg.walk() if not part.is_multipart()]
+        if len(tree_leaves) != len(leaves) or any(
+                part.get_content_type() != leaf['content_type'] for part, leaf in zip(tree_leaves, leaves)):
+            logger.debug("MIME structure not located in the raw mail - keeping part payloads")
+            return {}
+        return {id(part): leaf for part, leaf in zip(tree_leaves, leaves)}
+    
+    def parse_headers(self, source) -> Dict[str, Any]:
+        """
+        Envelope fields only - reads up to the header/body boundary
+        
+        Args:
+            source: Raw email bytes or path to an .eml file
+            
+        Returns:
+            Dict with message_id, from, to, cc, subject, date, headers,
+            smime_signed and source (None on error)
+        """
+        try:
+            if isinstance(source, (bytes, bytearray)):
+                header_block = self._read_header_block(io.BytesIO(source))
+            else:
+                with open(source, 'rb') as f:
+                    header_block = self._read_header_block(f)
+            
+            msg = BytesHeaderParser(policy=self.policy).parsebytes(header_block)
+            return {
                 'message_id': self._extract_message_id(msg),
-                'from': self._decode_header(msg.get('From', '')),
-                'to': self._decode_header(msg.get('To', '')),
-                'cc': self._decode_header(msg.get('Cc', '')),
-                'subject': self._decode_header(msg.get('Subject', '')),
-                'date': self._parse_date(msg.get('Date', '')),
-                'body': self._extract_body(msg),
-                'attachments': self._extract_attachments(msg),
+                'from': self._header(msg, 'From'),
+                'to': self._header(msg, 'To'),
+                'cc': self._header(msg, 'Cc'),
+                'subject': self._header(msg, 'Subject'),
+                'date': self._parse_date(self._header(msg, 'Date')),
                 'headers': dict(msg.items()),
-                'raw_size': len(raw_email),
-                'smime_signed': msg.get_content_type() == 'multipart/signed'
+                'smime_signed': msg.get_content_type() == 'multipart/signed',
+                'source': str(msg.get('X-N2K-Source', ''))
             }
             
-            logger.info(f"Parsed mail: {parsed['subject'][:50]}... "
-                       f"({len(parsed['attachments'])} attachments, "
-                       f"S/MIME: {parsed['smime_signed']})")
-            return parsed
-            
         except Exception as e:
-            logger.error(f"Mail parsing failed: {e}")
+            logger.error(f"Header parsing failed: {e}")
             return None
     
     @staticmethod
-    def _extract_message_id(msg) -> str:
+    def _read_header_block(fp) -> bytes:
+        """Lines up to and including the first empty line"""
+        lines = []
+        for line in fp:
+            lines.append(line)
+            if line in (b'\r\n', b'\n'):
+                break
+        return b''.join(lines)
+    
+    def _extract_message_id(self, msg) -> str:
         """Extract unique Message-ID header"""
-        msg_id = msg.get('Message-ID', '').strip('<>')
+        msg_id = self._header(msg, 'Message-ID').strip().strip('<>')
         if not msg_id:
             # Fallback: generate from date + subject hash
             import hashlib
-            raw = f"{msg.get('Date', '')}{msg.get('Subject', '')}"
+            raw = f"{self._header(msg, 'Date')}{self._header(msg, 'Subject')}"
             msg_id = f"generated-{hashlib.md5(raw.encode()).hexdigest()}"
         return msg_id
     
+    def _header(self, msg, name: str) -> str:
+        """Decoded header value - the same string for every engine"""
+        value = msg.get(name)
+        if value is None:
+            return ''
+        if self.engine != 'default':
+            # compat32 keeps raw strings: parse only the headers we actually use
+            value = policy.default.header_fetch_parse(name, value)
+        return self._decode_header(value)
+    
     @staticmethod
     def _decode_header(header_value: str) -> str:
         """Decode MIME encoded headers"""
-        if not header_value:
-            return ''
-        
-        decoded_parts = []
-        for part, encoding in decode_header(header_value):
-            if isinstance(part, bytes):
-                try:
-                    decoded = part.decode(encoding or 'utf-8', errors='replace')
-                except:
-                    decoded = part.decode('utf-8', errors='replace')
-            else:
-                decoded = part
-            decoded_parts.append(decoded)
-        
-        return ' '.join(decoded_parts)
+        return decode_header_value(header_value)
     
     @staticmethod
     def _parse_date(date_str: str) -> str:
         """Parse email date to ISO format"""
-        if not date_str:
-            return datetime.now().isoformat()
+        return parse_date(date_str)
+    
+    def _walk_parts(self, msg, mail: MailSource,
+                    located: Dict[int, Dict[str, Any]]) -> Tuple[List[PartRef], List[PartRef]]:
+        """
+        Single pass over the MIME tree: body text parts and attachments
         
-        try:
-            from email.utils import parsedate_to_datetime
-            dt = parsedate_to_datetime(date_str)
-            return dt.isoformat()
-        except:
-            return datetime.now().isoformat()
-    
-    def _extract_body(self, msg) -> Dict[str, str]:
-        """Extract plain text and HTML body, including S/MIME signed content"""
-        body = {
-            'plain': '',
-            'html': ''
-        }
+        Both are PartRef descriptors (byte range in the raw mail); nothing
+        is decoded here. Attachment sizes are estimated from the encoded
+        payload.
+        """
+        text_parts = []
+        attachments = []
         
         # Check if this is an S/MIME signed message
         if msg.get_content_type() == 'multipart/signed':
@@ -111,96 +386,84 @@ class MailParser:
                 msg = parts[0]  # Use first part (content) instead of signature
                 logger.debug(f"S/MIME content part type: {msg.get_content_type()}")
         
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                disposition = part.get_content_disposition()
-                
-                # Skip S/MIME signatures and certificates
-                if content_type in ['application/pkcs7-signature',
-                                   'application/x-pkcs7-signature',
-                                   'application/pkcs7-mime',
-                                   'application/x-pkcs7-mime']:
-                    logger.debug(f"Skipping S/MIME component: {content_type}")
-                    continue
-                
-                if disposition == 'attachment':
-                    continue
-                
-                try:
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        charset = part.get_content_charset() or 'utf-8'
-                        text = payload.decode(charset, errors='replace')
-                        
-                        if content_type == 'text/plain':
-                            body['plain'] += text
-                            logger.debug(f"Extracted {len(text)} chars of plain text")
-                        elif content_type == 'text/html':
-                            body['html'] += text
-                            logger.debug(f"Extracted {len(text)} chars of HTML")
-                except Exception as e:
-                    logger.warning(f"Failed to extract body part ({content_type}): {e}")
-        else:
-            # Non-multipart message
-            try:
-                payload = msg.get_payload(decode=True)
-                if payload:
-                    charset = msg.get_content_charset() or 'utf-8'
-                    text = payload.decode(charset, errors='replace')
-                    content_type = msg.get_content_type()
-                    
-                    if content_type == 'text/plain':
-                        body['plain'] = text
-                    elif content_type == 'text/html':
-                        body['html'] = text
-            except Exception as e:
-                logger.warning(f"Failed to extract body: {e}")
-        
-        # If still no content, log warning with details
-        if not body['plain'] and not body['html']:
-            logger.warning(f"No body content extracted - Content-Type: {msg.get_content_type()}")
-            logger.warning("Mail might be encrypted (S/MIME encrypted) or malformed")
-        else:
-            logger.info(f"Body extracted: {len(body['plain'])} chars plain, {len(body['html'])} chars HTML")
-        
-        return body
-    
-    def _extract_attachments(self, msg) -> List[Dict[str, Any]]:
-        """Extract attachment metadata (not content yet)"""
-        attachments = []
-        
-        # Handle S/MIME: if signed, look in first part
-        if msg.get_content_type() == 'multipart/signed':
-            parts = list(msg.get_payload())
-            if parts:
-                msg = parts[0]  # Use content part
+        single_part = not msg.is_multipart()
         
         for part in msg.walk():
-            disposition = part.get_content_disposition()
             content_type = part.get_content_type()
+            disposition = part.get_content_disposition()
             
-            # Skip S/MIME signatures
-            if content_type in ['application/pkcs7-signature',
-                               'application/x-pkcs7-signature',
-                               'application/pkcs7-mime',
-                               'application/x-pkcs7-mime']:
+            # Attached mails (message/rfc822) are containers, but listed as
+            # attachments like before; their own parts are walked as well
+            if part.is_multipart() and not (content_type == 'message/rfc822' and
+                                             disposition in ['attachment', 'inline']):
                 continue
             
+            # Skip S/MIME signatures and certificates
+            if content_type in SMIME_TYPES:
+                logger.debug(f"Skipping S/MIME component: {content_type}")
+                continue
+            
+            leaf = located.get(id(part))
+            ref = PartRef(
+                mail,
+                content_type,
+                disposition,
+                part.get_content_charset(),
+                str(part.get('Content-Transfer-Encoding', '')),
+                offset=leaf['start'] if leaf else None,
+                length=leaf['end'] - leaf['start'] if leaf else 0,
+                spill_path=leaf.get('spill_path') if leaf else None,
+                sha256=leaf.get('spill_sha256') if leaf else None,
+                part=None if leaf else part
+            )
+            
+            # Body text (a single-part mail is its own body, whatever the disposition)
+            if content_type in ('text/plain', 'text/html') and (single_part or disposition != 'attachment'):
+                text_parts.append(ref)
+            
             if disposition in ['attachment', 'inline']:
                 filename = part.get_filename()
                 if filename:
                     filename = self._decode_header(filename)
                 else:
                     # Generate filename from content type
-                    ext = part.get_content_type().split('/')[-1]
+                    ext = content_type.split('/')[-1]
                     filename = f"unnamed.{ext}"
                 
-                attachments.append({
-                    'filename': filename,
-                    'content_type': part.get_content_type(),
-                    'size': len(part.get_payload(decode=True) or b''),
-                    'part': part  # Store part object for later extraction
-                })
-        
-        return attachments
+                ref.filename = filename
+                ref.size = len(ref.read()) if part.is_multipart() else self._estimate_decoded_size(part)
+                attachments.append(ref)
+        
+        if not text_parts:
+            logger.warning(f"No body content found - Content-Type: {msg.get_content_type()}")
+            logger.warning("Mail might be encrypted (S/MIME encrypted) or malformed")
+        else:
+            logger.info(f"Body parts: {len(text_parts)} ({len(attachments)} attachment(s))")
+        
+        return text_parts, attachments
+    
+    @staticmethod
+    def _estimate_decoded_size(part) -> int:
+        """Decoded size from the encoded payload, without decoding it"""
+        # Parts left on the server by the selective IMAP fetch
+        omitted = part.get('X-N2K-Omitted')
+        if omitted and omitted.strip().isdigit():
+            return int(omitted)
+        
+        # Decoded to a spill file by the streaming parse
+        spilled = part.get(SPILL_SIZE_HEADER)
+        if spilled and str(spilled).strip().isdigit():
+            return int(spilled)
+        
+        raw = part.get_payload()
+        if not isinstance(raw, str):
+            return len(part.get_payload(decode=True) or b'')
+        
+        encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+        if encoding == 'base64':
+            data = raw.translate(_WHITESPACE)
+            return max(0, len(data) * 3 // 4 - data[-2:].count('='))
+        if encoding == 'quoted-printable':
+            # '=XX' is one byte, '=\n' a soft line break
+            return max(0, len(raw) - 2 * raw.count('='))
+        return len(raw.encode('utf-8', errors='surrogateescape'))
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Streaming MIME Parse
+Feeds an .eml from disk in chunks through BytesFeedParser; attachment
+bodies above a threshold are decoded into spill files instead of the tree
+"""
+import io
+import re
+import hashlib
+import binascii
+import tempfile
+from email import policy as email_policy
+from email.feedparser import BytesFeedParser
+from email.parser import BytesHeaderParser
+from pathlib import Path
+from typing import List, Optional
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Header added to spilled parts (path of the decoded payload) and its size
+SPILL_HEADER = 'X-N2K-Spilled'
+SPILL_SIZE_HEADER = 'X-N2K-Spilled-Size'
+
+# readline() limit - binary bodies without line breaks stay bounded too
+_READ_CHUNK = 64 * 1024
+# Bytes collected before handing them to the feed parser
+_FEED_CHUNK = 256 * 1024
+
+_NON_BASE64_RE = re.compile(rb'[^A-Za-z0-9+/=]')
+# Header field or continuation line (anything else ends a header block early)
+_HEADER_LINE_RE = re.compile(rb'^([^\s:]+[ \t]*:|[ \t])')
+
+class Base64Decoder:
+    """Incremental base64 decoder (whitespace/garbage tolerant)"""
+    def __init__(self):
+        self._rest = b''
+        self._done = False
+
+    def feed(self, data: bytes) -> bytes:
+        if self._done:
+            return b''
+        data = self._rest + _NON_BASE64_RE.sub(b'', data)
+        padding = data.find(b'=')
+        if padding >= 0:
+            # Padding ends the payload
+            data = data[:padding]
+            self._done = True
+            self._rest = b''
+            return self._decode_tail(data)
+        usable = len(data) - len(data) % 4
+        self._rest = data[usable:]
+        return binascii.a2b_base64(data[:usable]) if usable else b''
+
+    def flush(self) -> bytes:
+        data, self._rest = self._rest, b''
+        return self._decode_tail(data)
+
+    @staticmethod
+    def _decode_tail(data: bytes) -> bytes:
+        usable = len(data) - len(data) % 4
+        decoded = binascii.a2b_base64(data[:usable]) if usable else b''
+        tail = data[usable:]
+        if len(tail) >= 2:
+            decoded += binascii.a2b_base64(tail + b'=' * (4 - len(tail)))
+        return decoded
+
+class QuotedPrintableDecoder:
+    """Incremental quoted-printable decoder (works on complete lines)"""
+    def __init__(self):
+        self._rest = b''
+
+    def feed(self, data: bytes) -> bytes:
+        data = self._rest + data
+        end = data.rfind(b'\n') + 1
+        self._rest = data[end:]
+        return binascii.a2b_qp(data[:end]) if end else b''
+
+    def flush(self) -> bytes:
+        data, self._rest = self._rest, b''
+        return binascii.a2b_qp(data) if data else b''
+
+class IdentityDecoder:
+    """7bit / 8bit / binary"""
+    def feed(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+def get_decoder(transfer_encoding: str):
+    encoding = (transfer_encoding or '').strip().lower()
+    if encoding == 'base64':
+        return Base64Decoder()
+    if encoding == 'quoted-printable':
+        return QuotedPrintableDecoder()
+    return IdentityDecoder()
+
+def _split_eol(line: bytes):
+    """(content, line ending)"""
+    if line.endswith(b'\r\n'):
+        return line[:-2], b'\r\n'
+    if line.endswith(b'\n') or line.endswith(b'\r'):
+        return line[:-1], line[-1:]
+    return line, b''
+
+class _Leaf:
+    """Body of a non-multipart entity while it is being read"""
+    def __init__(self, header_lines: List[bytes], info):
+        self.header_lines = header_lines
+        self.info = info
+        self.chunks = []
+        self.buffered = 0
+        self.spill_path = None
+        self.spill_file = None
+        self.spill_hash = None
+        self.decoder = None
+        self.held_eol = b''
+        self.last_eol = b''
+        self.size = 0
+        self.body_start = 0
+
+class StreamingParse:
+    """
+    One streaming parse of an .eml file (or of raw bytes)
+
+    After run(): message (email.message.Message), raw_size, sha256,
+    spill_dir (None if nothing was spilled; the caller removes it) and
+    leaves - one entry per non-multipart part in document order with the
+    byte range of its encoded body ('start', 'end') and, if spilled,
+    'spill_path' / 'spill_size' / 'spill_sha256' (hashed while decoding).
+    """
+    def __init__(self, source, policy=email_policy.default,
+                 spill_threshold: Optional[int] = 1024 * 1024, spill_root: Optional[str] = None):
+        """
+        Args:
+            source: Path of the .eml file, or the raw bytes
+            spill_threshold: Attachment bodies above this many bytes go to
+                             spill files (None: never)
+        """
+        self.source = source if isinstance(source, (bytes, bytearray)) else Path(source)
+        self.policy = policy
+        self.spill_threshold = spill_threshold
+        self.spill_root = spill_root
+        self.spill_dir = None
+        self.spilled = 0
+        self.raw_size = 0
+        self.sha256 = None
+        self.message = None
+        self.leaves = []
+
+        self._parser = BytesFeedParser(policy=policy)
+        self._pending = bytearray()
+        self._boundaries = []
+        self._digest = []
+        self._leaf = None
+
+    def run(self):
+        digest = hashlib.sha256()
+        state = 'headers'
+        header_lines = []
+        at_line_start = True
+
+        try:
+            with self._open() as f:
+                while True:
+                    line = f.readline(_READ_CHUNK)
+                    if not line:
+                        break
+                    line_start = self.raw_size
+                    self.raw_size += len(line)
+                    digest.update(line)
+                    full_line = at_line_start
+                    at_line_start = line.endswith((b'\n', b'\r'))
+
+                    if state == 'headers':
+                        if not full_line or self._is_header_line(line, header_lines):
+                            header_lines.append(line)
+                            if full_line and line in (b'\r\n', b'\n', b'\r'):
+                                state = self._start_entity(header_lines, self.raw_size)
+                                header_lines = []
+                            continue
+                        # Header block without the empty separator line
+                        state = self._start_entity(header_lines, line_start)
+                        header_lines = []
+                        if state == 'headers' and not self._is_delimiter(line):
+                            header_lines.append(line)
+                            continue
+
+                    if full_line and self._boundaries and self._is_delimiter(line):
+                        state = self._delimiter(line, line_start)
+                        continue
+
+                    if state == 'body':
+                        self._body_data(line)
+                    else:
+                        # Preamble / epilogue
+                        self._feed(line)
+
+            if state == 'headers' and header_lines:
+                # Headers only, no body
+                self._start_entity(header_lines, self.raw_size)
+            if self._leaf is not None:
+                self._finish_leaf(self.raw_size, at_boundary=False)
+
+            self._flush_feed(force=True)
+            self.message = self._parser.close()
+        except Exception:
+            self._close_spill()
+            raise
+
+        self.sha256 = digest.hexdigest()
+        return self
+
+    def _is_header_line(self, line: bytes, header_lines: List[bytes]) -> bool:
+        if line in (b'\r\n', b'\n', b'\r'):
+            return True
+        if self._boundaries and self._is_delimiter(line):
+            return False
+        if not header_lines and self.raw_size == len(line) and line.startswith(b'From '):
+            # mbox 'From ' line
+            return True
+        return bool(_HEADER_LINE_RE.match(line))
+
+    def _open(self):
+        if isinstance(self.source, Path):
+            return open(self.source, 'rb')
+        return io.BytesIO(self.source)
+
+    # === Structure ===
+
+    def _start_entity(self, header_lines: List[bytes], body_start: int) -> str:
+        """Header block complete: container parts are fed, leaves buffered"""
+        info = BytesHeaderParser(policy=email_policy.compat32).parsebytes(b''.join(header_lines))
+        maintype = info.get_content_maintype()
+
+        if maintype == 'multipart':
+            boundary = info.get_boundary()
+            self._feed(b''.join(header_lines))
+            if boundary:
+                self._boundaries.append(boundary.encode('ascii', 'surrogateescape'))
+                self._digest.append(info.get_content_subtype() == 'digest')
+            return 'preamble'
+
+        # Parts of a multipart/digest default to message/rfc822
+        digest_part = bool(self._digest) and self._digest[-1] and info.get('Content-Type') is None
+        if digest_part or (maintype == 'message' and info.get_content_subtype() == 'rfc822'):
+            # Nested message: its header block follows
+            self._feed(b''.join(header_lines))
+            return 'headers'
+
+        self._leaf = _Leaf(header_lines, info)
+        self._leaf.body_start = body_start
+        return 'body'
+
+    def _is_delimiter(self, line: bytes) -> bool:
+        if not line.startswith(b'--'):
+            return False
+        stripped = line.rstrip(b' \t\r\n')
+        for boundary in self._boundaries:
+            if stripped == b'--' + boundary or stripped == b'--' + boundary + b'--':
+                return True
+        return False
+
+    def _delimiter(self, line: bytes, line_start: int) -> str:
+        stripped = line.rstrip(b' \t\r\n')
+        if self._leaf is not None:
+            self._finish_leaf(line_start, at_boundary=True)
+
+        # Innermost matching boundary; deeper (unterminated) levels end here
+        for level in range(len(self._boundaries) - 1, -1, -1):
+            boundary = self._boundaries[level]
+            if stripped == b'--' + boundary + b'--':
+                del self._boundaries[level:]
+                del self._digest[level:]
+                self._feed(line)
+                return 'epilogue'
+            if stripped == b'--' + boundary:
+                del self._boundaries[level + 1:]
+                del self._digest[level + 1:]
+                self._feed(line)
+                return 'headers'
+        return 'epilogue'
+
+    # === Leaf bodies ===
+
+    def _spillable(self, leaf: _Leaf) -> bool:
+        """Attachments may spill; body text always stays in the tree"""
+        if leaf.info.get_content_disposition() == 'attachment':
+            return True
+        return leaf.info.get_content_maintype() != 'text'
+
+    def _body_data(self, data: bytes):
+        leaf = self._leaf
+        leaf.last_eol = _split_eol(data)[1]
+        if leaf.spill_file is not None:
+            self._spill_write(data)
+            return
+
+        leaf.chunks.append(data)
+        leaf.buffered += len(data)
+        if (self.spill_threshold is not None and leaf.buffered > self.spill_threshold
+                and self._spillable(leaf)):
+            self._open_spill(leaf)
+            chunks, leaf.chunks = leaf.chunks, []
+            for chunk in chunks:
+                self._spill_write(chunk)
+
+    def _open_spill(self, leaf: _Leaf):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='n2k-spill-', dir=self.spill_root)
+        self.spilled += 1
+        leaf.spill_path = Path(self.spill_dir) / f"part-{self.spilled}.bin"
+        leaf.spill_file = open(leaf.spill_path, 'wb')
+        leaf.spill_hash = hashlib.sha256()
+        leaf.decoder = get_decoder(leaf.info.get('Content-Transfer-Encoding', ''))
+
+    def _spill_write(self, data: bytes):
+        """Decode into the spill file; the line ending before a boundary is held back"""
+        leaf = self._leaf
+        content, eol = _split_eol(data)
+        decoded = leaf.decoder.feed(leaf.held_eol + content)
+        leaf.held_eol = eol
+        if decoded:
+            leaf.spill_file.write(decoded)
+            leaf.spill_hash.update(decoded)
+            leaf.size += len(decoded)
+
+    def _finish_leaf(self, end: int, at_boundary: bool):
+        """
+        Args:
+            end: Offset where the body ends (delimiter line or end of input)
+        """
+        leaf, self._leaf = self._leaf, None
+
+        # The line ending before a delimiter belongs to the delimiter
+        if at_boundary:
+            end -= len(leaf.last_eol)
+        record = {'start': leaf.body_start, 'end': max(leaf.body_start, end),
+                  'content_type': leaf.info.get_content_type()}
+        self.leaves.append(record)
+
+        if leaf.spill_file is None:
+            self._feed(b''.join(leaf.header_lines))
+            for chunk in leaf.chunks:
+                self._feed(chunk)
+            return
+
+        tail = b'' if at_boundary else leaf.held_eol
+        decoded = leaf.decoder.feed(tail) + leaf.decoder.flush()
+        leaf.spill_file.write(decoded)
+        leaf.spill_hash.update(decoded)
+        leaf.size += len(decoded)
+        leaf.spill_file.close()
+        record['spill_path'] = leaf.spill_path
+        record['spill_size'] = leaf.size
+        record['spill_sha256'] = leaf.spill_hash.hexdigest()
+
+        # The tree only gets the headers plus where the payload went
+        header_lines = list(leaf.header_lines)
+        # Headers may end without the blank line (truncated part)
+        blank = header_lines.pop() if header_lines and header_lines[-1] in (b'\r\n', b'\n') else None
+        last = header_lines[-1] if header_lines else b''
+        eol = blank or (b'\r\n' if last.endswith(b'\r\n') else b'\n')
+        if last and not last.endswith(b'\n'):
+            header_lines[-1] = last + eol
+        header_lines.append(f"{SPILL_HEADER}: {leaf.spill_path}".encode('utf-8', 'surrogateescape') + eol)
+        header_lines.append(f"{SPILL_SIZE_HEADER}: {leaf.size}".encode('ascii') + eol)
+        header_lines.append(blank or eol)
+        self._feed(b''.join(header_lines))
+        if at_boundary:
+            # Keep an (empty) body line so the delimiter starts on its own line
+            self._feed(eol)
+        logger.debug(f"Spilled part ({leaf.info.get_content_type()}, {leaf.size} bytes) to {leaf.spill_path}")
+
+    def _close_spill(self):
+        if self._leaf is not None and self._leaf.spill_file is not None:
+            self._leaf.spill_file.close()
+
+    # === Feed parser ===
+
+    def _feed(self, data: bytes):
+        self._pending += data
+        self._flush_feed()
+
+    def _flush_feed(self, force: bool = False):
+        if self._pending and (force or len(self._pending) >= _FEED_CHUNK):
+            self._parser.feed(bytes(self._pending))
+            self._pending.clear()
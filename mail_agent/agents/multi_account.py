@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Multi-Account Ingestion
+Fetches several accounts/mailboxes concurrently (asyncio + worker threads)
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# Keys of an account entry that are not IMAP connection settings
+_ACCOUNT_KEYS = ('name', 'mailboxes', 'max_connections')
+
+def expand_accounts(config: dict) -> List[dict]:
+    """
+    Build one mail agent config per (account, mailbox)
+
+    mail_config.json:
+        "accounts": [
+            {"name": "support", "mailboxes": ["INBOX", "Tickets"], "max_connections": 2},
+            {"name": "it", "host": "imap.other.example", "mailboxes": ["INBOX"]}
+        ]
+
+    Every other key of an account overrides the shared 'imap' block.
+    Credentials come from secrets.json mail.accounts.<name>.
+    """
+    jobs = []
+    for account in config.get('accounts', []):
+        name = account.get('name')
+        if not name:
+            logger.warning(f"Skipping account without name: {account}")
+            continue
+
+        imap_config = dict(config['imap'])
+        imap_config.update({k: v for k, v in account.items() if k not in _ACCOUNT_KEYS})
+        imap_config['account'] = name
+
+        for mailbox in account.get('mailboxes') or [imap_config.get('mailbox', 'INBOX')]:
+            job = dict(config)
+            job['imap'] = dict(imap_config, mailbox=mailbox)
+            jobs.append(job)
+    return jobs
+
+def source_tag(imap_config: dict) -> Optional[str]:
+    """'<account>/<mailbox>' for configs built by expand_accounts, else None"""
+    account = imap_config.get('account')
+    if not account:
+        return None
+    return f"{account}/{imap_config.get('mailbox', 'INBOX')}"
+
+class MultiAccountIngestor:
+    def __init__(self, config: dict, handler: Callable[[dict], Optional[int]]):
+        """
+        Args:
+            config: Mail agent config with an 'accounts' list
+            handler: Blocking ingest function for one mailbox config,
+                     returns the number of processed messages (None on error).
+                     Runs in a worker thread.
+        """
+        self.config = config
+        self.handler = handler
+        self.jobs = expand_accounts(config)
+        # Overall number of simultaneous IMAP connections
+        self.max_parallel = max(1, int(config['imap'].get('max_parallel_accounts', 4)))
+        self.max_connections = {
+            account['name']: max(1, int(account.get('max_connections', 1)))
+            for account in config.get('accounts', []) if account.get('name')
+        }
+
+    def run(self) -> Dict[str, Optional[int]]:
+        """
+        Ingest all mailboxes
+
+        Returns:
+            {'<account>/<mailbox>': processed count or None on failure}
+        """
+        if not self.jobs:
+            logger.warning("No accounts configured")
+            return {}
+        return asyncio.run(self._run_all())
+
+    async def _run_all(self) -> Dict[str, Optional[int]]:
+        loop = asyncio.get_running_loop()
+        semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.max_connections.items()}
+
+        logger.info(f"Ingesting {len(self.jobs)} mailbox(es) from "
+                    f"{len(self.max_connections)} account(s), max {self.max_parallel} in parallel")
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel,
+                                thread_name_prefix='imap-account') as executor:
+            results = await asyncio.gather(*(
+                self._run_job(loop, executor, semaphores[job['imap']['account']], job)
+                for job in self.jobs
+            ))
+        return dict(results)
+
+    async def _run_job(self, loop, executor, semaphore: asyncio.Semaphore, job: dict):
+        source = source_tag(job['imap'])
+        async with semaphore:
+            try:
+                count = await loop.run_in_executor(executor, self.handler, job)
+            except Exception as e:
+                logger.error(f"Ingestion of {source} failed: {e}", exc_info=True)
+                count = None
+
+        logger.info(f"[{source}] processed {count if count is not None else 'ERROR'}")
+        return source, count
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Parsed Mail
+Compact parse result: raw headers decoded on access, body text read from
+the mail on first access, attachments as byte-range descriptors
+"""
+from email import policy
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Iterator
+import re
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+from agents.mail_stream import get_decoder
+
+logger = get_logger()
+
+# Folded header continuation (raw values keep the line breaks)
+_FOLD_RE = re.compile(r'\r?\n(?=[ \t])')
+
+_READ_CHUNK = 1024 * 1024
+
+def decode_header_value(header_value) -> str:
+    """Decode MIME encoded headers (RFC 2047), unfolding continuation lines"""
+    if not header_value:
+        return ''
+
+    header_value = _FOLD_RE.sub('', str(header_value))
+    try:
+        return str(make_header(decode_header(header_value)))
+    except Exception:
+        # Unknown charset - decode part by part
+        pass
+
+    decoded_parts = []
+    for part, encoding in decode_header(header_value):
+        if isinstance(part, bytes):
+            try:
+                decoded = part.decode(encoding or 'utf-8', errors='replace')
+            except Exception:
+                decoded = part.decode('utf-8', errors='replace')
+        else:
+            decoded = part
+        decoded_parts.append(decoded)
+
+    return ' '.join(decoded_parts)
+
+def parse_date(date_str: str) -> str:
+    """Parse email date to ISO format"""
+    if not date_str:
+        return datetime.now().isoformat()
+
+    try:
+        return parsedate_to_datetime(date_str).isoformat()
+    except Exception:
+        return datetime.now().isoformat()
+
+class MailSource:
+    """The raw mail a ParsedMail points into: bytes in memory or a file"""
+    __slots__ = ('data', 'path')
+
+    def __init__(self, data: bytes = None, path: Path = None):
+        self.data = data
+        self.path = Path(path) if path is not None else None
+
+    def iter_range(self, start: int, end: int) -> Iterator[bytes]:
+        """Bytes [start, end) in chunks"""
+        if self.data is not None:
+            for offset in range(start, end, _READ_CHUNK):
+                yield bytes(self.data[offset:min(end, offset + _READ_CHUNK)])
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(remaining, _READ_CHUNK))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+class PartRef:
+    """
+    A leaf MIME part by position: encoded body at [offset, offset + length)
+    of the mail, decoded on demand. Attachments are exposed like the former
+    attachment dicts (att['filename'], att['size'], att.get('filename')),
+    att['payload'] is the descriptor itself (read() / path).
+    """
+    __slots__ = ('mail', 'content_type', 'disposition', 'filename', 'charset',
+                 'transfer_encoding', 'offset', 'length', 'size', 'spill_path', 'sha256', 'part')
+
+    _KEYS = ('filename', 'content_type', 'size', 'offset', 'length', 'payload')
+
+    def __init__(self, mail: MailSource, content_type: str, disposition: Optional[str],
+                 charset: Optional[str], transfer_encoding: str,
+                 offset: Optional[int], length: int, filename: str = None, size: int = 0,
+                 spill_path: Path = None, sha256: str = None, part=None):
+        self.mail = mail
+        self.content_type = content_type
+        self.disposition = disposition
+        self.filename = filename
+        self.charset = charset
+        self.transfer_encoding = transfer_encoding
+        self.offset = offset
+        self.length = length
+        self.size = size
+        self.spill_path = spill_path
+        # SHA-256 of the decoded payload, known for spilled parts
+        self.sha256 = sha256
+        # Only set when the part could not be located in the raw mail
+        self.part = part
+
+    @property
+    def path(self) -> Optional[Path]:
+        """Spill file holding the decoded payload (streaming parse), else None"""
+        return self.spill_path
+
+    def iter_decoded(self) -> Iterator[bytes]:
+        """Decoded payload in chunks"""
+        if self.spill_path is not None:
+            with open(self.spill_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(_READ_CHUNK), b''):
+                    yield chunk
+            return
+
+        if self.part is not None and self.part.is_multipart():
+            # Attached mail (message/rfc822): the embedded message itself
+            yield b''.join(message.as_bytes() for message in self.part.get_payload())
+            return
+
+        if self.part is not None or self.offset is None:
+            yield (self.part.get_payload(decode=True) if self.part is not None else b'') or b''
+            return
+
+        decoder = get_decoder(self.transfer_encoding)
+        for chunk in self.mail.iter_range(self.offset, self.offset + self.length):
+            decoded = decoder.feed(chunk)
+            if decoded:
+                yield decoded
+        tail = decoder.flush()
+        if tail:
+            yield tail
+
+    def read(self) -> bytes:
+        """Decoded payload (not kept - the descriptor stays small)"""
+        return b''.join(self.iter_decoded())
+
+    def text(self) -> str:
+        return self.read().decode(self.charset or 'utf-8', errors='replace')
+
+    # === Dict-compatible view ===
+
+    def __getitem__(self, key: str):
+        if key == 'payload':
+            return self
+        if key in self._KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._KEYS
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self._KEYS else default
+
+    def __repr__(self):
+        return (f"PartRef({self.content_type!r}, filename={self.filename!r}, "
+                f"offset={self.offset}, length={self.length}, size={self.size})")
+
+class ParsedMail:
+    """
+    Result of MailParser.parse()/parse_file()
+
+    Keeps the raw top-level headers, references to the text parts and
+    attachment descriptors - no email.message tree. Supports the former
+    dict interface: parsed['subject'], parsed['body']['plain'],
+    parsed.get('source', ''), 'attachments' in parsed, dict(parsed.items()).
+    """
+    __slots__ = ('mail', 'raw_headers', 'text_parts', 'attachments', 'raw_size',
+                 'smime_signed', 'sha256', 'spill_dir', '_decoded', '_body')
+
+    # Dict key -> attribute
+    _KEYS = {
+        'message_id': 'message_id',
+        'from': 'sender',
+        'to': 'to',
+        'cc': 'cc',
+        'subject': 'subject',
+        'date': 'date',
+        'body': 'body',
+        'attachments': 'attachments',
+        'headers': 'headers',
+        'raw_size': 'raw_size',
+        'smime_signed': 'smime_signed',
+        'source': 'source',
+        'sha256': 'sha256',
+        'spill_dir': 'spill_dir'
+    }
+
+    def __init__(self, mail: MailSource, raw_headers: List[tuple], text_parts: List[PartRef],
+                 attachments: List[PartRef], raw_size: int, smime_signed: bool,
+                 sha256: str = None, spill_dir: str = None):
+        self.mail = mail
+        self.raw_headers = raw_headers
+        self.text_parts = text_parts
+        self.attachments = attachments
+        self.raw_size = raw_size
+        self.smime_signed = smime_signed
+        self.sha256 = sha256
+        self.spill_dir = spill_dir
+        self._decoded = {}
+        self._body = None
+
+    # === Headers (decoded on first access) ===
+
+    def raw_header(self, name: str) -> Optional[str]:
+        lower = name.lower()
+        for header_name, value in self.raw_headers:
+            if header_name.lower() == lower:
+                return value
+        return None
+
+    def header(self, name: str) -> str:
+        """Decoded value of the first header with this name ('' if missing)"""
+        key = name.lower()
+        if key not in self._decoded:
+            raw = self.raw_header(name)
+            if raw is None:
+                self._decoded[key] = ''
+            else:
+                self._decoded[key] = decode_header_value(policy.default.header_fetch_parse(name, raw))
+        return self._decoded[key]
+
+    @property
+    def sender(self) -> str:
+        return self.header('From')
+
+    @property
+    def to(self) -> str:
+        return self.header('To')
+
+    @property
+    def cc(self) -> str:
+        return self.header('Cc')
+
+    @property
+    def subject(self) -> str:
+        return self.header('Subject')
+
+    @property
+    def date(self) -> str:
+        if '@date' not in self._decoded:
+            self._decoded['@date'] = parse_date(self.header('Date'))
+        return self._decoded['@date']
+
+    @property
+    def message_id(self) -> str:
+        if '@message_id' not in self._decoded:
+            msg_id = self.header('Message-ID').strip().strip('<>')
+            if not msg_id:
+                # Fallback: generate from date + subject hash
+                import hashlib
+                raw = f"{self.header('Date')}{self.header('Subject')}"
+                msg_id = f"generated-{hashlib.md5(raw.encode()).hexdigest()}"
+            self._decoded['@message_id'] = msg_id
+        return self._decoded['@message_id']
+
+    @property
+    def source(self) -> str:
+        """'<account>/<mailbox>' set by the multi-account ingestion"""
+        return self.raw_header('X-N2K-Source') or ''
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """All top-level headers, decoded (later duplicates win, like dict(msg.items()))"""
+        return {name: str(policy.default.header_fetch_parse(name, value))
+                for name, value in self.raw_headers}
+
+    # === Body (materialized on first access) ===
+
+    @property
+    def body(self) -> Dict[str, str]:
+        if self._body is None:
+            body = {'plain': '', 'html': ''}
+            for part in self.text_parts:
+                try:
+                    text = part.text()
+                except Exception as e:
+                    logger.warning(f"Failed to extract body part ({part.content_type}): {e}")
+                    continue
+                body['plain' if part.content_type == 'text/plain' else 'html'] += text
+            self._body = body
+        return self._body
+
+    def relocate(self, path: Path):
+        """The raw mail file was moved (e.g. adopted from the spool)"""
+        self.mail.path = Path(path)
+
+    # === Dict-compatible view ===
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, self._KEYS[key])
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        return getattr(self, self._KEYS[key]) if key in self._KEYS else default
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._KEYS
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def keys(self):
+        return self._KEYS.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self._KEYS]
+
+    def __repr__(self):
+        return f"ParsedMail(subject={self.subject[:40]!r}, attachments={len(self.attachments)})"
@@ -8,10 +8,15 @@ import argparse
 import time
 from pathlib import Path
 from agents.imap_fetcher import IMAPFetcher
+from agents.imap_idle import IMAPIdleListener
+from agents.multi_account import MultiAccountIngestor
+from agents.imap_backfill import IMAPBackfill
 from agents.mail_parser import MailParser
 from agents.attachment_handler import AttachmentHandler
 from utils.logger import get_logger
 from utils.file_handler import FileHandler
+from utils.parse_cache import ParseCache
+from utils.thread_index import ThreadIndex, default_index_path
 
 logger = get_logger()
 
@@ -69,11 +74,18 @@ def load_config(config_path: str = None) -> dict:
     config = {
         'imap': mail_config.get('imap', {}),
         'smtp': mail_config.get('smtp', {}),
+        # Optional: several accounts/mailboxes ingested concurrently
+        'accounts': mail_config.get('accounts', []),
         'storage': {
             'base_path': storage_base_path,
+            'layout': app_config.get('storage', {}).get('layout', 'flat'),
+            # Packing of old sent/archived/failed mails (utils/cold_storage.py)
+            'cold_tier': app_config.get('storage', {}).get('cold_tier', {}),
             'max_attachment_size_mb': app_config.get('storage', {}).get('max_attachment_size_mb', 50)
         },
         'logging': app_config.get('logging', {}),
+        # MailParser engine: 'default' or 'compat32' (see utils/benchmark_parser.py)
+        'parser': app_config.get('parser', {'engine': 'default'}),
         'app_name': app_config.get('app_name', 'Nice2Know'),
         'version': app_config.get('version', '1.0.0'),
         # Add default processing/filters if not in app_config
@@ -95,95 +107,205 @@ def load_config(config_path: str = None) -> dict:
     
     return config
 
-def run_agent(config: dict, dry_run: bool = False):
-    """Main agent execution"""
-    logger.info("=" * 60)
-    logger.info(f"{config.get('app_name', 'Nice2Know')} Mail Agent - Starting")
-    logger.info(f"Version: {config.get('version', '1.0.0')}")
-    logger.info("=" * 60)
-    logger.info(f"Storage path: {config['storage']['base_path']}")
-    logger.info(f"Dry run mode: {dry_run}")
-    logger.info("=" * 60)
-    
-    # Initialize components
-    file_handler = FileHandler(config['storage']['base_path'])
-    fetcher = IMAPFetcher(config)
-    parser = MailParser()
+def create_components(config: dict):
+    """Create file handler, parser, attachment handler, parse cache and thread index"""
+    file_handler = FileHandler(config['storage']['base_path'], config['storage'].get('layout', 'flat'))
+    parser_config = config.get('parser', {})
+    # Spill files next to the blob store: moving them there is a rename, not a copy
+    spill_dir = Path(parser_config.get('spill_dir') or Path(config['storage']['base_path']) / 'cache' / 'spill')
+    spill_dir.mkdir(parents=True, exist_ok=True)
+    parser = MailParser(
+        parser_config.get('engine', 'default'),
+        spill_threshold_kb=parser_config.get('spill_threshold_kb', 1024),
+        spill_dir=str(spill_dir)
+    )
     att_handler = AttachmentHandler(
         file_handler,
         config['storage']['max_attachment_size_mb']
     )
+    parse_cache = ParseCache(Path(config['storage']['base_path']) / 'cache' / 'parsed')
+    thread_index = ThreadIndex(default_index_path(config['storage']['base_path']))
+    return file_handler, parser, att_handler, parse_cache, thread_index
+
+def process_mailbox(fetcher: IMAPFetcher, config: dict, components: tuple,
+                    dry_run: bool = False, messages=None, checkpoint=None, on_failure=None) -> int:
+    """
+    Fetch and process messages over an already selected connection
     
-    # Connect to mail server
-    if not fetcher.connect():
-        logger.error("Failed to connect to mail server. Exiting.")
-        return 1
+    Args:
+        messages: Optional SpooledMessage iterator (default: new messages
+                  according to the processing settings)
+        checkpoint: Called with each processed id (default: fetcher.checkpoint)
+        on_failure: Called with each failed id, which is retried later
+                    (default: fetcher.mark_failed)
     
-    if not fetcher.select_mailbox():
-        logger.error("Failed to select mailbox. Exiting.")
-        fetcher.disconnect()
-        return 1
+    Returns:
+        Number of processed messages
+    """
+    file_handler, parser, att_handler, parse_cache, thread_index = components
+    checkpoint = checkpoint or fetcher.checkpoint
+    on_failure = on_failure or fetcher.mark_failed
     
-    # Fetch messages
-    messages = fetcher.fetch_messages(
-        limit=config['processing']['fetch_limit'],
-        unseen_only=config['processing']['fetch_unseen_only']
-    )
-    
-    if not messages:
-        logger.info("No messages to process")
-        fetcher.disconnect()
-        return 0
+    # Fetch messages - streamed through the spool directory, one in memory at a time
+    if messages is None:
+        messages = fetcher.iter_messages(
+            limit=config['processing']['fetch_limit'],
+            unseen_only=config['processing']['fetch_unseen_only']
+        )
     
     # Process each message
+    fetched_count = 0
     processed_count = 0
-    target_folder = config['filters'].get('processed_folder', 'processed')
-    folder_ensured = False
+    processed_ids = []
     
-    for msg_id, raw_email in messages:
+    for spooled in messages:
+        msg_id = spooled.message_id
+        fetched_count += 1
         logger.info(f"\n--- Processing message {msg_id} ---")
         
+        parsed = None
+        failed = True
         try:
-            # Parse email
-            parsed = parser.parse(raw_email)
+            # Parse email - streamed from the spool file, large attachments spill to disk
+            parsed = parser.parse_file(spooled.path)
             if not parsed:
                 logger.error(f"Failed to parse message {msg_id}")
                 continue
             
             # Save raw EML if configured
+            mail_path = None
             if config['processing']['save_raw_eml'] and not dry_run:
-                file_handler.save_mail(
+                mail_path = file_handler.adopt_mail(
                     parsed['message_id'],
-                    raw_email
+                    spooled.path
                 )
+                # Body and attachments are read from the raw mail on access
+                parsed.relocate(mail_path)
+                # Later stages load this instead of parsing the .eml again
+                parse_cache.put_digest(parsed['sha256'], parsed)
+            
+            # Map the message to its conversation (Message-ID / In-Reply-To / References)
+            if not dry_run:
+                thread_id = thread_index.add_parsed(parsed, mail_path.name if mail_path else None)
+                if thread_id != parsed['message_id']:
+                    logger.info(f"Reply in thread {thread_id}")
             
             # Extract attachments
             if config['processing']['extract_attachments'] and parsed['attachments']:
                 if not dry_run:
-                    saved_attachments = att_handler.extract_attachments(parsed['attachments'])
+                    saved_attachments = att_handler.extract_attachments(
+                        parsed['attachments'],
+                        mail_id=parsed['message_id'],
+                        mail_file=mail_path.name if mail_path else None
+                    )
                     logger.info(f"Saved {len(saved_attachments)} attachment(s)")
                 else:
                     logger.info(f"[DRY RUN] Would extract {len(parsed['attachments'])} attachment(s)")
             
-            # Mark as read if configured
-            if config['filters']['mark_as_read'] and not dry_run:
-                fetcher.mark_as_read(msg_id)
-            
-            # Move to processed folder if configured
-            if config['filters'].get('move_to_processed', False) and not dry_run:
-                # Ensure folder exists (only once)
-                if not folder_ensured:
-                    fetcher._ensure_folder(target_folder)
-                    folder_ensured = True
-                fetcher.move_to_folder(msg_id, target_folder)
+            # Advance UID checkpoint (no-op in search mode)
+            if not dry_run:
+                checkpoint(msg_id)
             
+            processed_ids.append(msg_id)
             processed_count += 1
+            failed = False
             
         except Exception as e:
             logger.error(f"Error processing message {msg_id}: {e}", exc_info=True)
+        finally:
+            parser.release(parsed)
+            spooled.discard()
+            # Later checkpoints move past this UID - keep it for a retry
+            if failed and not dry_run:
+                on_failure(msg_id)
     
-    # Cleanup
-    fetcher.disconnect()
+    if not fetched_count:
+        logger.info("No messages to process")
+        return 0
+    
+    # Flag / move all processed messages at once (constant round trips per cycle)
+    if processed_ids and not dry_run:
+        post_process(fetcher, config, processed_ids)
+    
+    logger.info(f"Processed {processed_count} message(s)")
+    return processed_count
+
+def post_process(fetcher: IMAPFetcher, config: dict, message_ids: list):
+    """Mark as read / move to the processed folder in bulk, as configured"""
+    if config['filters']['mark_as_read']:
+        fetcher.mark_as_read_bulk(message_ids)
+    
+    if config['filters'].get('move_to_processed', False):
+        target_folder = config['filters'].get('processed_folder', 'processed')
+        fetcher._ensure_folder(target_folder)
+        fetcher.move_messages(message_ids, target_folder)
+
+def log_banner(config: dict, dry_run: bool):
+    """Log startup banner"""
+    logger.info("=" * 60)
+    logger.info(f"{config.get('app_name', 'Nice2Know')} Mail Agent - Starting")
+    logger.info(f"Version: {config.get('version', '1.0.0')}")
+    logger.info("=" * 60)
+    logger.info(f"Storage path: {config['storage']['base_path']}")
+    logger.info(f"Dry run mode: {dry_run}")
+    logger.info("=" * 60)
+
+def ingest_mailbox(config: dict, components: tuple, dry_run: bool = False):
+    """
+    Connect, process one mailbox and disconnect
+    
+    Returns:
+        Number of processed messages, None if connect/select failed
+    """
+    fetcher = IMAPFetcher(config)
+    
+    # Connect to mail server
+    if not fetcher.connect():
+        logger.error("Failed to connect to mail server.")
+        return None
+    
+    if not fetcher.select_mailbox():
+        logger.error("Failed to select mailbox.")
+        fetcher.disconnect()
+        return None
+    
+    try:
+        return process_mailbox(fetcher, config, components, dry_run)
+    finally:
+        # Cleanup
+        fetcher.disconnect()
+
+def run_accounts(config: dict, dry_run: bool = False):
+    """Ingest all configured accounts/mailboxes concurrently"""
+    ingestor = MultiAccountIngestor(
+        config,
+        # Own components per worker thread
+        lambda job: ingest_mailbox(job, create_components(job), dry_run)
+    )
+    results = ingestor.run()
+    
+    logger.info("=" * 60)
+    for source, count in results.items():
+        logger.info(f"  {source}: {count if count is not None else 'FAILED'}")
+    logger.info(f"Processing complete. Processed {sum(c or 0 for c in results.values())} message(s)")
+    logger.info("=" * 60)
+    
+    return 1 if results and all(c is None for c in results.values()) else 0
+
+def run_agent(config: dict, dry_run: bool = False):
+    """Main agent execution"""
+    log_banner(config, dry_run)
+    
+    if config.get('accounts'):
+        return run_accounts(config, dry_run)
+    
+    # Initialize components
+    components = create_components(config)
+    processed_count = ingest_mailbox(config, components, dry_run)
+    
+    if processed_count is None:
+        logger.error("Mailbox not available. Exiting.")
+        return 1
     
     logger.info("=" * 60)
     logger.info(f"Processing complete. Processed {processed_count} message(s)")
@@ -191,6 +313,78 @@ def run_agent(config: dict, dry_run: bool = False):
     
     return 0
 
+def run_backfill(config: dict, dry_run: bool = False, connections: int = None):
+    """Initial sync of all existing messages over parallel connections"""
+    log_banner(config, dry_run)
+    components = create_components(config)
+    
+    backfill = IMAPBackfill(
+        config,
+        lambda fetcher, uid_list, checkpoint, on_failure: process_mailbox(
+            fetcher, config, components, dry_run,
+            messages=fetcher.iter_ids(uid_list),
+            checkpoint=checkpoint,
+            on_failure=on_failure
+        ),
+        connections=connections,
+        dry_run=dry_run
+    )
+    processed_count = backfill.run()
+    
+    if processed_count is None:
+        logger.error("Mailbox not available. Exiting.")
+        return 1
+    
+    logger.info("=" * 60)
+    logger.info(f"Backfill finished. Processed {processed_count} message(s)")
+    logger.info("=" * 60)
+    
+    return 0 if backfill.ranges_done == backfill.ranges_total else 1
+
+def run_loop(config: dict, dry_run: bool = False, interval: int = 60):
+    """Poll the mailbox every interval seconds"""
+    logger.info(f"Starting loop mode (interval: {interval}s)")
+    logger.info("Press Ctrl+C to stop")
+    
+    while True:
+        try:
+            run_agent(config, dry_run)
+            logger.info(f"Waiting {interval} seconds before next run...")
+            time.sleep(interval)
+        except KeyboardInterrupt:
+            logger.info("\nLoop interrupted by user")
+            break
+
+def run_idle(config: dict, dry_run: bool = False, interval: int = 60):
+    """
+    IDLE push mode: keep one connection open and process as soon as the
+    server reports new mail. Falls back to polling without IDLE support.
+    """
+    log_banner(config, dry_run)
+    components = create_components(config)
+    
+    if config.get('accounts'):
+        logger.warning("IDLE watches the 'imap' mailbox only - use --loop for multi-account ingestion")
+    
+    listener = IMAPIdleListener(
+        config,
+        on_new_mail=lambda fetcher: process_mailbox(fetcher, config, components, dry_run)
+    )
+    
+    logger.info("Starting IDLE mode")
+    logger.info("Press Ctrl+C to stop")
+    
+    try:
+        if listener.run():
+            return
+    except KeyboardInterrupt:
+        logger.info("\nIDLE interrupted by user")
+        listener.close()
+        return
+    
+    logger.warning("Server does not support IDLE - falling back to polling")
+    run_loop(config, dry_run, interval)
+
 def main():
     parser = argparse.ArgumentParser(description='Nice2Know Mail Agent')
     parser.add_argument('--config', help='Path to mail config JSON file')
@@ -198,26 +392,26 @@ def main():
                        help='Test mode - fetch but do not save or modify')
     parser.add_argument('--loop', action='store_true',
                        help='Run continuously in loop mode')
+    parser.add_argument('--idle', action='store_true',
+                       help='Run continuously using IMAP IDLE push (falls back to --loop)')
     parser.add_argument('--interval', type=int, default=60,
                        help='Loop interval in seconds (default: 60)')
+    parser.add_argument('--backfill', action='store_true',
+                       help='Initial sync of all existing messages over parallel connections')
+    parser.add_argument('--connections', type=int,
+                       help='Parallel IMAP connections for --backfill (default: imap.backfill_connections or 4)')
     
     args = parser.parse_args()
     
     try:
         config = load_config(args.config)
         
-        if args.loop:
-            logger.info(f"Starting loop mode (interval: {args.interval}s)")
-            logger.info("Press Ctrl+C to stop")
-            
-            while True:
-                try:
-                    run_agent(config, args.dry_run)
-                    logger.info(f"Waiting {args.interval} seconds before next run...")
-                    time.sleep(args.interval)
-                except KeyboardInterrupt:
-                    logger.info("\nLoop interrupted by user")
-                    break
+        if args.backfill:
+            return run_backfill(config, args.dry_run, args.connections)
+        elif args.idle:
+            run_idle(config, args.dry_run, args.interval)
+        elif args.loop:
+            run_loop(config, args.dry_run, args.interval)
         else:
             return run_agent(config, args.dry_run)
             
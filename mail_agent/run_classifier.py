@@ -77,54 +77,29 @@ def get_storage_base() -> Path:
     
     return storage_base.resolve()
 
-def get_unclassified_mails(mail_dir: Path, classified_dir: Path, reclassify: bool = False) -> List[Path]:
+def get_storage_layout():
+    """Storage layout from config (flat state folders or per-mail bundles)"""
+    sys.path.insert(0, str(WORKING_DIR))
+    from utils.storage_layout import create_layout
+    config = load_application_config()
+    return create_layout(get_storage_base(), config.get('storage', {}).get('layout', 'flat'))
+
+def get_unclassified_mails(layout, reclassify: bool = False) -> List[Path]:
     """
-    Get all .eml files that don't have a classification JSON yet
+    Get all new .eml files that don't have a classification JSON yet
     Sorted from oldest to newest
     
     Args:
-        mail_dir: Directory containing .eml files
-        classified_dir: Directory containing classification JSONs
+        layout: Storage layout (utils.storage_layout)
         reclassify: If True, return all mails regardless of classification status
     """
-    if not mail_dir.exists():
-        return []
-    
-    mail_files = list(mail_dir.glob("*.eml"))
-    
-    if not mail_files:
-        return []
-    
+    # Oldest to newest (FIFO)
     if reclassify:
         # Return all mails
-        unclassified = mail_files
-    else:
-        # Filter out already classified mails
-        unclassified = []
-        for mail_file in mail_files:
-            # Generate expected classification filename
-            mail_parts = mail_file.stem.split('_')
-            if len(mail_parts) >= 2:
-                mail_timestamp = f"{mail_parts[0]}_{mail_parts[1]}"
-            else:
-                mail_timestamp = mail_file.stem
-            
-            classification_file = classified_dir / f"{mail_timestamp}_identifier.json"
-            
-            # Only process if no classification exists
-            if not classification_file.exists():
-                unclassified.append(mail_file)
-    
-    def get_timestamp(filepath: Path) -> datetime:
-        try:
-            filename = filepath.stem
-            timestamp_str = '_'.join(filename.split('_')[:2])
-            return datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
-        except:
-            return datetime.fromtimestamp(filepath.stat().st_mtime)
-    
-    # Sort oldest to newest (FIFO)
-    return sorted(unclassified, key=get_timestamp)
+        return layout.mails('new')
+    
+    # Only process if no classification exists (registry query)
+    return layout.mails('new', without_artifact='identifier')
 
 def extract_mail_id(mail_path: Path) -> str:
     """
@@ -218,24 +193,32 @@ def classify_mail(mail_path: Path, output_dir: Path, timeout: int = 300) -> Tupl
     temp_txt = None
     try:
         sys.path.insert(0, str(WORKING_DIR))
-        from agents.mail_parser import MailParser
+        from utils.parse_cache import ParseCache
+        from agents.mail_parser import html_to_text
+        from agents.body_reducer import reduce_body
         
-        parser = MailParser()
-        with open(mail_path, 'rb') as f:
-            raw_email = f.read()
-        
-        parsed = parser.parse(raw_email)
+        # Parse-once sidecar (written at ingestion or by an earlier stage)
+        parse_cache = ParseCache(get_storage_base() / 'cache' / 'parsed')
+        parsed = parse_cache.load(mail_path)
         if not parsed:
             print(f"{RED}✗ (parsing failed){NC}")
             return False, None, None
         
-        # Get plaintext (prefer plain over HTML)
-        plaintext = parsed['body']['plain'] or parsed['body']['html']
+        # Get plaintext (prefer plain over HTML converted to text)
+        plaintext = parsed['body']['plain'] or html_to_text(parsed['body']['html'])
         
         if not plaintext:
             print(f"{RED}✗ (no body content){NC}")
             return False, None, None
         
+        # Drop quoted history, signatures and disclaimers from the prompt
+        reduced = parsed.get('reduced') or reduce_body(plaintext)
+        if reduced['text']:
+            plaintext = reduced['text']
+        if reduced['tokens_saved'] > 0:
+            print(f"  {CYAN}Body reduced: {reduced['tokens_before']} -> {reduced['tokens_after']} tokens "
+                  f"(-{reduced['tokens_saved']}){NC}")
+        
         # Create temporary .txt file for LLM
         temp_txt = mail_path.parent / f"{mail_path.stem}_decoded.txt"
         with open(temp_txt, 'w', encoding='utf-8') as f:
@@ -350,7 +333,7 @@ def display_classification_summary(classification: dict):
     except Exception as e:
         print(f"  {YELLOW}Could not display summary: {e}{NC}")
 
-def process_mail(mail_path: Path, classified_dir: Path) -> Tuple[bool, Optional[dict]]:
+def process_mail(mail_path: Path, layout) -> Tuple[bool, Optional[dict]]:
     """
     Classify a single mail
     
@@ -359,10 +342,22 @@ def process_mail(mail_path: Path, classified_dir: Path) -> Tuple[bool, Optional[
     """
     print(f"\n{CYAN}Processing: {mail_path.name}{NC}")
     
+    classified_dir = layout.artifact_path(mail_path, 'identifier').parent
     success, output_path, classification = classify_mail(mail_path, classified_dir, timeout=300)
     
     if success:
         print(f"  {GREEN}→ Classification saved to: {output_path.name}{NC}")
+        layout.record_artifact(mail_path, 'identifier')
+        
+        # Remember the result for later mails of the same conversation
+        sys.path.insert(0, str(WORKING_DIR))
+        from utils.thread_index import ThreadIndex, default_index_path
+        thread_index = ThreadIndex(default_index_path(get_storage_base()))
+        thread_row = thread_index.ensure_indexed(mail_path)
+        if thread_row:
+            thread_index.record_artifact(thread_row['message_id'], 'classification', output_path)
+        thread_index.close()
+        
         if classification:
             display_classification_summary(classification)
         return True, classification
@@ -381,19 +376,22 @@ def main():
     # Get storage base from config
     storage_base = get_storage_base()
     
-    # Define directories from config
-    mail_dir = storage_base / 'mails'
-    classified_dir = storage_base / 'classified'
+    layout = get_storage_layout()
+    layout.ensure_directories()
     
-    # Create directories if they don't exist
-    for directory in [mail_dir, classified_dir]:
-        directory.mkdir(parents=True, exist_ok=True)
+    # Define directories from config
+    if layout.name == 'bundle':
+        mail_dir = classified_dir = layout.root
+    else:
+        mail_dir = storage_base / 'mails'
+        classified_dir = storage_base / 'classified'
     
     print(f"{BLUE}{'=' * 60}{NC}")
     print(f"{BLUE}Nice2Know - Mail Classification Pipeline (Stage 0){NC}")
     print(f"{BLUE}{'=' * 60}{NC}")
     print(f"Working directory:      {WORKING_DIR}")
     print(f"Storage base:           {storage_base}")
+    print(f"Storage layout:         {layout.name}")
     print(f"Mail directory:         {mail_dir}")
     print(f"Classification output:  {classified_dir}")
     if args.reclassify:
@@ -406,7 +404,7 @@ def main():
     print()
     
     # Get unclassified mails
-    mails = get_unclassified_mails(mail_dir, classified_dir, reclassify=args.reclassify)
+    mails = get_unclassified_mails(layout, reclassify=args.reclassify)
     
     if not mails:
         if args.reclassify:
@@ -439,7 +437,7 @@ def main():
     for i, mail_path in enumerate(mails, 1):
         print(f"{BLUE}[{i}/{len(mails)}]{NC}", end=' ')
         
-        success, classification = process_mail(mail_path, classified_dir)
+        success, classification = process_mail(mail_path, layout)
         
         if success:
             success_count += 1
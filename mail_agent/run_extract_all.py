@@ -10,10 +10,10 @@ Usage:
   python run_extract.py              # Process all unprocessed mails
   python run_extract.py --limit 5    # Process max 5 mails
   python run_extract.py --latest     # Process only the latest mail
+  python run_extract.py --full       # No delta extraction for replies in known threads
 """
 import sys
 import subprocess
-import shutil
 import json
 from pathlib import Path
 from datetime import datetime
@@ -74,28 +74,106 @@ def get_storage_base() -> Path:
     
     return storage_base.resolve()
 
-def get_unprocessed_mails(mail_dir: Path) -> List[Path]:
-    """Get all .eml files, sorted from oldest to newest"""
-    if not mail_dir.exists():
-        return []
-    
-    mail_files = list(mail_dir.glob("*.eml"))
-    
-    if not mail_files:
-        return []
-    
-    def get_timestamp(filepath: Path) -> datetime:
-        try:
-            filename = filepath.stem
-            timestamp_str = '_'.join(filename.split('_')[:2])
-            return datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
-        except:
-            return datetime.fromtimestamp(filepath.stat().st_mtime)
-    
-    # Sort oldest to newest (FIFO)
-    return sorted(mail_files, key=get_timestamp)
+def get_storage_layout():
+    """Storage layout from config (flat state folders or per-mail bundles)"""
+    sys.path.insert(0, str(WORKING_DIR))
+    from utils.storage_layout import create_layout
+    config = load_application_config()
+    return create_layout(get_storage_base(), config.get('storage', {}).get('layout', 'flat'))
+
+_file_handler = None
+
+def get_file_handler():
+    """FileHandler for reading stored records (also from cold storage)"""
+    global _file_handler
+    if _file_handler is None:
+        sys.path.insert(0, str(WORKING_DIR))
+        from utils.file_handler import FileHandler
+        config = load_application_config()
+        _file_handler = FileHandler(get_storage_base(), config.get('storage', {}).get('layout', 'flat'))
+    return _file_handler
 
-def extract_json(mail_path: Path, json_type: str, output_dir: Path, timeout: int = 300) -> Tuple[bool, Optional[Path]]:
+def get_unprocessed_mails(layout) -> List[Path]:
+    """Get all new .eml files, sorted from oldest to newest"""
+    return layout.mails('new')
+
+def extract_delta(mail_path: Path, json_type: str, base_record: Path, new_text: str,
+                  output_path: Path, timeout: int = 300) -> bool:
+    """
+    Incremental extraction for a reply in a known thread
+    The LLM gets the new content and a summary of the existing record and
+    returns a patch; the merged record is saved as this mail's JSON
+    
+    Returns:
+        True if the merged record was written
+    """
+    from agents.delta_extraction import (summarize_record, build_delta_input, parse_patch,
+                                         merge_patch, stamp_identity)
+    from agents.body_reducer import estimate_tokens
+    
+    try:
+        # Records of older thread messages may already be in cold storage
+        record = get_file_handler().load_json(base_record)
+    except Exception as e:
+        print(f"  {YELLOW}Could not load {base_record.name}: {e}{NC}")
+        return False
+    
+    delta_input = build_delta_input(summarize_record(record), new_text)
+    temp_txt = mail_path.parent / f"{mail_path.stem}_delta.txt"
+    patch_path = output_path.with_name(f"{output_path.stem}_patch.json")
+    
+    llm_script = WORKING_DIR / 'agents' / 'llm_request.py'
+    cmd = [
+        sys.executable,
+        str(llm_script),
+        '--pre_prompt', str(WORKING_DIR / 'catalog/prompts/extract_delta.txt'),
+        '--mailbody', str(temp_txt),
+        '--export', str(patch_path)
+    ]
+    
+    print(f"  Extracting {json_type} (delta on {base_record.name}, "
+          f"~{estimate_tokens(delta_input)} tokens)...", end=' ', flush=True)
+    
+    try:
+        with open(temp_txt, 'w', encoding='utf-8') as f:
+            f.write(delta_input)
+        
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+        
+        patch = None
+        if result.returncode == 0 and patch_path.exists():
+            patch = parse_patch(patch_path.read_text(encoding='utf-8'))
+        
+        if patch is None:
+            print(f"{RED}✗ (no valid patch){NC}")
+            return False
+        
+        # Saved as this mail's record: own ids and timestamp, not the base mail's
+        merged = stamp_identity(merge_patch(record, patch), mail_path)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        
+        print(f"{GREEN}✓ ({len(patch)} field(s) patched){NC}")
+        return True
+        
+    except subprocess.TimeoutExpired:
+        print(f"{RED}✗ TIMEOUT{NC}")
+        return False
+    except Exception as e:
+        print(f"{RED}✗ {e}{NC}")
+        return False
+    finally:
+        for path in (temp_txt, patch_path):
+            if path.exists():
+                path.unlink()
+
+def extract_json(mail_path: Path, json_type: str, output_dir: Path, timeout: int = 300,
+                 base_record: Optional[Path] = None) -> Tuple[bool, Optional[Path]]:
     """
     Extract JSON using llm_request.py with increased timeout
     Automatically decodes .eml to plaintext before LLM processing
@@ -105,6 +183,8 @@ def extract_json(mail_path: Path, json_type: str, output_dir: Path, timeout: int
         json_type: 'problem', 'solution', or 'asset'
         output_dir: Directory for output files
         timeout: LLM timeout in seconds (default 300)
+        base_record: Existing record of the thread - try a delta extraction
+                     first (falls back to a full extraction)
     
     Returns:
         (success, output_path)
@@ -137,24 +217,38 @@ def extract_json(mail_path: Path, json_type: str, output_dir: Path, timeout: int
     temp_txt = None
     try:
         sys.path.insert(0, str(WORKING_DIR))
-        from agents.mail_parser import MailParser
-        
-        parser = MailParser()
-        with open(mail_path, 'rb') as f:
-            raw_email = f.read()
+        from utils.parse_cache import ParseCache
+        from agents.mail_parser import html_to_text
+        from agents.body_reducer import reduce_body
         
-        parsed = parser.parse(raw_email)
+        # Parse-once sidecar (written at ingestion or by an earlier stage)
+        parse_cache = ParseCache(get_storage_base() / 'cache' / 'parsed')
+        parsed = parse_cache.load(mail_path)
         if not parsed:
             print(f"{RED}✗ (parsing failed){NC}")
             return False, None
         
-        # Get plaintext (prefer plain over HTML)
-        plaintext = parsed['body']['plain'] or parsed['body']['html']
+        # Get plaintext (prefer plain over HTML converted to text)
+        plaintext = parsed['body']['plain'] or html_to_text(parsed['body']['html'])
         
         if not plaintext:
             print(f"{RED}✗ (no body content){NC}")
             return False, None
         
+        # Drop quoted history, signatures and disclaimers from the prompt
+        reduced = parsed.get('reduced') or reduce_body(plaintext)
+        if reduced['text']:
+            plaintext = reduced['text']
+        if reduced['tokens_saved'] > 0:
+            print(f"  {CYAN}Body reduced: {reduced['tokens_before']} -> {reduced['tokens_after']} tokens "
+                  f"(-{reduced['tokens_saved']}){NC}")
+        
+        # Reply in a known thread: patch the existing record instead
+        if base_record:
+            if extract_delta(mail_path, json_type, base_record, plaintext, output_path, timeout):
+                return True, output_path
+            print(f"  {YELLOW}→ Falling back to full extraction{NC}")
+        
         # Create temporary .txt file for LLM
         temp_txt = mail_path.parent / f"{mail_path.stem}_decoded.txt"
         with open(temp_txt, 'w', encoding='utf-8') as f:
@@ -219,35 +313,60 @@ def extract_json(mail_path: Path, json_type: str, output_dir: Path, timeout: int
             temp_txt.unlink()
         return False, None
 
-def process_mail(mail_path: Path, output_dir: Path, failed_dir: Path, processed_dir: Path) -> bool:
+def process_mail(mail_path: Path, layout, incremental: bool = True) -> bool:
     """
     Process a single mail: extract all JSONs and move to appropriate folder
+    (bundle layout: the state is recorded in the bundle manifest)
+    Replies in a thread with existing records are extracted as deltas
+    unless incremental is False
     
     Returns:
         True if all extractions successful, False otherwise
     """
     print(f"\n{CYAN}Processing: {mail_path.name}{NC}")
     
+    # Conversation of this mail (indexed at ingestion)
+    sys.path.insert(0, str(WORKING_DIR))
+    from utils.thread_index import ThreadIndex, default_index_path
+    thread_index = ThreadIndex(default_index_path(get_storage_base()))
+    thread_row = thread_index.ensure_indexed(mail_path)
+    follow_up = False
+    if thread_row:
+        context = thread_index.thread_context(thread_row['message_id'])
+        follow_up = context['is_follow_up']
+        if follow_up:
+            print(f"  {CYAN}Thread: message {context['position']}/{context['count']} "
+                  f"of {context['thread_id']}{NC}")
+    
     # Extract all JSON types
     json_types = ['problem', 'solution', 'asset']
     results = {}
+    output_dir = layout.artifact_path(mail_path, 'problem').parent
     
     for json_type in json_types:
-        success, output_path = extract_json(mail_path, json_type, output_dir, timeout=300)
+        base_record = None
+        if incremental and follow_up:
+            from agents.delta_extraction import previous_record
+            base_record = previous_record(thread_index, thread_row['message_id'], json_type,
+                                          get_file_handler())
+        success, output_path = extract_json(mail_path, json_type, output_dir, timeout=300,
+                                            base_record=base_record)
         results[json_type] = (success, output_path)
+        layout.record_artifact(mail_path, json_type, 'ok' if success else 'failed')
+        if success and thread_row:
+            thread_index.record_artifact(thread_row['message_id'], json_type, output_path)
+    thread_index.close()
     
     # Check if all succeeded
     all_success = all(success for success, _ in results.values())
     
     # Move mail to appropriate folder
     if all_success:
-        dest = processed_dir / mail_path.name
-        shutil.move(str(mail_path), str(dest))
+        layout.set_state(mail_path, 'processed')
         print(f"  {GREEN}→ Moved to processed/{NC}")
         return True
     else:
-        dest = failed_dir / mail_path.name
-        shutil.move(str(mail_path), str(dest))
+        layout.set_state(mail_path, 'failed')
         print(f"  {RED}→ Moved to failed/ (partial extraction){NC}")
         
         # List what failed
@@ -259,27 +378,31 @@ def main():
     parser = argparse.ArgumentParser(description='Nice2Know Mail Extraction Pipeline')
     parser.add_argument('--limit', type=int, help='Max number of mails to process')
     parser.add_argument('--latest', action='store_true', help='Process only the latest mail')
+    parser.add_argument('--full', action='store_true',
+                        help='Always extract from the full body (no delta extraction for replies)')
     
     args = parser.parse_args()
     
     # Get storage base from config
     storage_base = get_storage_base()
     
-    # Define directories from config
-    mail_dir = storage_base / 'mails'
-    output_dir = storage_base / 'processed'
-    failed_dir = storage_base / 'failed'
-    processed_dir = storage_base / 'processed'
+    layout = get_storage_layout()
+    layout.ensure_directories()
     
-    # Create directories if they don't exist
-    for directory in [mail_dir, output_dir, failed_dir, processed_dir]:
-        directory.mkdir(parents=True, exist_ok=True)
+    # Define directories from config
+    if layout.name == 'bundle':
+        mail_dir = failed_dir = processed_dir = layout.root
+    else:
+        mail_dir = storage_base / 'mails'
+        failed_dir = storage_base / 'failed'
+        processed_dir = storage_base / 'processed'
     
     print(f"{BLUE}{'=' * 60}{NC}")
     print(f"{BLUE}Nice2Know - Mail Extraction Pipeline (Improved){NC}")
     print(f"{BLUE}{'=' * 60}{NC}")
     print(f"Working directory:   {WORKING_DIR}")
     print(f"Storage base:        {storage_base}")
+    print(f"Storage layout:      {layout.name}")
     print(f"Mail directory:      {mail_dir}")
     print(f"Processed directory: {processed_dir}")
     print(f"Failed directory:    {failed_dir}")
@@ -290,7 +413,7 @@ def main():
     print()
     
     # Get unprocessed mails
-    mails = get_unprocessed_mails(mail_dir)
+    mails = get_unprocessed_mails(layout)
     
     if not mails:
         print(f"{YELLOW}No unprocessed mails found in {mail_dir}{NC}")
@@ -315,7 +438,7 @@ def main():
     for i, mail_path in enumerate(mails, 1):
         print(f"{BLUE}[{i}/{len(mails)}]{NC}", end=' ')
         
-        if process_mail(mail_path, output_dir, failed_dir, processed_dir):
+        if process_mail(mail_path, layout, incremental=not args.full):
             success_count += 1
         else:
             failed_count += 1
@@ -7,14 +7,11 @@ Uses hex mail_id from JSON for URLs
 import sys
 import json
 import smtplib
-import shutil
 from pathlib import Path
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from datetime import datetime
 from typing import Optional, Dict
-import email
-from email import policy
 
 # Auto-detect mail_agent/ directory
 def find_mail_agent_root(start_path: Path) -> Path:
@@ -36,6 +33,8 @@ WORKING_DIR = find_mail_agent_root(SCRIPT_DIR)
 sys.path.insert(0, str(WORKING_DIR))
 
 from utils.analyze_json_quality import analyze_quality, get_field_status
+from agents.mail_parser import MailParser
+from utils.storage_layout import create_layout
 
 # Colors
 GREEN = '\033[0;32m'
@@ -107,6 +106,11 @@ def get_storage_base() -> Path:
     
     return storage_base.resolve()
 
+def get_storage_layout():
+    """Storage layout from config (flat state folders or per-mail bundles)"""
+    config = load_application_config()
+    return create_layout(get_storage_base(), config.get('storage', {}).get('layout', 'flat'))
+
 def load_mail_config() -> tuple[Dict, Dict]:
     """Load mail configuration and secrets"""
     config_dir = WORKING_DIR / 'config'
@@ -147,11 +151,13 @@ def load_html_template(filepath: Path) -> Optional[str]:
 def extract_mail_info(mail_path: Path) -> Dict[str, str]:
     """Extract sender and subject from .eml file"""
     try:
-        with open(mail_path, 'rb') as f:
-            msg = email.message_from_binary_file(f, policy=policy.default)
+        # Only the header block is read - the body is not needed here
+        headers = MailParser().parse_headers(mail_path)
+        if headers is None:
+            raise ValueError(f"unreadable headers in {mail_path.name}")
         
-        sender = msg.get('From', 'unknown@example.com')
-        subject = msg.get('Subject', 'No Subject')
+        sender = headers['from'] or 'unknown@example.com'
+        subject = headers['subject'] or 'No Subject'
         
         if '<' in sender and '>' in sender:
             sender_email = sender[sender.find('<')+1:sender.find('>')]
@@ -541,12 +547,30 @@ def send_mail(recipient: str, subject: str, html_body: str, mail_config: Dict, s
         traceback.print_exc()
         return False
 
-def move_to_sent(mail_file: Path, sent_dir: Path) -> bool:
-    """Move .eml file to sent directory after successful sending"""
+def write_receipt(mail_file: Path, layout, mail_info: Dict, problem: Dict) -> Optional[Path]:
+    """Record that the confirmation was sent (next to the mail in the bundle layout)"""
+    receipt_path = layout.artifact_path(mail_file, 'receipt')
+    receipt = {
+        'sent_at': datetime.now().isoformat(),
+        'recipient': mail_info['sender'],
+        'subject': f"Re: {mail_info['subject']}",
+        'mail_file': mail_file.name,
+        'mail_id': problem.get('mail_id')
+    }
+    try:
+        receipt_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(receipt_path, 'w', encoding='utf-8') as f:
+            json.dump(receipt, f, ensure_ascii=False, indent=2)
+        layout.record_artifact(mail_file, 'receipt')
+        return receipt_path
+    except Exception as e:
+        print(f"{YELLOW}⚠ Could not write send receipt: {e}{NC}")
+        return None
+
+def move_to_sent(mail_file: Path, layout) -> bool:
+    """Move .eml file to sent directory after successful sending (bundle layout: mark as sent)"""
     try:
-        sent_dir.mkdir(parents=True, exist_ok=True)
-        dest_file = sent_dir / mail_file.name
-        shutil.move(str(mail_file), str(dest_file))
+        layout.set_state(mail_file, 'sent')
         print(f"{GREEN}✓ Moved {mail_file.name} to sent/{NC}")
         return True
     except Exception as e:
@@ -561,10 +585,15 @@ def main():
     
     # Get storage base from config
     storage_base = get_storage_base()
-    processed_dir = storage_base / 'processed'
-    sent_dir = storage_base / 'sent'
+    layout = get_storage_layout()
+    if layout.name == 'bundle':
+        processed_dir = sent_dir = layout.root
+    else:
+        processed_dir = storage_base / 'processed'
+        sent_dir = storage_base / 'sent'
     
     print(f"Storage base:        {storage_base}")
+    print(f"Storage layout:      {layout.name}")
     print(f"Processed directory: {processed_dir}")
     print(f"Sent directory:      {sent_dir}")
     print()
@@ -582,21 +611,21 @@ def main():
         print(f"{RED}✗ Processed directory not found: {processed_dir}{NC}")
         sys.exit(1)
     
-    # Find latest
-    json_files = list(processed_dir.glob('*_problem.json'))
-    if not json_files:
-        print(f"{RED}✗ No problem JSON files found in {processed_dir}{NC}")
+    # Find latest processed mail with a problem JSON
+    mail_files = layout.mails('processed', with_artifact='problem')
+    if not mail_files:
+        print(f"{RED}✗ No processed mail with a problem JSON found in {processed_dir}{NC}")
         sys.exit(1)
     
-    latest_problem = sorted(json_files, key=lambda p: p.stem)[-1]
-    timestamp = '_'.join(latest_problem.stem.split('_')[:2])
+    mail_file = mail_files[-1]
+    timestamp = '_'.join(mail_file.stem.split('_')[:2])
     
     print(f"Using timestamp: {timestamp}")
     
     # Load JSONs
-    problem_path = processed_dir / f"{timestamp}_problem.json"
-    solution_path = processed_dir / f"{timestamp}_solution.json"
-    asset_path = processed_dir / f"{timestamp}_asset.json"
+    problem_path = layout.artifact_path(mail_file, 'problem')
+    solution_path = layout.artifact_path(mail_file, 'solution')
+    asset_path = layout.artifact_path(mail_file, 'asset')
     
     print(f"Loading: {problem_path.name}")
     problem = load_json_file(problem_path)
@@ -611,14 +640,6 @@ def main():
     if not asset:
         sys.exit(1)
     
-    # Load mail from processed directory
-    mail_files = list(processed_dir.glob(f"{timestamp}_*.eml"))
-    if not mail_files:
-        print(f"{RED}✗ No mail file found for timestamp {timestamp}{NC}")
-        print(f"{YELLOW}Expected: {processed_dir}/{timestamp}_*.eml{NC}")
-        sys.exit(1)
-    
-    mail_file = mail_files[0]
     mail_info = extract_mail_info(mail_file)
     print(f"Loading mail: {mail_file.name}")
     
@@ -656,9 +677,11 @@ def main():
     if success:
         print(f"{GREEN}✓ Mail sent successfully!{NC}\n")
         
+        write_receipt(mail_file, layout, mail_info, problem)
+        
         # Move mail to sent directory
         print(f"Moving mail to sent directory...")
-        if move_to_sent(mail_file, sent_dir):
+        if move_to_sent(mail_file, layout):
             print(f"\n{GREEN}✓ Process completed successfully!{NC}")
             sys.exit(0)
         else:
@@ -0,0 +1,11 @@
+"""
+Nice2Know Mail Agent - pytest setup
+Modules are imported like the scripts do (agents.*, utils.* from mail_agent/)
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+# Manual connection checks against the configured servers, not unit tests
+collect_ignore = ['test_mail.py', 'send_confirmation_mail.py']
@@ -11,8 +11,6 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from datetime import datetime
 from typing import Optional, Dict
-import email
-from email import policy
 
 # Auto-detect mail_agent/ directory
 def find_mail_agent_root(start_path: Path) -> Path:
@@ -33,6 +31,7 @@ WORKING_DIR = find_mail_agent_root(SCRIPT_DIR)
 sys.path.insert(0, str(WORKING_DIR))
 
 from utils.analyze_json_quality import analyze_quality, get_field_status
+from agents.mail_parser import MailParser
 
 # Colors
 GREEN = '\033[0;32m'
@@ -80,11 +79,13 @@ def load_html_template(filepath: Path) -> Optional[str]:
 
 def extract_mail_info(mail_path: Path) -> Dict[str, str]:
     try:
-        with open(mail_path, 'rb') as f:
-            msg = email.message_from_binary_file(f, policy=policy.default)
+        # Only the header block is read - the body is not needed here
+        headers = MailParser().parse_headers(mail_path)
+        if headers is None:
+            raise ValueError(f"unreadable headers in {mail_path.name}")
         
-        sender = msg.get('From', 'unknown@example.com')
-        subject = msg.get('Subject', 'No Subject')
+        sender = headers['from'] or 'unknown@example.com'
+        subject = headers['subject'] or 'No Subject'
         
         if '<' in sender and '>' in sender:
             sender_email = sender[sender.find('<')+1:sender.find('>')]
@@ -0,0 +1,32 @@
+"""
+Nice2Know Mail Agent - BodyReducer tests
+"""
+from agents.body_reducer import reduce_body
+
+def test_quoted_reply_is_removed():
+    text = ("Das Problem besteht weiterhin.\n\n"
+            "Am 01.02.2025 um 10:00 schrieb Max Muster <max@example.org>:\n"
+            "> Bitte Cache leeren.\n")
+    assert reduce_body(text)['text'] == 'Das Problem besteht weiterhin.'
+
+def test_signature_and_legal_footer_are_removed():
+    text = ("Hallo,\nDrucker defekt.\n\n"
+            "Mit freundlichen Grüßen\nAnna Muster\nMuster GmbH\nTel. +49 30 123\n\n"
+            "Muster GmbH, Sitz der Gesellschaft: Berlin, Amtsgericht Charlottenburg HRB 12345, "
+            "Geschäftsführer: Max Muster\n")
+    assert reduce_body(text)['text'] == 'Hallo,\nDrucker defekt.\n\nMit freundlichen Grüßen\nAnna Muster'
+
+def test_closing_in_the_middle_keeps_log_lines():
+    text = "Error: timeout\nThanks\nat line 5\nat line 6\n"
+    assert reduce_body(text)['text'] == text.rstrip('\n')
+
+def test_postscript_after_signature_is_kept():
+    text = "Hi,\nthe db job fails.\n\nThanks!\nBob\n\nP.S. The error in the log is: ORA-01555\n"
+    assert 'ORA-01555' in reduce_body(text)['text']
+
+def test_single_legal_keyword_in_content_is_kept():
+    text = ("Hallo,\n\nunser Geschäftsführer kann sich nicht mehr am VPN anmelden.\n\n"
+            "bitte vertraulich behandeln. Fehlercode E-502\n\nViele Grüße\nAnna\n")
+    reduced = reduce_body(text)['text']
+    assert 'VPN' in reduced
+    assert 'E-502' in reduced
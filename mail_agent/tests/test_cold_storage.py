@@ -0,0 +1,56 @@
+"""
+Nice2Know Mail Agent - ColdStore pack / read / restore round trip
+"""
+import json
+
+from utils.cold_storage import ColdStore, tier_config
+from utils.file_handler import FileHandler
+from utils.storage_layout import create_layout
+
+MAIL_FILE = '20240105_101500_aaaaaaaabbbbbbbbccccccccdddddddd@example.org.eml'
+MAIL = b'From: a@example.org\r\nSubject: alt\r\n\r\n' + b'Drucker defekt.\r\n' * 500
+
+def archived_mail(base):
+    layout = create_layout(base, 'flat')
+    layout.ensure_directories()
+    mail_path = layout.set_state(layout.store_mail_bytes(MAIL, MAIL_FILE), 'archived')
+    problem = layout.artifact_path(mail_path, 'problem')
+    problem.write_text(json.dumps({'type': 'n2k_problem', 'mail_id': 'aaaa'}), encoding='utf-8')
+    return layout, mail_path, problem
+
+def test_tiering_is_opt_in():
+    assert tier_config({})['enabled'] is False
+    assert tier_config({'cold_tier': {'enabled': True}})['enabled'] is True
+
+def test_pack_read_restore(tmp_path):
+    layout, mail_path, problem = archived_mail(tmp_path)
+    problem_bytes = problem.read_bytes()
+    store = ColdStore(tmp_path)
+    try:
+        stats = store.tier(layout, after_days=30, codec='gzip')
+        assert (stats['mails'], stats['files'], stats['errors']) == (1, 2, 0)
+        assert stats['packed'] < stats['size']
+        assert not mail_path.exists() and not problem.exists()
+
+        assert store.read(MAIL_FILE) == MAIL
+        assert store.read(problem.name) == problem_bytes
+        assert store.mail_files() == [MAIL_FILE]
+
+        restored = store.restore(layout, MAIL_FILE)
+        assert restored == mail_path
+        assert mail_path.read_bytes() == MAIL
+        assert problem.read_bytes() == problem_bytes
+        assert store.read(MAIL_FILE) is None
+    finally:
+        store.close()
+
+def test_file_handler_reads_packed_files(tmp_path):
+    layout, mail_path, problem = archived_mail(tmp_path)
+    store = ColdStore(tmp_path)
+    store.tier(layout, after_days=30, codec='gzip')
+    store.close()
+
+    handler = FileHandler(str(tmp_path))
+    assert handler.stored_file_exists(mail_path)
+    assert handler.read_file(mail_path) == MAIL
+    assert handler.load_json(problem)['type'] == 'n2k_problem'
@@ -0,0 +1,43 @@
+"""
+Nice2Know Mail Agent - delta patch merge and identity stamping
+"""
+from pathlib import Path
+
+from agents.delta_extraction import merge_patch, parse_patch, stamp_identity
+
+OLD_ID = 'aaaaaaaabbbbbbbbccccccccdddddddd'
+REPLY = Path('20251116_101500_11111111-2222-3333-4444-555555555555@example.org.eml')
+REPLY_ID = '11111111222233334444555555555555'
+
+def test_parse_patch_accepts_wrapped_answer():
+    assert parse_patch('Antwort: {"patch": {"status": "solved"}} fertig') == {'status': 'solved'}
+    assert parse_patch('kein JSON') is None
+
+def test_merge_patch_rules():
+    record = {'id': f'prob_{OLD_ID}', 'tags': ['vpn'], 'steps': [{'n': 1}],
+              'problem': {'title': 'VPN', 'status': 'open'}}
+    patch = {'id': 'prob_x', 'tags': ['vpn', 'login'], 'steps': [{'n': 2}],
+             'problem': {'status': 'solved'}, 'workaround': None}
+
+    merged = merge_patch(record, patch)
+    assert merged['id'] == f'prob_{OLD_ID}'
+    assert merged['tags'] == ['vpn', 'login']
+    assert merged['steps'] == [{'n': 2}]
+    assert merged['problem'] == {'title': 'VPN', 'status': 'solved'}
+    assert 'workaround' in merged and merged['workaround'] is None
+    # The base record is not modified
+    assert record['problem']['status'] == 'open'
+
+def test_stamp_identity_problem():
+    record = stamp_identity({'type': 'n2k_problem', 'id': f'prob_{OLD_ID}', 'mail_id': OLD_ID,
+                             'asset_id': 'asset_vpn_01', 'timestamp': '2025-01-01T00:00:00Z'}, REPLY)
+    assert record['id'] == f'prob_{REPLY_ID}'
+    assert record['mail_id'] == REPLY_ID
+    assert record['asset_id'] == 'asset_vpn_01'
+    assert record['timestamp'] != '2025-01-01T00:00:00Z'
+
+def test_stamp_identity_solution_relinks_own_problem():
+    record = stamp_identity({'type': 'n2k_solution', 'id': f'sol_{OLD_ID}',
+                             'problem_ids': [f'prob_{OLD_ID}', 'prob_other']}, REPLY)
+    assert record['id'] == f'sol_{REPLY_ID}'
+    assert record['problem_ids'] == [f'prob_{REPLY_ID}', 'prob_other']
@@ -0,0 +1,148 @@
+"""
+Nice2Know Mail Agent - retry of failed UIDs (live sync and backfill)
+"""
+import pytest
+
+import agents.imap_fetcher as imap_fetcher
+from agents.imap_backfill import IMAPBackfill
+from agents.imap_fetcher import IMAPFetcher
+from run_agent import process_mailbox
+
+class FakeConnection:
+    """UID SEARCH over a fixed set of UIDs ('UID n:*', 'UID n:m' and 'UID a,b,c')"""
+
+    def __init__(self, uids):
+        self.uids = sorted(uids)
+
+    def uid(self, command, charset, criteria):
+        assert command == 'SEARCH'
+        spec = criteria.split()[1]
+        if spec.endswith(':*'):
+            first = int(spec[:-2])
+            # Like a real server, n:* always matches the highest UID
+            found = [uid for uid in self.uids if uid >= first] or self.uids[-1:]
+        elif ':' in spec:
+            first, last = (int(uid) for uid in spec.split(':'))
+            found = [uid for uid in self.uids if first <= uid <= last]
+        else:
+            wanted = {int(uid) for uid in spec.split(',')}
+            found = [uid for uid in self.uids if uid in wanted]
+        return 'OK', [' '.join(str(uid) for uid in found).encode('ascii')]
+
+    def noop(self):
+        return 'OK', []
+
+class FakeCredentials:
+    _secrets = {}
+
+@pytest.fixture
+def fetcher(tmp_path, monkeypatch):
+    monkeypatch.setattr(imap_fetcher, 'get_credentials', lambda: FakeCredentials())
+    fetcher = IMAPFetcher({
+        'imap': {'host': 'imap.example.org', 'sync_mode': 'uid'},
+        'storage': {'base_path': str(tmp_path)}
+    })
+    fetcher.connection = FakeConnection(range(1, 13))
+    fetcher.mailbox = 'INBOX'
+    fetcher.uidvalidity = 7
+    return fetcher
+
+def uids(id_list):
+    return [int(uid) for uid in id_list]
+
+def test_failed_last_uid_is_fetched_once(fetcher):
+    key = fetcher._state_key()
+    fetcher.sync_state.reset(key, 7)
+    fetcher.checkpoint('11')
+    fetcher.mark_failed('12')
+
+    assert uids(fetcher._search_new_uids(unseen_only=False)) == [12]
+
+def test_failed_uid_below_checkpoint_is_retried_first(fetcher):
+    key = fetcher._state_key()
+    fetcher.sync_state.reset(key, 7)
+    fetcher.mark_failed('9')
+    fetcher.checkpoint('10')
+
+    assert uids(fetcher._search_new_uids(unseen_only=False)) == [9, 11, 12]
+    # The limit applies to retries and new messages together
+    assert uids(fetcher._search_new_uids(limit=2, unseen_only=False)) == [9, 11]
+
+def test_expunged_failed_uid_is_dropped(fetcher):
+    key = fetcher._state_key()
+    fetcher.sync_state.reset(key, 7)
+    fetcher.mark_failed('5')
+    fetcher.checkpoint('12')
+    fetcher.connection.uids.remove(5)
+
+    assert uids(fetcher._search_new_uids(unseen_only=False)) == []
+    assert fetcher.sync_state.get(key)['failed_uids'] == {}
+
+def test_failed_uid_is_given_up_after_max_attempts(fetcher):
+    key = fetcher._state_key()
+    fetcher.sync_state.reset(key, 7)
+    for _ in range(imap_fetcher._MAX_FAILED_ATTEMPTS):
+        fetcher.mark_failed('3')
+
+    assert fetcher.sync_state.get(key)['failed_uids'] == {}
+
+class Spooled:
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.path = f"/spool/{message_id}.eml"
+
+    def discard(self):
+        pass
+
+class FakeParser:
+    def __init__(self, failing):
+        self.failing = failing
+
+    def parse_file(self, path):
+        message_id = path.rsplit('/', 1)[-1][:-4]
+        return None if message_id in self.failing else {'message_id': message_id, 'attachments': []}
+
+    def release(self, parsed):
+        pass
+
+class FakeThreadIndex:
+    def add_parsed(self, parsed, mail_file):
+        return parsed['message_id']
+
+def test_process_mailbox_reports_failures():
+    config = {
+        'processing': {'save_raw_eml': False, 'extract_attachments': False},
+        'filters': {'mark_as_read': False}
+    }
+    components = (None, FakeParser({'2'}), None, None, FakeThreadIndex())
+    done, failed = [], []
+
+    count = process_mailbox(None, config, components, messages=[Spooled('1'), Spooled('2'), Spooled('3')],
+                            checkpoint=done.append, on_failure=failed.append)
+
+    assert count == 2
+    assert done == ['1', '3']
+    assert failed == ['2']
+
+def test_backfill_range_stays_open_until_failures_succeed(fetcher):
+    failing = {3}
+    seen = []
+
+    def handler(fetcher, uid_list, checkpoint, on_failure):
+        seen.append(uids(uid_list))
+        for uid in uid_list:
+            (on_failure if int(uid) in failing else checkpoint)(uid.decode('ascii'))
+        return len(uid_list)
+
+    backfill = IMAPBackfill({'imap': {}}, handler, range_size=5)
+    backfill.sync_state = fetcher.sync_state
+    backfill.uidvalidity = fetcher.uidvalidity
+    backfill.base_key = fetcher._state_key()
+
+    assert backfill._backfill_range(fetcher, 1, 5) == (5, False)
+    assert not backfill._range_complete(1, 5)
+
+    failing.clear()
+    assert backfill._backfill_range(fetcher, 1, 5) == (1, True)
+    assert seen == [[1, 2, 3, 4, 5], [3]]
+    assert backfill._range_complete(1, 5)
@@ -0,0 +1,86 @@
+"""
+Nice2Know Mail Agent - BODYSTRUCTURE, streaming parse and MailParser tests
+"""
+import base64
+
+from agents.imap_bodystructure import parse_fetch_response, parse_bodystructure, iter_leaves, is_body_text
+from agents.mail_parser import MailParser
+from agents.mail_stream import StreamingParse, SPILL_SIZE_HEADER
+
+ATTACHMENT = b'%PDF-1.4 ' + bytes(range(256)) * 40
+
+def multipart_mail(attachment: bytes = ATTACHMENT) -> bytes:
+    encoded = base64.encodebytes(attachment).replace(b'\n', b'\r\n')
+    return (b'From: Anna <anna@example.org>\r\nSubject: Drucker\r\nMessage-ID: <m1@example.org>\r\n'
+            b'Content-Type: multipart/mixed; boundary="B"\r\n\r\n'
+            b'--B\r\nContent-Type: text/plain; charset=utf-8\r\n\r\nDrucker defekt.\r\n'
+            b'--B\r\nContent-Type: application/pdf; name="log.pdf"\r\nContent-Transfer-Encoding: base64\r\n'
+            b'Content-Disposition: attachment; filename="log.pdf"\r\n\r\n'
+            + encoded + b'--B--\r\n')
+
+def test_parse_bodystructure_multipart():
+    response = (b'1 (UID 42 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" 15 1 NIL NIL NIL)'
+                b'("APPLICATION" "PDF" ("NAME" "log.pdf") NIL NIL "BASE64" 4000 NIL '
+                b'("ATTACHMENT" ("FILENAME" "log.pdf")) NIL) "MIXED" ("BOUNDARY" "B") NIL NIL))')
+    [(seq, items)] = parse_fetch_response([response])
+    assert seq == 1
+    assert items[b'UID'] == b'42'
+
+    tree = parse_bodystructure(items[b'BODYSTRUCTURE'])
+    text, pdf = list(iter_leaves(tree))
+    assert tree['subtype'] == 'mixed' and tree['params']['boundary'] == 'B'
+    assert (text['section'], is_body_text(text)) == ('1', True)
+    assert (pdf['section'], pdf['disposition'], pdf['filename'], pdf['size']) == ('2', 'attachment', 'log.pdf', 4000)
+
+def test_parse_fetch_response_with_literal():
+    header = b'Subject: x\r\n\r\n'
+    data = [(b'3 (UID 7 BODY[HEADER] {%d}' % len(header), header), b')']
+    [(seq, items)] = parse_fetch_response(data)
+    assert (seq, items[b'UID'], items[b'BODY[HEADER]']) == (3, b'7', header)
+
+def test_streaming_parse_spills_and_hashes_attachment(tmp_path):
+    parse = StreamingParse(multipart_mail(), spill_threshold=100, spill_root=str(tmp_path))
+    parse.run()
+
+    spilled = [leaf for leaf in parse.leaves if 'spill_path' in leaf]
+    assert len(spilled) == 1
+    with open(spilled[0]['spill_path'], 'rb') as f:
+        assert f.read() == ATTACHMENT
+    assert spilled[0]['spill_size'] == len(ATTACHMENT)
+
+    part = list(parse.message.walk())[-1]
+    assert part.get_filename() == 'log.pdf'
+    assert int(part[SPILL_SIZE_HEADER]) == len(ATTACHMENT)
+
+def test_mail_parser_lists_attachments_and_body(tmp_path):
+    mail_path = tmp_path / 'mail.eml'
+    mail_path.write_bytes(multipart_mail())
+
+    parser = MailParser()
+    parsed = parser.parse_file(mail_path)
+    try:
+        assert parsed['subject'] == 'Drucker'
+        assert parsed['body']['plain'].strip() == 'Drucker defekt.'
+        [attachment] = parsed['attachments']
+        assert attachment['filename'] == 'log.pdf'
+        assert attachment['payload'].read() == ATTACHMENT
+    finally:
+        parser.release(parsed)
+
+def test_mail_parser_lists_attached_mail(tmp_path):
+    mail_path = tmp_path / 'forward.eml'
+    mail_path.write_bytes(
+        b'From: a@example.org\r\nSubject: Fwd\r\nMessage-ID: <f1@example.org>\r\n'
+        b'Content-Type: multipart/mixed; boundary="B"\r\n\r\n'
+        b'--B\r\nContent-Type: text/plain\r\n\r\nsiehe Anhang\r\n'
+        b'--B\r\nContent-Type: message/rfc822\r\nContent-Disposition: attachment; filename="orig.eml"\r\n\r\n'
+        b'From: c@example.org\r\nSubject: Original\r\n\r\noriginal body\r\n--B--\r\n')
+
+    parser = MailParser()
+    parsed = parser.parse_file(mail_path)
+    try:
+        [attachment] = parsed['attachments']
+        assert (attachment['filename'], attachment['content_type']) == ('orig.eml', 'message/rfc822')
+        assert b'Subject: Original' in attachment['payload'].read()
+    finally:
+        parser.release(parsed)
@@ -0,0 +1,69 @@
+"""
+Nice2Know Mail Agent - SyncStateStore tests
+"""
+import json
+
+from utils.sync_state import SyncStateStore
+
+def test_advance_only_moves_forward(tmp_path):
+    store = SyncStateStore(tmp_path / 'state.json')
+    store.reset('box', 1)
+
+    assert store.advance('box', 1, 10)
+    assert not store.advance('box', 1, 5)
+    assert store.get('box')['last_uid'] == 10
+
+def test_new_uidvalidity_replaces_checkpoint(tmp_path):
+    store = SyncStateStore(tmp_path / 'state.json')
+    store.reset('box', 1)
+    store.advance('box', 1, 10)
+
+    assert store.advance('box', 2, 3)
+    assert store.get('box') == {**store.get('box'), 'uidvalidity': 2, 'last_uid': 3}
+
+def test_failed_uid_survives_later_checkpoint(tmp_path):
+    store = SyncStateStore(tmp_path / 'state.json')
+    store.reset('box', 1)
+
+    assert store.mark_failed('box', 1, 11) == 1
+    store.advance('box', 1, 12)
+    assert store.get('box')['failed_uids'] == {'11': 1}
+
+    assert store.mark_failed('box', 1, 11) == 2
+    # Success of the retry clears it, the checkpoint stays
+    assert not store.advance('box', 1, 11)
+    assert store.get('box')['failed_uids'] == {}
+    assert store.get('box')['last_uid'] == 12
+
+def test_mark_failed_needs_entry(tmp_path):
+    store = SyncStateStore(tmp_path / 'state.json')
+    assert store.mark_failed('box', 1, 11) == 0
+
+def test_drop_failed(tmp_path):
+    store = SyncStateStore(tmp_path / 'state.json')
+    store.reset('box', 1)
+    store.mark_failed('box', 1, 4)
+    store.mark_failed('box', 1, 5)
+
+    store.drop_failed('box', [4])
+    assert store.get('box')['failed_uids'] == {'5': 1}
+
+def test_separate_stores_keep_each_others_keys(tmp_path):
+    state_file = tmp_path / 'state.json'
+    first = SyncStateStore(state_file)
+    second = SyncStateStore(state_file)
+
+    first.reset('a@example.org/INBOX', 1)
+    first.advance('a@example.org/INBOX', 1, 5)
+    second.reset('b@example.org/INBOX', 2)
+    second.advance('b@example.org/INBOX', 2, 7)
+
+    saved = json.loads(state_file.read_text())
+    assert saved['a@example.org/INBOX']['last_uid'] == 5
+    assert saved['b@example.org/INBOX']['last_uid'] == 7
+    assert SyncStateStore(state_file).get('a@example.org/INBOX')['last_uid'] == 5
+
+def test_shared_store_per_file(tmp_path):
+    state_file = tmp_path / 'state.json'
+    assert SyncStateStore.shared(state_file) is SyncStateStore.shared(str(state_file))
+    assert SyncStateStore.shared(state_file) is not SyncStateStore.shared(tmp_path / 'other.json')
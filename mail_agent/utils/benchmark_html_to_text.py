@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Nice2Know - HTML-to-text Benchmark
+Measures prompt size reduction of html_to_text() on real mails
+
+Usage:
+  python utils/benchmark_html_to_text.py                 # storage/mails + storage/processed
+  python utils/benchmark_html_to_text.py path/to/*.eml   # specific files or directories
+  python utils/benchmark_html_to_text.py --show 2        # print the first 2 conversions
+
+Token counts use tiktoken (cl100k_base) if installed, otherwise the
+common estimate of 4 characters per token.
+"""
+import sys
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+from typing import List
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from agents.mail_parser import MailParser, html_to_text
+from utils.logger import get_logger
+
+# Colors
+GREEN = '\033[0;32m'
+YELLOW = '\033[1;33m'
+BLUE = '\033[0;34m'
+CYAN = '\033[0;36m'
+NC = '\033[0m'
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding('cl100k_base')
+
+    def count_tokens(text: str) -> int:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+
+    TOKENIZER = 'tiktoken cl100k_base'
+except Exception:
+    def count_tokens(text: str) -> int:
+        return (len(text) + 3) // 4
+
+    TOKENIZER = 'estimate (4 chars/token)'
+
+def default_paths() -> List[Path]:
+    """storage/mails and storage/processed from application.json"""
+    root = Path(__file__).resolve().parent.parent
+    base_path = './storage'
+    config_file = root / 'config' / 'connections' / 'application.json'
+    if config_file.exists():
+        with open(config_file, 'r', encoding='utf-8') as f:
+            base_path = json.load(f).get('storage', {}).get('base_path', base_path)
+
+    storage = Path(base_path) if Path(base_path).is_absolute() else root / base_path
+    return [storage / 'mails', storage / 'processed']
+
+def collect_mails(paths: List[Path]) -> List[Path]:
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(path.glob('*.eml')))
+        elif path.suffix == '.eml' and path.exists():
+            files.append(path)
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark html_to_text token reduction')
+    parser.add_argument('paths', nargs='*', type=Path, help='.eml files or directories')
+    parser.add_argument('--show', type=int, default=0, help='Print the first N converted texts')
+    args = parser.parse_args()
+
+    # MailParser logs every mail at INFO
+    get_logger().setLevel(logging.WARNING)
+
+    mails = collect_mails(args.paths or default_paths())
+    mail_parser = MailParser()
+
+    print(f"{BLUE}{'=' * 72}{NC}")
+    print(f"{BLUE}HTML-to-text Benchmark{NC}")
+    print(f"{BLUE}{'=' * 72}{NC}")
+    print(f"Mails found: {len(mails)}")
+    print(f"Tokenizer:   {TOKENIZER}\n")
+
+    rows = []
+    shown = 0
+    for mail_path in mails:
+        parsed = mail_parser.parse(mail_path.read_bytes())
+        if not parsed or not parsed['body']['html']:
+            continue
+
+        html = parsed['body']['html']
+        started = time.perf_counter()
+        text = html_to_text(html)
+        elapsed = time.perf_counter() - started
+
+        rows.append({
+            'name': mail_path.name,
+            'html_tokens': count_tokens(html),
+            'text_tokens': count_tokens(text),
+            'html_bytes': len(html.encode('utf-8')),
+            'ms': elapsed * 1000
+        })
+
+        if shown < args.show:
+            shown += 1
+            print(f"{CYAN}--- {mail_path.name} ---{NC}")
+            print(text[:2000])
+            print()
+
+    if not rows:
+        print(f"{YELLOW}No mails with an HTML body found{NC}")
+        return 0
+
+    print(f"{'Mail':<40} {'HTML tok':>9} {'Text tok':>9} {'Saved':>7} {'ms':>7}")
+    print('-' * 76)
+    for row in rows:
+        saved = 1 - row['text_tokens'] / row['html_tokens'] if row['html_tokens'] else 0
+        print(f"{row['name'][:40]:<40} {row['html_tokens']:>9} {row['text_tokens']:>9} "
+              f"{saved:>7.0%} {row['ms']:>7.2f}")
+
+    html_total = sum(r['html_tokens'] for r in rows)
+    text_total = sum(r['text_tokens'] for r in rows)
+    mb = sum(r['html_bytes'] for r in rows) / 1024 / 1024
+    seconds = sum(r['ms'] for r in rows) / 1000
+
+    print('-' * 76)
+    print(f"{GREEN}{len(rows)} HTML mail(s): {html_total} -> {text_total} tokens "
+          f"({1 - text_total / max(html_total, 1):.0%} fewer){NC}")
+    print(f"{GREEN}Conversion: {mb:.2f} MB HTML in {seconds:.3f}s "
+          f"({mb / max(seconds, 1e-9):.1f} MB/s){NC}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
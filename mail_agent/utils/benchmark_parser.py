@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Nice2Know - Parser Engine Benchmark
+Compares the MailParser engines ('default' vs 'compat32'): checks that the
+extracted fields are identical and measures the parse time
+
+Usage:
+  python utils/benchmark_parser.py                   # storage/mails + storage/processed
+  python utils/benchmark_parser.py path/to/*.eml     # specific files or directories
+  python utils/benchmark_parser.py --generate 500    # synthetic corpus (no mails needed)
+  python utils/benchmark_parser.py --rounds 5
+
+Exit code 1 if any field differs between the engines.
+"""
+import sys
+import time
+import argparse
+import logging
+from pathlib import Path
+from typing import Dict, Any, List
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.application import MIMEApplication
+from email.header import Header
+from email.utils import formatdate
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from agents.mail_parser import MailParser, PARSER_ENGINES
+from utils.benchmark_html_to_text import default_paths, collect_mails
+from utils.logger import get_logger
+
+# Colors
+GREEN = '\033[0;32m'
+RED = '\033[0;31m'
+YELLOW = '\033[1;33m'
+BLUE = '\033[0;34m'
+NC = '\033[0m'
+
+# Everything the pipeline reads from a parse result
+COMPARED_FIELDS = ('message_id', 'from', 'to', 'cc', 'subject', 'date',
+                   'body', 'attachments', 'raw_size', 'smime_signed', 'source')
+
+def extracted_fields(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """Comparable view of a parse result (no MIME part objects)"""
+    if parsed is None:
+        return None
+    fields = {name: parsed[name] for name in COMPARED_FIELDS if name != 'attachments'}
+    if 'Date' not in parsed['headers']:
+        # Falls back to the parse time
+        fields['date'] = None
+    fields['attachments'] = [(a['filename'], a['content_type'], a['size']) for a in parsed['attachments']]
+    return fields
+
+def generate_corpus(count: int) -> List[bytes]:
+    """Synthetic mails: encoded headers, alternative bodies, attachments"""
+    names = ['Jürgen Müller', 'Zoë Ångström', 'IT Support', 'Łukasz Żółć']
+    corpus = []
+    for i in range(count):
+        msg = MIMEMultipart('mixed')
+        msg['From'] = f"{Header(names[i % len(names)], 'utf-8').encode()} <user{i}@example.com>"
+        msg['To'] = 'support@example.com'
+        msg['Subject'] = Header(f"Störung #{i}: Drucker im 2. OG – bitte prüfen " * (1 + i % 3), 'utf-8')
+        msg['Date'] = formatdate(1700000000 + i * 3600, localtime=False)
+        msg['Message-ID'] = f"<bench-{i}@example.com>"
+
+        alternative = MIMEMultipart('alternative')
+        text = f"Hallo,\n\nder Drucker {i} zeigt Fehler 0x{i:04x}.\n" * (5 + i % 40)
+        alternative.attach(MIMEText(text, 'plain', 'utf-8'))
+        alternative.attach(MIMEText(f"<html><body><p>{text}</p></body></html>", 'html', 'utf-8'))
+        msg.attach(alternative)
+
+        for n in range(i % 3):
+            attachment = MIMEApplication(bytes(range(256)) * (40 * (n + 1)), Name=f'log_{n}.bin')
+            attachment.add_header('Content-Disposition', 'attachment',
+                                  filename=('utf-8', '', f'Prüfbericht_{n}.bin'))
+            msg.attach(attachment)
+
+        corpus.append(msg.as_bytes())
+    return corpus
+
+def time_engine(engine: str, corpus: List[bytes], rounds: int):
+    """Best-of-rounds wall time and the results of the last round"""
+    parser = MailParser(engine)
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        results = [parser.parse(raw) for raw in corpus]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MailParser engines')
+    parser.add_argument('paths', nargs='*', type=Path, help='.eml files or directories')
+    parser.add_argument('--generate', type=int, default=0, help='Use N synthetic mails instead')
+    parser.add_argument('--rounds', type=int, default=3, help='Timing rounds per engine (best is reported)')
+    args = parser.parse_args()
+
+    # MailParser logs every mail at INFO and warns about bodiless mails
+    get_logger().setLevel(logging.ERROR)
+
+    if args.generate:
+        corpus = generate_corpus(args.generate)
+        source = f"{len(corpus)} synthetic mail(s)"
+    else:
+        mails = collect_mails(args.paths or default_paths())
+        corpus = [mail.read_bytes() for mail in mails]
+        source = f"{len(corpus)} mail(s) from disk"
+
+    print(f"{BLUE}{'=' * 60}{NC}")
+    print(f"{BLUE}Parser Engine Benchmark{NC}")
+    print(f"{BLUE}{'=' * 60}{NC}")
+    print(f"Corpus:  {source} ({sum(len(raw) for raw in corpus) / 1024 / 1024:.2f} MB)")
+    print(f"Rounds:  {args.rounds}\n")
+
+    if not corpus:
+        print(f"{YELLOW}No mails found - try --generate 500{NC}")
+        return 0
+
+    timings = {}
+    results = {}
+    for engine in PARSER_ENGINES:
+        timings[engine], results[engine] = time_engine(engine, corpus, max(1, args.rounds))
+        print(f"  {engine:<10} {timings[engine]:>8.3f}s  "
+              f"({len(corpus) / max(timings[engine], 1e-9):.0f} mails/s)")
+
+    # Parity: every engine against 'default'
+    mismatches = 0
+    for engine in PARSER_ENGINES:
+        if engine == 'default':
+            continue
+        for index, (expected, actual) in enumerate(zip(results['default'], results[engine])):
+            expected, actual = extracted_fields(expected), extracted_fields(actual)
+            if expected == actual:
+                continue
+            mismatches += 1
+            if mismatches <= 5:
+                differing = [name for name in COMPARED_FIELDS
+                             if (expected or {}).get(name) != (actual or {}).get(name)]
+                print(f"{RED}  Mismatch in mail #{index} ({engine}): {', '.join(differing)}{NC}")
+                for name in differing[:3]:
+                    print(f"    default:  {str((expected or {}).get(name))[:100]!r}")
+                    print(f"    {engine}: {str((actual or {}).get(name))[:100]!r}")
+
+    print()
+    speedup = timings['default'] / max(timings['compat32'], 1e-9)
+    if mismatches:
+        print(f"{RED}✗ {mismatches} mail(s) with differing fields{NC}")
+    else:
+        print(f"{GREEN}✓ Extracted fields identical for all {len(corpus)} mail(s){NC}")
+    print(f"{GREEN}compat32 speedup: {speedup:.2f}x{NC}")
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Attachment Blob Store
+Content-addressed storage: every distinct attachment is stored once under
+its SHA-256, mails reference their attachments through small manifests
+
+Layout:
+    attachments/blobs/ab/cd/abcd…ef            decoded content
+    attachments/manifests/<mail>.json          per-mail list of blobs
+"""
+import os
+import json
+import hashlib
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+_CHUNK = 1024 * 1024
+
+class BlobStore:
+    def __init__(self, root: Path):
+        """
+        Args:
+            root: Blob directory, usually <storage>/attachments/blobs
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest: str) -> Path:
+        # Two-level fan-out keeps directories small
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def put_bytes(self, content: bytes) -> Tuple[str, Path, bool]:
+        """
+        Store content unless a blob with the same SHA-256 exists
+
+        Returns:
+            (digest, blob path, written) - written is False for a duplicate
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        blob = self.path(digest)
+        if blob.exists():
+            return digest, blob, False
+
+        tmp_path = self._tmp_file()
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            return digest, blob, self._commit(tmp_path, blob)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def put_stream(self, chunks: Iterable[bytes]) -> Tuple[str, Path, bool, int]:
+        """
+        Store content arriving in chunks (e.g. a decoder) - written to a
+        temp file in the store and hashed in the same pass, so memory use
+        is bounded by the chunk size
+
+        Returns:
+            (digest, blob path, written, size) - empty content is not stored
+        """
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = self._tmp_file()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            blob = self.path(digest)
+            if not size:
+                return digest, blob, False, 0
+            return digest, blob, self._commit(tmp_path, blob), size
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def put_file(self, source_path: Path, digest: str = None) -> Tuple[str, Path, bool]:
+        """
+        Store a file's content; the source file is moved into the store or
+        removed if the blob already exists
+
+        Args:
+            digest: SHA-256 of the file if already known (skips the hashing read)
+
+        Returns:
+            (digest, blob path, written)
+        """
+        source_path = Path(source_path)
+        if digest is None:
+            digest = hashlib.sha256()
+            with open(source_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(_CHUNK), b''):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+
+        blob = self.path(digest)
+        if blob.exists():
+            source_path.unlink()
+            return digest, blob, False
+
+        try:
+            return digest, blob, self._commit(source_path, blob)
+        except OSError:
+            # Different filesystem (e.g. spill dir in /tmp): copy into the store first
+            tmp_path = self._tmp_file()
+            try:
+                with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                    for chunk in iter(lambda: src.read(_CHUNK), b''):
+                        dst.write(chunk)
+                written = self._commit(tmp_path, blob)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+            source_path.unlink()
+            return digest, blob, written
+
+    def _tmp_file(self) -> Path:
+        """Temp file inside the store, so the final rename stays on one filesystem"""
+        fd, tmp_name = tempfile.mkstemp(prefix='.tmp-', dir=self.root)
+        os.close(fd)
+        return Path(tmp_name)
+
+    @staticmethod
+    def _commit(tmp_path: Path, blob: Path) -> bool:
+        """Atomically rename into place - False if another writer was faster"""
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        if blob.exists():
+            return False
+        os.replace(tmp_path, blob)
+        return True
+
+class ManifestStore:
+    """
+    Per-mail attachment manifests
+
+        {
+            "message_id": "...",
+            "mail_file": "20251120_100000_<id>.eml",
+            "created_at": "2025-11-20T10:00:00",
+            "attachments": [
+                {"filename": "log.txt", "content_type": "text/plain",
+                 "category": "logs", "size": 1234, "sha256": "..."}
+            ]
+        }
+    """
+
+    def __init__(self, root: Path):
+        """
+        Args:
+            root: Manifest directory, usually <storage>/attachments/manifests
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, name: str) -> Path:
+        return self.root / f"{name}.json"
+
+    def write(self, name: str, message_id: str, attachments: List[Dict[str, Any]],
+              mail_file: str = None) -> Path:
+        """Write the manifest atomically (tmp file + rename)"""
+        manifest = {
+            'message_id': message_id,
+            'mail_file': mail_file,
+            'created_at': datetime.now().isoformat(),
+            'attachments': attachments
+        }
+        manifest_path = self.path(name)
+        tmp_path = manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return manifest_path
+
+    def read(self, name: str) -> Optional[Dict[str, Any]]:
+        manifest_path = self.path(name)
+        if not manifest_path.exists():
+            return None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read manifest {manifest_path}: {e}")
+            return None
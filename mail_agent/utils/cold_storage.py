@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Cold Storage
+Mails in a final state (sent, archived, failed) older than
+storage.cold_tier.after_days are packed together with their artifacts
+(classification, extractions, send receipt) into monthly pack files:
+
+    cold/2025-11.zst      zstd frames (gzip members: cold/2025-11.gz)
+    index/cold.db         file -> pack, offset, length
+
+Every file is compressed on its own, so reading one file is a single seek
+and read - the month never has to be unpacked. FileHandler.read_file() and
+the web editor fall back to the cold store for files that were packed.
+zstd needs the optional 'zstandard' package, otherwise gzip is used.
+
+Usage:
+  python utils/cold_storage.py --tier [--days 30] [--codec zstd|gzip] [--dry-run]
+  python utils/cold_storage.py --cat <file name>                 # print a packed file
+  python utils/cold_storage.py --restore <mail file|mail_id>     # unpack for reprocessing
+  python utils/cold_storage.py --stats
+"""
+import os
+import gzip
+import hashlib
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+from utils.storage_layout import ARTIFACTS, mail_timestamp
+
+logger = get_logger()
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('zstd', 'gzip')
+PACK_SUFFIX = {'zstd': 'zst', 'gzip': 'gz'}
+
+# States whose mails are not touched by the pipeline any more
+COLD_STATES = ('sent', 'archived', 'failed')
+
+DEFAULT_AFTER_DAYS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    mail_file   TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    timestamp   TEXT NOT NULL,
+    state       TEXT,
+    pack        TEXT NOT NULL,
+    offset      INTEGER NOT NULL,
+    length      INTEGER NOT NULL,
+    size        INTEGER NOT NULL,
+    codec       TEXT NOT NULL,
+    sha256      TEXT NOT NULL,
+    packed_at   TEXT,
+    PRIMARY KEY (mail_file, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_members_name ON members(name);
+CREATE INDEX IF NOT EXISTS idx_members_timestamp ON members(timestamp);
+"""
+
+def resolve_codec(codec: str = 'zstd') -> str:
+    """Requested codec if usable - zstd falls back to gzip without 'zstandard'"""
+    if codec not in CODECS:
+        logger.warning(f"Unknown cold storage codec '{codec}', using gzip")
+        return 'gzip'
+    if codec == 'zstd' and zstandard is None:
+        logger.info("zstandard not installed, cold storage uses gzip")
+        return 'gzip'
+    return codec
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    # mtime=0: identical input gives identical members
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("File is zstd-compressed - install 'zstandard' to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def mail_age(mail_path: Path) -> timedelta:
+    """Age from the YYYYMMDD_HHMMSS prefix (file mtime if there is none)"""
+    try:
+        received = datetime.strptime(mail_timestamp(mail_path), '%Y%m%d_%H%M%S')
+    except ValueError:
+        received = datetime.fromtimestamp(Path(mail_path).stat().st_mtime)
+    return datetime.now() - received
+
+class ColdStore:
+    """Monthly pack files of individually compressed files plus their index"""
+
+    def __init__(self, base_path: Path):
+        """
+        Args:
+            base_path: Storage base path (packs in cold/, index in index/cold.db)
+        """
+        self.base_path = Path(base_path)
+        self.root = self.base_path / 'cold'
+        self.db_path = self.base_path / 'index' / 'cold.db'
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Read by the web editor while the tiering job writes
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # === Pack ===
+
+    def pack_mail(self, layout, mail_path: Path, state: str, codec: str) -> Dict[str, int]:
+        """
+        Append a mail and its artifacts to the month's pack, index them and
+        remove the originals (only after reading every member back)
+
+        Returns:
+            {'files', 'size', 'packed'} - bytes before / after compression
+        """
+        mail_path = Path(mail_path)
+        files = [('mail', mail_path)]
+        for kind in ARTIFACTS:
+            artifact = layout.artifact_path(mail_path, kind)
+            if artifact.exists():
+                files.append((kind, artifact))
+
+        timestamp = mail_timestamp(mail_path)
+        self.root.mkdir(parents=True, exist_ok=True)
+        pack = self.root / f"{timestamp[:4]}-{timestamp[4:6]}.{PACK_SUFFIX[codec]}"
+
+        members = []
+        with open(pack, 'ab') as f:
+            for kind, path in files:
+                data = path.read_bytes()
+                frame = compress(data, codec)
+                offset = f.tell()
+                f.write(frame)
+                members.append({
+                    'kind': kind, 'name': path.name, 'offset': offset, 'length': len(frame),
+                    'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()
+                })
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Deleting the originals is only safe if the pack reads back correctly
+        for member in members:
+            data = self._read(pack.name, member['offset'], member['length'], codec)
+            if hashlib.sha256(data).hexdigest() != member['sha256']:
+                raise IOError(f"Verification failed for {member['name']} in {pack.name}")
+
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            for member in members:
+                self._conn.execute(
+                    """
+                    INSERT OR REPLACE INTO members (mail_file, kind, name, timestamp, state, pack,
+                                                    offset, length, size, codec, sha256, packed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (mail_path.name, member['kind'], member['name'], timestamp, state, pack.name,
+                     member['offset'], member['length'], member['size'], codec, member['sha256'], now)
+                )
+
+        for _, path in files:
+            path.unlink()
+
+        registry = getattr(layout, 'registry', None)
+        if registry:
+            registry.record_stage(mail_path, 'cold', pack)
+
+        return {
+            'files': len(members),
+            'size': sum(member['size'] for member in members),
+            'packed': sum(member['length'] for member in members)
+        }
+
+    def tier(self, layout, after_days: int = DEFAULT_AFTER_DAYS, codec: str = 'zstd',
+             dry_run: bool = False) -> Dict[str, int]:
+        """
+        Pack all mails in a final state older than after_days
+
+        Args:
+            layout: Storage layout (utils.storage_layout, usually with registry)
+        """
+        codec = resolve_codec(codec)
+        stats = {'mails': 0, 'files': 0, 'size': 0, 'packed': 0, 'errors': 0}
+        min_age = timedelta(days=after_days)
+
+        for state in COLD_STATES:
+            for mail_path in layout.mails(state):
+                if mail_age(mail_path) < min_age:
+                    continue
+                stats['mails'] += 1
+                if dry_run:
+                    stats['size'] += mail_path.stat().st_size
+                    continue
+                try:
+                    result = self.pack_mail(layout, mail_path, state, codec)
+                except Exception as e:
+                    logger.error(f"Could not pack {mail_path.name}: {e}")
+                    stats['errors'] += 1
+                    continue
+                for key in ('files', 'size', 'packed'):
+                    stats[key] += result[key]
+                logger.debug(f"Packed {mail_path.name}: {result['size']} -> {result['packed']} bytes")
+
+        return stats
+
+    # === Read ===
+
+    def _read(self, pack: str, offset: int, length: int, codec: str) -> bytes:
+        with open(self.root / pack, 'rb') as f:
+            f.seek(offset)
+            return decompress(f.read(length), codec)
+
+    def _read_member(self, member: Dict[str, Any]) -> bytes:
+        return self._read(member['pack'], member['offset'], member['length'], member['codec'])
+
+    def find(self, name: str) -> Optional[Dict[str, Any]]:
+        """Index row of a packed file (by file name or original path)"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM members WHERE name = ? ORDER BY packed_at DESC LIMIT 1', (Path(name).name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def read(self, name: str) -> Optional[bytes]:
+        """Content of a packed file, None if it is not in the cold store"""
+        member = self.find(name)
+        return self._read_member(member) if member else None
+
+    def members(self, mail_file: str) -> List[Dict[str, Any]]:
+        """Packed files of a mail (mail first)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM members WHERE mail_file = ? ORDER BY kind != 'mail', kind",
+                (Path(mail_file).name,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def mail_files(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute('SELECT DISTINCT mail_file FROM members').fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(DISTINCT mail_file), COUNT(*), COALESCE(SUM(size), 0), '
+                'COALESCE(SUM(length), 0) FROM members'
+            ).fetchone()
+        return {'mails': row[0], 'files': row[1], 'size': row[2], 'packed': row[3]}
+
+    # === Restore ===
+
+    def restore(self, layout, mail_file: str) -> Optional[Path]:
+        """
+        Unpack a mail and its artifacts to their place in the layout (e.g.
+        for reprocessing); the pack keeps the bytes, the index drops them
+
+        Returns:
+            Path of the restored mail, None if the mail is not packed
+        """
+        members = self.members(mail_file)
+        if not members:
+            return None
+
+        mail_path = layout.mail_path(members[0]['mail_file'], members[0]['state'] or 'archived')
+        for member in members:
+            data = self._read_member(member)
+            if hashlib.sha256(data).hexdigest() != member['sha256']:
+                raise IOError(f"Checksum mismatch for {member['name']} in {member['pack']}")
+            target = mail_path if member['kind'] == 'mail' else layout.artifact_path(mail_path, member['kind'])
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = target.with_name(target.name + '.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, target)
+
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM members WHERE mail_file = ?', (mail_path.name,))
+
+        registry = getattr(layout, 'registry', None)
+        if registry:
+            registry.register(mail_path, members[0]['state'] or 'archived')
+            registry.record_stage(mail_path, 'cold', None, 'restored')
+
+        logger.info(f"Restored {mail_path.name} from cold storage ({len(members)} file(s))")
+        return mail_path
+
+def tier_config(storage_config: Dict[str, Any]) -> Dict[str, Any]:
+    """storage.cold_tier from application.json with defaults (opt-in: packing deletes the originals)"""
+    config = storage_config.get('cold_tier', {})
+    return {
+        'enabled': config.get('enabled', False),
+        'after_days': config.get('after_days', DEFAULT_AFTER_DAYS),
+        'codec': config.get('codec', 'zstd')
+    }
+
+def _format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+def main():
+    from run_agent import load_config
+    from utils.storage_layout import create_layout
+
+    parser = argparse.ArgumentParser(description='Nice2Know cold storage')
+    parser.add_argument('--tier', action='store_true', help='Pack old sent/archived/failed mails')
+    parser.add_argument('--days', type=int, help='Minimum age in days (default: storage.cold_tier.after_days)')
+    parser.add_argument('--codec', choices=CODECS, help='Compression (default: storage.cold_tier.codec)')
+    parser.add_argument('--dry-run', action='store_true', help='Only count what would be packed')
+    parser.add_argument('--cat', metavar='FILE', help='Write a packed file to stdout')
+    parser.add_argument('--restore', metavar='MAIL', help='Unpack a mail (file name or mail_id)')
+    parser.add_argument('--stats', action='store_true', help='Show cold storage size')
+    args = parser.parse_args()
+
+    config = load_config()
+    base_path = config['storage']['base_path']
+    store = ColdStore(base_path)
+
+    if args.cat:
+        data = store.read(args.cat)
+        if data is None:
+            print(f"Not in cold storage: {args.cat}", file=sys.stderr)
+            return 1
+        sys.stdout.buffer.write(data)
+        return 0
+
+    settings = tier_config(config['storage'])
+    layout = create_layout(base_path, config['storage'].get('layout', 'flat'))
+
+    if args.tier:
+        days = args.days if args.days is not None else settings['after_days']
+        stats = store.tier(layout, days, args.codec or settings['codec'], dry_run=args.dry_run)
+        if args.dry_run:
+            print(f"Would pack {stats['mails']} mail(s) older than {days} days "
+                  f"({_format_size(stats['size'])} of .eml)")
+        else:
+            ratio = stats['size'] / stats['packed'] if stats['packed'] else 0
+            print(f"Packed {stats['mails']} mail(s), {stats['files']} file(s): "
+                  f"{_format_size(stats['size'])} -> {_format_size(stats['packed'])} ({ratio:.1f}x)"
+                  + (f", {stats['errors']} error(s)" if stats['errors'] else ''))
+
+    if args.restore:
+        from utils.file_handler import FileHandler
+        mail_path = FileHandler(base_path, config['storage'].get('layout', 'flat')).restore_mail(args.restore)
+        if not mail_path:
+            print(f"Not in cold storage: {args.restore}")
+            return 1
+        print(f"Restored: {mail_path}")
+
+    if args.stats:
+        stats = store.stats()
+        ratio = stats['size'] / stats['packed'] if stats['packed'] else 0
+        print(f"Cold storage: {stats['mails']} mail(s), {stats['files']} file(s), "
+              f"{_format_size(stats['size'])} -> {_format_size(stats['packed'])} ({ratio:.1f}x)")
+
+    store.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
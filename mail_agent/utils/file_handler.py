@@ -3,28 +3,33 @@
 Nice2Know Mail Agent - File Operations
 """
 import os
-import hashlib
+import json
 from pathlib import Path
 from datetime import datetime
+from typing import Optional, Any
 import sys
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from utils.logger import get_logger
+from utils.blob_store import BlobStore, ManifestStore
+from utils.storage_layout import create_layout
 
 logger = get_logger()
 
 class FileHandler:
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, layout: str = 'flat'):
         """
         Initialize FileHandler with storage base path
         
         Args:
             base_path: Absolute or relative path to storage directory
+            layout: 'flat' (state folders) or 'bundle' (YYYY/MM/DD/<mail>/)
         """
         # Convert to Path object and resolve to absolute path
         self.base_path = Path(base_path).resolve()
+        self.layout = create_layout(self.base_path, layout)
         
         logger.info(f"FileHandler initialized with base_path: {self.base_path}")
         
@@ -33,14 +38,21 @@ class FileHandler:
             logger.warning(f"Base path does not exist, will be created: {self.base_path}")
         
         self._ensure_directories()
+        self.layout.ensure_directories()
+        
+        # Attachments are stored once per content (SHA-256), mails reference them via manifests
+        self.blobs = BlobStore(self.base_path / 'attachments' / 'blobs')
+        self.manifests = ManifestStore(self.base_path / 'attachments' / 'manifests')
+        
+        # Old sent/archived/failed mails packed by utils/cold_storage.py (opened on first use)
+        self._cold = None
     
     def _ensure_directories(self):
         """Create all required directories"""
         dirs = [
             self.base_path / 'mails',
-            self.base_path / 'attachments' / 'images',
-            self.base_path / 'attachments' / 'documents',
-            self.base_path / 'attachments' / 'logs',
+            self.base_path / 'attachments' / 'blobs',
+            self.base_path / 'attachments' / 'manifests',
             self.base_path / 'processed',
             self.base_path / 'failed',
             self.base_path / 'sent'
@@ -69,11 +81,9 @@ class FileHandler:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         safe_mail_id = self._sanitize_filename(mail_id)
         filename = f"{timestamp}_{safe_mail_id}.{extension}"
-        filepath = self.base_path / 'mails' / filename
         
         try:
-            with open(filepath, 'wb') as f:
-                f.write(content)
+            filepath = self.layout.store_mail_bytes(content, filename, message_id=mail_id)
             
             logger.info(f"Saved mail: {filepath.name} ({len(content)} bytes)")
             return filepath
@@ -81,43 +91,125 @@ class FileHandler:
             logger.error(f"Failed to save mail {filename}: {e}")
             raise
     
-    def save_attachment(self, filename: str, content: bytes, category: str = 'documents') -> Path:
+    def adopt_mail(self, mail_id: str, spool_path: Path, extension: str = 'eml') -> Path:
         """
-        Save attachment to categorized directory
+        Move a spooled raw email into storage (mails directory or its bundle)
+        
+        Same naming as save_mail, but the content is never loaded into
+        memory (rename within the storage filesystem).
         
         Args:
-            filename: Original attachment filename
-            content: File content as bytes
-            category: Category folder (images/documents/logs)
+            mail_id: Message ID (will be sanitized)
+            spool_path: File written by the streaming IMAP fetch
+            extension: File extension (default: eml)
         
         Returns:
             Path to saved file
         """
-        safe_filename = self._sanitize_filename(filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        safe_mail_id = self._sanitize_filename(mail_id)
+        filename = f"{timestamp}_{safe_mail_id}.{extension}"
         
-        # Add hash to prevent duplicates
-        file_hash = hashlib.md5(content).hexdigest()[:8]
-        name, ext = os.path.splitext(safe_filename)
-        unique_filename = f"{timestamp}_{file_hash}_{name}{ext}"
+        try:
+            size = spool_path.stat().st_size
+            filepath = self.layout.store_mail(spool_path, filename, message_id=mail_id)
+            
+            logger.info(f"Saved mail: {filepath.name} ({size} bytes)")
+            return filepath
+        except Exception as e:
+            logger.error(f"Failed to save mail {filename}: {e}")
+            raise
+    
+    def save_attachment(self, filename: str, content: bytes) -> Path:
+        """
+        Save attachment content to the blob store (skipped if already stored)
         
-        # Validate category
-        valid_categories = ['images', 'documents', 'logs']
-        if category not in valid_categories:
-            logger.warning(f"Invalid category '{category}', using 'documents'")
-            category = 'documents'
+        Args:
+            filename: Original attachment filename (for logging, kept in the manifest)
+            content: File content as bytes
         
-        filepath = self.base_path / 'attachments' / category / unique_filename
+        Returns:
+            Path to the blob (name is the SHA-256 of the content)
+        """
+        try:
+            digest, blob, written = self.blobs.put_bytes(content)
+        except Exception as e:
+            logger.error(f"Failed to save attachment {filename}: {e}")
+            raise
+        
+        self._log_blob(filename, digest, len(content), written)
+        return blob
+    
+    def save_attachment_stream(self, filename: str, chunks) -> Optional[Path]:
+        """
+        Save an attachment decoded chunk by chunk (e.g. PartRef.iter_decoded())
+        straight into the blob store, hashing in the same pass
+        
+        Args:
+            filename: Original attachment filename
+            chunks: Iterable of decoded bytes
         
+        Returns:
+            Path to the blob, None if the content is empty
+        """
         try:
-            with open(filepath, 'wb') as f:
-                f.write(content)
-            
-            logger.info(f"Saved attachment: {category}/{unique_filename} ({len(content)} bytes)")
-            return filepath
+            digest, blob, written, size = self.blobs.put_stream(chunks)
         except Exception as e:
-            logger.error(f"Failed to save attachment {unique_filename}: {e}")
+            logger.error(f"Failed to save attachment {filename}: {e}")
             raise
+        
+        if not size:
+            return None
+        self._log_blob(filename, digest, size, written)
+        return blob
+    
+    def save_attachment_file(self, filename: str, source_path: Path, digest: str = None) -> Path:
+        """
+        Save an attachment whose decoded content already is a file
+        (spilled by the streaming parse) - moved instead of loaded into
+        memory, removed if already stored
+        
+        Args:
+            filename: Original attachment filename
+            source_path: File with the decoded content (consumed)
+            digest: SHA-256 computed while the file was written (else hashed here)
+        
+        Returns:
+            Path to the blob
+        """
+        try:
+            size = Path(source_path).stat().st_size
+            digest, blob, written = self.blobs.put_file(source_path, digest)
+        except Exception as e:
+            logger.error(f"Failed to save attachment {filename}: {e}")
+            raise
+        
+        self._log_blob(filename, digest, size, written)
+        return blob
+    
+    @staticmethod
+    def _log_blob(filename: str, digest: str, size: int, written: bool):
+        if written:
+            logger.info(f"Saved attachment: {filename} -> blobs/{digest[:12]}… ({size} bytes)")
+        else:
+            logger.info(f"Attachment already stored: {filename} -> blobs/{digest[:12]}… (write skipped)")
+    
+    def save_attachment_manifest(self, mail_id: str, attachments: list, mail_file: str = None) -> Path:
+        """
+        Write the manifest listing a mail's attachments
+        
+        Args:
+            mail_id: Message-ID of the mail
+            attachments: Entries with filename, content_type, category, size, sha256
+            mail_file: File name of the stored .eml (if saved)
+        
+        Returns:
+            Path to the manifest
+        """
+        name = Path(mail_file).stem if mail_file else self._sanitize_filename(mail_id)
+        manifest_path = self.manifests.write(name, mail_id, attachments, mail_file)
+        logger.info(f"Saved attachment manifest: {manifest_path.name} ({len(attachments)} attachment(s))")
+        return manifest_path
     
     def move_to_processed(self, mail_path: Path) -> Path:
         """
@@ -127,16 +219,14 @@ class FileHandler:
             mail_path: Path to mail file
         
         Returns:
-            New path in processed folder
+            New path (processed folder, unchanged for bundles)
         """
         if not mail_path.exists():
             logger.error(f"Mail file not found: {mail_path}")
             raise FileNotFoundError(f"Mail file not found: {mail_path}")
         
-        dest = self.base_path / 'processed' / mail_path.name
-        
         try:
-            mail_path.rename(dest)
+            dest = self.layout.set_state(mail_path, 'processed')
             logger.debug(f"Moved to processed: {mail_path.name}")
             return dest
         except Exception as e:
@@ -151,22 +241,70 @@ class FileHandler:
             mail_path: Path to mail file
         
         Returns:
-            New path in failed folder
+            New path (failed folder, unchanged for bundles)
         """
         if not mail_path.exists():
             logger.error(f"Mail file not found: {mail_path}")
             raise FileNotFoundError(f"Mail file not found: {mail_path}")
         
-        dest = self.base_path / 'failed' / mail_path.name
-        
         try:
-            mail_path.rename(dest)
+            dest = self.layout.set_state(mail_path, 'failed')
             logger.debug(f"Moved to failed: {mail_path.name}")
             return dest
         except Exception as e:
             logger.error(f"Failed to move mail to failed folder: {e}")
             raise
     
+    @property
+    def cold(self):
+        if self._cold is None:
+            from utils.cold_storage import ColdStore
+            self._cold = ColdStore(self.base_path)
+        return self._cold
+    
+    def stored_file_exists(self, path: Path) -> bool:
+        """True if the file is on disk or packed in cold storage"""
+        return Path(path).exists() or self.cold.find(path) is not None
+    
+    def read_file(self, path: Path) -> bytes:
+        """
+        Read a stored mail or JSON - from disk, or decompressed from cold
+        storage if it has been packed
+        
+        Raises:
+            FileNotFoundError: Neither on disk nor in cold storage
+        """
+        path = Path(path)
+        if path.exists():
+            return path.read_bytes()
+        
+        content = self.cold.read(path)
+        if content is None:
+            raise FileNotFoundError(f"Stored file not found: {path}")
+        logger.debug(f"Read {path.name} from cold storage")
+        return content
+    
+    def load_json(self, path: Path) -> Any:
+        """Stored JSON (classification, extraction, receipt), see read_file"""
+        return json.loads(self.read_file(path).decode('utf-8'))
+    
+    def restore_mail(self, key: str) -> Optional[Path]:
+        """
+        Unpack a mail and its JSONs from cold storage (e.g. for reprocessing)
+        
+        Args:
+            key: Mail file name or mail_id
+        
+        Returns:
+            Path of the restored mail, None if it is not packed
+        """
+        mail_file = key
+        registry = getattr(self.layout, 'registry', None)
+        if registry and not self.cold.members(key):
+            row = registry.find(mail_id=key)
+            mail_file = row['mail_file'] if row else key
+        return self.cold.restore(self.layout, mail_file)
+    
     def get_mails_directory(self) -> Path:
         """Get path to mails directory"""
         return self.base_path / 'mails'
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Mail Registry
+One SQLite table of all stored mails (file name, timestamp, mail_id,
+Message-ID, current path and pipeline state) plus the result of every
+stage (classification, extractions, send receipt). Each stage updates it
+in a transaction, so the daemon, the scripts and the web editor look mails
+up by key instead of globbing the storage folders.
+
+The registry is attached to the storage layout (utils.storage_layout):
+files are still written by the layout, RegisteredLayout records each
+change and answers mails()/find_mail()/state_of() from the index.
+
+Usage:
+  python utils/mail_registry.py --rebuild      # re-register all stored mails
+  python utils/mail_registry.py --show <key>   # mail file, timestamp, mail_id or Message-ID
+"""
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+from utils.storage_layout import ARTIFACTS, mail_timestamp
+
+logger = get_logger()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mails (
+    mail_file   TEXT PRIMARY KEY,
+    timestamp   TEXT NOT NULL,
+    mail_id     TEXT,
+    message_id  TEXT,
+    path        TEXT NOT NULL,
+    state       TEXT NOT NULL,
+    created_at  TEXT,
+    updated_at  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_mails_timestamp ON mails(timestamp);
+CREATE INDEX IF NOT EXISTS idx_mails_mail_id ON mails(mail_id);
+CREATE INDEX IF NOT EXISTS idx_mails_message_id ON mails(message_id);
+CREATE INDEX IF NOT EXISTS idx_mails_state ON mails(state, timestamp);
+
+CREATE TABLE IF NOT EXISTS stages (
+    mail_file   TEXT NOT NULL,
+    stage       TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    path        TEXT,
+    updated_at  TEXT,
+    PRIMARY KEY (mail_file, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_stages_stage ON stages(stage, status);
+"""
+
+def mail_id_from_file(mail_file: str) -> Optional[str]:
+    """
+    mail_id as written into the extracted JSONs: hex UUID of the file name
+    without hyphens (see agents/llm_request.extract_mail_id), otherwise the
+    part after the timestamp
+    """
+    parts = Path(mail_file).stem.split('@')[0].split('_')
+    if len(parts) < 3:
+        return None
+    candidate = parts[-1].replace('-', '').lower()
+    if len(candidate) >= 32 and all(c in '0123456789abcdef' for c in candidate[:32]):
+        return candidate[:32]
+    return '_'.join(Path(mail_file).stem.split('_')[2:]) or None
+
+def result_mail_id(json_path: Path) -> Optional[str]:
+    """mail_id inside an extracted JSON (the editor opens records by it)"""
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            mail_id = json.load(f).get('mail_id')
+    except Exception as e:
+        logger.debug(f"No mail_id in {Path(json_path).name}: {e}")
+        return None
+    return mail_id if isinstance(mail_id, str) and mail_id else None
+
+class MailRegistry:
+    """
+    SQLite-backed registry of stored mails and their stage results
+
+    Mails are keyed by file name (YYYYMMDD_HHMMSS_<id>.eml), which stays the
+    same in every state and layout; timestamp, mail_id and Message-ID are
+    indexed for lookups.
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        Args:
+            db_path: Database file, usually <storage>/index/registry.db
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Shared by the backfill worker threads - access is serialized by the lock
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Daemon, scripts and web editor are separate processes
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # === Updates (one transaction each) ===
+
+    def register(self, mail_path: Path, state: str = 'new', message_id: str = None):
+        """Add a stored mail or update its path and state"""
+        mail_path = Path(mail_path)
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._upsert(mail_path, state, message_id, now)
+
+    def _upsert(self, mail_path: Path, state: str, message_id: Optional[str], now: str):
+        self._conn.execute(
+            """
+            INSERT INTO mails (mail_file, timestamp, mail_id, message_id, path, state,
+                               created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(mail_file) DO UPDATE SET
+                path = excluded.path,
+                state = excluded.state,
+                message_id = COALESCE(excluded.message_id, mails.message_id),
+                updated_at = excluded.updated_at
+            """,
+            (mail_path.name, mail_timestamp(mail_path), mail_id_from_file(mail_path.name),
+             message_id, str(mail_path), state, now, now)
+        )
+
+    def set_state(self, mail_path: Path, state: str):
+        """New state (and path - flat layout moves the file)"""
+        mail_path = Path(mail_path)
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                'UPDATE mails SET state = ?, path = ?, updated_at = ? WHERE mail_file = ?',
+                (state, str(mail_path), datetime.now().isoformat(), mail_path.name)
+            ).rowcount
+            if not updated:
+                self._upsert(mail_path, state, None, datetime.now().isoformat())
+
+    def record_stage(self, mail_path: Path, stage: str, path: Path = None,
+                     status: str = 'ok', mail_id: str = None):
+        """
+        Result of a pipeline stage (stage = artifact kind, e.g. 'problem')
+
+        Args:
+            status: 'ok', 'failed' or 'missing' (recorded file gone)
+            mail_id: mail_id found in the result, replaces the one derived
+                     from the file name
+        """
+        mail_file = Path(mail_path).name
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO stages (mail_file, stage, status, path, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (mail_file, stage, status, str(path) if path else None, now)
+            )
+            if mail_id:
+                self._conn.execute(
+                    'UPDATE mails SET mail_id = ?, updated_at = ? WHERE mail_file = ?',
+                    (mail_id, now, mail_file)
+                )
+
+    def forget(self, mail_file: str):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM stages WHERE mail_file = ?', (Path(mail_file).name,))
+            self._conn.execute('DELETE FROM mails WHERE mail_file = ?', (Path(mail_file).name,))
+
+    # === Lookup ===
+
+    def get(self, mail_file: str) -> Optional[Dict[str, Any]]:
+        """Registry row of a mail (by file name or path)"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM mails WHERE mail_file = ?', (Path(mail_file).name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def find(self, timestamp: str = None, mail_id: str = None, message_id: str = None,
+             state: str = None) -> Optional[Dict[str, Any]]:
+        """Newest mail matching all given keys"""
+        rows = self.mails(state, timestamp=timestamp, mail_id=mail_id, message_id=message_id)
+        return rows[-1] if rows else None
+
+    def mails(self, state: Optional[str] = None, with_stage: str = None, without_stage: str = None,
+              timestamp: str = None, mail_id: str = None, message_id: str = None) -> List[Dict[str, Any]]:
+        """
+        Mails in a state (None: all), oldest first
+
+        Args:
+            with_stage / without_stage: only mails with / without a
+                successful result of that stage
+        """
+        query = 'SELECT m.* FROM mails m'
+        conditions, params = [], []
+        if with_stage:
+            query += " JOIN stages s ON s.mail_file = m.mail_file AND s.stage = ? AND s.status = 'ok'"
+            params.append(with_stage)
+        if without_stage:
+            conditions.append(
+                "NOT EXISTS (SELECT 1 FROM stages x WHERE x.mail_file = m.mail_file "
+                "AND x.stage = ? AND x.status = 'ok')"
+            )
+            params.append(without_stage)
+        for column, value in (('m.state', state), ('m.timestamp', timestamp),
+                              ('m.mail_id', mail_id), ('m.message_id', message_id)):
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY m.timestamp, m.mail_file'
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def stages(self, mail_file: str) -> Dict[str, Dict[str, Any]]:
+        """Stage results of a mail: {stage: row}"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM stages WHERE mail_file = ?', (Path(mail_file).name,)
+            ).fetchall()
+        return {row['stage']: dict(row) for row in rows}
+
+    def has_stage(self, mail_file: str, stage: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM stages WHERE mail_file = ? AND stage = ? AND status = 'ok'",
+                (Path(mail_file).name, stage)
+            ).fetchone()
+        return row is not None
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM mails LIMIT 1').fetchone() is None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM mails GROUP BY state').fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    # === Rebuild ===
+
+    def sync(self, layout, keep: List[str] = ()) -> int:
+        """
+        Register all mails found on disk with their state and existing
+        artifacts; rows of mails that are gone are dropped
+
+        Args:
+            layout: FlatLayout or BundleLayout (scans the storage)
+            keep: Mail files stored elsewhere (cold storage) - rows are kept
+        """
+        now = datetime.now().isoformat()
+        found = set()
+        with self._lock, self._conn:
+            for mail_path in layout.mails(None):
+                self._upsert(mail_path, layout.state_of(mail_path) or 'new', None, now)
+                found.add(mail_path.name)
+                for kind in ARTIFACTS:
+                    artifact = layout.artifact_path(mail_path, kind)
+                    if artifact.exists():
+                        self._conn.execute(
+                            """
+                            INSERT OR IGNORE INTO stages (mail_file, stage, status, path, updated_at)
+                            VALUES (?, ?, 'ok', ?, ?)
+                            """,
+                            (mail_path.name, kind, str(artifact), now)
+                        )
+                        mail_id = result_mail_id(artifact) if kind == 'problem' else None
+                        if mail_id:
+                            self._conn.execute('UPDATE mails SET mail_id = ? WHERE mail_file = ?',
+                                               (mail_id, mail_path.name))
+
+            known = [row[0] for row in self._conn.execute('SELECT mail_file FROM mails')]
+            for mail_file in known:
+                if mail_file not in found and mail_file not in keep:
+                    self._conn.execute('DELETE FROM stages WHERE mail_file = ?', (mail_file,))
+                    self._conn.execute('DELETE FROM mails WHERE mail_file = ?', (mail_file,))
+        return len(found)
+
+class RegisteredLayout:
+    """
+    Storage layout whose lookups are answered by the registry
+
+    Wraps a FlatLayout/BundleLayout: writes and moves are done by the
+    layout, then recorded in the registry. Everything else (artifact_path,
+    bundle_dir, root, ...) is passed through.
+
+    Artifacts written outside the registry (editor, older code, manual
+    files) have no stage row - artifact lookups check the file for those
+    and record it when found. Rows whose file was deleted or moved since
+    are marked 'missing' instead of being trusted.
+    """
+
+    def __init__(self, layout, registry: MailRegistry):
+        self.layout = layout
+        self.registry = registry
+        # First run on an existing storage
+        if registry.is_empty():
+            count = registry.sync(layout)
+            if count:
+                logger.info(f"Mail registry initialized with {count} stored mail(s)")
+
+    def __getattr__(self, name):
+        return getattr(self.layout, name)
+
+    def store_mail(self, source_path: Path, filename: str, message_id: str = None) -> Path:
+        dest = self.layout.store_mail(source_path, filename, message_id)
+        self.registry.register(dest, 'new', message_id)
+        return dest
+
+    def store_mail_bytes(self, content: bytes, filename: str, message_id: str = None) -> Path:
+        dest = self.layout.store_mail_bytes(content, filename, message_id)
+        self.registry.register(dest, 'new', message_id)
+        return dest
+
+    def mails(self, state: Optional[str] = 'new', with_artifact: str = None,
+              without_artifact: str = None) -> List[Path]:
+        """Mails in a state (None: all), oldest first - indexed query"""
+        rows = self.registry.mails(state, with_stage=with_artifact, without_stage=without_artifact)
+        if with_artifact:
+            rows = [row for row in rows if self._recorded_artifact(Path(row['path']), with_artifact)]
+            # Not recorded as done, but the artifact may be on disk anyway
+            rows += [row for row in self.registry.mails(state, without_stage=with_artifact)
+                     if self._unrecorded_artifact(Path(row['path']), with_artifact)]
+        if without_artifact:
+            rows = [row for row in rows if not self._unrecorded_artifact(Path(row['path']), without_artifact)]
+            # Recorded as done, but the artifact is gone
+            rows += [row for row in self.registry.mails(state, with_stage=without_artifact)
+                     if not self._recorded_artifact(Path(row['path']), without_artifact)]
+        if with_artifact or without_artifact:
+            rows.sort(key=lambda row: (row['timestamp'] or '', row['mail_file']))
+
+        found = []
+        for row in rows:
+            mail_path = Path(row['path'])
+            if mail_path.exists():
+                found.append(mail_path)
+            else:
+                logger.debug(f"Registered mail missing on disk: {mail_path}")
+        return found
+
+    def state_of(self, mail_path: Path) -> Optional[str]:
+        row = self.registry.get(mail_path)
+        return row['state'] if row else self.layout.state_of(mail_path)
+
+    def set_state(self, mail_path: Path, state: str) -> Path:
+        dest = self.layout.set_state(mail_path, state)
+        self.registry.set_state(dest, state)
+        return dest
+
+    def record_artifact(self, mail_path: Path, kind: str, status: str = 'ok'):
+        """Stage result: written by the stage, recorded by layout and registry"""
+        self.layout.record_artifact(mail_path, kind, status)
+        artifact = self.layout.artifact_path(mail_path, kind)
+        if status != 'ok':
+            self.registry.record_stage(mail_path, kind, None, status)
+            return
+        mail_id = result_mail_id(artifact) if kind == 'problem' else None
+        self.registry.record_stage(mail_path, kind, artifact, status, mail_id)
+
+    def has_artifact(self, mail_path: Path, kind: str) -> bool:
+        if self.registry.has_stage(mail_path, kind):
+            return self._recorded_artifact(mail_path, kind)
+        return self._unrecorded_artifact(mail_path, kind)
+
+    def _recorded_artifact(self, mail_path: Path, kind: str) -> bool:
+        """Successful stage row whose file still exists - a stale row is marked 'missing'"""
+        stages = self.registry.stages(mail_path)
+        row = stages.get(kind)
+        if row and row['path'] and Path(row['path']).exists():
+            return True
+        if self.layout.has_artifact(mail_path, kind):
+            # Moved with the mail (state change) - record the current path
+            self.registry.record_stage(mail_path, kind, self.layout.artifact_path(mail_path, kind))
+            return True
+        if stages.get('cold', {}).get('status') == 'ok':
+            # Packed into cold storage together with the mail
+            return True
+        logger.debug(f"Recorded {kind} of {Path(mail_path).name} missing on disk")
+        self.registry.record_stage(mail_path, kind, None, 'missing')
+        return False
+
+    def _unrecorded_artifact(self, mail_path: Path, kind: str) -> bool:
+        """Artifact file without a successful stage row - recorded if it exists"""
+        if not self.layout.has_artifact(mail_path, kind):
+            return False
+        artifact = self.layout.artifact_path(mail_path, kind)
+        mail_id = result_mail_id(artifact) if kind == 'problem' else None
+        self.registry.record_stage(mail_path, kind, artifact, 'ok', mail_id)
+        return True
+
+    def find_mail(self, timestamp: str, state: Optional[str] = None) -> Optional[Path]:
+        """Mail file for a YYYYMMDD_HHMMSS timestamp"""
+        row = self.registry.find(timestamp=timestamp, state=state)
+        if row and Path(row['path']).exists():
+            return Path(row['path'])
+        return None
+
+def default_registry_path(storage_base: Path) -> Path:
+    return Path(storage_base) / 'index' / 'registry.db'
+
+def cold_mail_files(storage_base: Path) -> List[str]:
+    """Mails packed into cold storage (their files are not on disk)"""
+    if not (Path(storage_base) / 'index' / 'cold.db').exists():
+        return []
+    from utils.cold_storage import ColdStore
+    store = ColdStore(storage_base)
+    mail_files = store.mail_files()
+    store.close()
+    return mail_files
+
+def main():
+    from run_agent import load_config
+    from utils.storage_layout import create_layout
+
+    parser = argparse.ArgumentParser(description='Nice2Know mail registry')
+    parser.add_argument('--rebuild', action='store_true', help='Re-register all stored mails')
+    parser.add_argument('--show', metavar='KEY', help='Mail file, timestamp, mail_id or Message-ID')
+    args = parser.parse_args()
+
+    config = load_config()
+    base_path = config['storage']['base_path']
+    registry = MailRegistry(default_registry_path(base_path))
+
+    if args.rebuild:
+        layout = create_layout(base_path, config['storage'].get('layout', 'flat'), registry=False)
+        count = registry.sync(layout, keep=set(cold_mail_files(base_path)))
+        states = ', '.join(f"{state}: {n}" for state, n in sorted(registry.stats().items()))
+        print(f"Registered {count} mail(s) ({states or 'empty'})")
+
+    if args.show:
+        key = args.show.strip('<>')
+        row = (registry.get(key) or registry.find(timestamp=key) or registry.find(mail_id=key)
+               or registry.find(message_id=key))
+        if not row:
+            print(f"Unknown mail: {args.show}")
+            return 1
+        for column in ('mail_file', 'timestamp', 'mail_id', 'message_id', 'state', 'path'):
+            print(f"  {column:<11} {row[column]}")
+        for stage, result in sorted(registry.stages(row['mail_file']).items()):
+            print(f"  {stage:<11} {result['status']:<7} {result['path'] or '-'}")
+
+    registry.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Parsed Mail Cache
+Parse-once sidecars (normalized headers + decoded body) keyed by the
+SHA-256 of the raw .eml, shared by ingestion, classifier, extractor and sender
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Any, Optional
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+from agents.mail_parser import html_to_text
+from agents.body_reducer import reduce_body
+
+logger = get_logger()
+
+# Bump when MailParser output changes - older sidecars are re-parsed
+CACHE_VERSION = 3
+
+def normalize_parsed(parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-serializable copy of a MailParser result (no MIME part objects)"""
+    body = parsed['body']
+    return {
+        'message_id': parsed['message_id'],
+        'from': parsed['from'],
+        'to': parsed['to'],
+        'cc': parsed['cc'],
+        'subject': parsed['subject'],
+        'date': parsed['date'],
+        'body': dict(body),
+        # Prompt-ready body: quotes/signatures/disclaimers removed, offsets kept
+        'reduced': reduce_body(body['plain'] or html_to_text(body['html'])),
+        'attachments': [
+            {
+                'filename': att['filename'],
+                'content_type': att['content_type'],
+                'size': att['size']
+            }
+            for att in parsed['attachments']
+        ],
+        'headers': {name: str(value) for name, value in parsed['headers'].items()},
+        'raw_size': parsed['raw_size'],
+        'smime_signed': parsed['smime_signed'],
+        'source': parsed.get('source', '')
+    }
+
+class ParseCache:
+    def __init__(self, cache_dir: Path):
+        """
+        Args:
+            cache_dir: Sidecar directory, usually <storage>/cache/parsed
+        """
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def content_hash(raw_email: bytes) -> str:
+        return hashlib.sha256(raw_email).hexdigest()
+
+    @staticmethod
+    def file_hash(mail_path: Path) -> str:
+        """SHA-256 of a file, read in chunks"""
+        digest = hashlib.sha256()
+        with open(mail_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _sidecar(self, digest: str) -> Path:
+        # Two-level fan-out keeps directories small
+        return self.cache_dir / digest[:2] / f"{digest}.json"
+
+    def get(self, raw_email: bytes) -> Optional[Dict[str, Any]]:
+        """Cached parse result for these bytes, None on miss"""
+        return self.get_digest(self.content_hash(raw_email))
+
+    def get_digest(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Cached parse result for a SHA-256 digest, None on miss"""
+        sidecar = self._sidecar(digest)
+        if not sidecar.exists():
+            return None
+
+        try:
+            with open(sidecar, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Unreadable parse cache entry {sidecar.name}: {e}")
+            return None
+
+        if data.get('cache_version') != CACHE_VERSION:
+            return None
+        return data['parsed']
+
+    def put(self, raw_email: bytes, parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a MailParser result
+
+        Returns:
+            The normalized (cached) form
+        """
+        return self.put_digest(self.content_hash(raw_email), parsed)
+
+    def put_digest(self, digest: str, parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a MailParser result under a known SHA-256 (e.g. from parse_file)"""
+        normalized = normalize_parsed(parsed)
+        sidecar = self._sidecar(digest)
+
+        try:
+            sidecar.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = sidecar.with_suffix(f'.{os.getpid()}.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'cache_version': CACHE_VERSION,
+                    'sha256': digest,
+                    'parsed': normalized
+                }, f, ensure_ascii=False)
+            os.replace(tmp_file, sidecar)
+        except Exception as e:
+            # The cache is an optimization - never fail the pipeline for it
+            logger.warning(f"Could not write parse cache entry: {e}")
+
+        return normalized
+
+    def load(self, mail_path: Path, parser=None) -> Optional[Dict[str, Any]]:
+        """
+        Parsed form of an .eml file - from the sidecar, or parsed and cached
+
+        Args:
+            mail_path: Raw mail file
+            parser: MailParser instance (created on demand)
+
+        Returns:
+            Normalized parse result, None if parsing failed
+        """
+        cached = self.get_digest(self.file_hash(mail_path))
+        if cached is not None:
+            logger.debug(f"Parse cache hit: {Path(mail_path).name}")
+            return cached
+
+        if parser is None:
+            from agents.mail_parser import MailParser
+            parser = MailParser()
+
+        # Streaming parse: large attachments never sit in memory
+        parsed = parser.parse_file(mail_path)
+        if not parsed:
+            return None
+        try:
+            return self.put_digest(parsed['sha256'], parsed)
+        finally:
+            parser.release(parsed)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Storage Layout
+Where a mail and its artifacts (classification, extractions, send receipt)
+live, selected by "storage.layout" in application.json:
+
+  flat    (default) one folder per pipeline state, files joined by the
+          YYYYMMDD_HHMMSS prefix:
+              mails/  classified/  processed/  failed/  sent/  archived/
+
+  bundle  one directory per mail, state kept in its manifest:
+              bundles/YYYY/MM/DD/<mail>/<mail>.eml
+                                       /<timestamp>_identifier.json
+                                       /<timestamp>_problem.json ...
+                                       /bundle.json
+
+File names are the same in both layouts, only the directories differ.
+
+Usage:
+  python utils/storage_layout.py --migrate           # flat -> bundle (dry run)
+  python utils/storage_layout.py --migrate --apply
+"""
+import os
+import json
+import shutil
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+LAYOUTS = ('flat', 'bundle')
+
+# Pipeline states of a mail
+STATES = ('new', 'processed', 'failed', 'sent', 'archived')
+
+# Artifact kinds -> file name suffix (<timestamp>_<suffix>.json)
+ARTIFACTS = {
+    'identifier': 'identifier',
+    'problem': 'problem',
+    'solution': 'solution',
+    'asset': 'asset',
+    'receipt': 'sent'
+}
+
+BUNDLE_MANIFEST = 'bundle.json'
+
+def mail_timestamp(mail_path: Path) -> str:
+    """YYYYMMDD_HHMMSS prefix of a stored mail (or artifact) file name"""
+    parts = Path(mail_path).stem.split('_')
+    if len(parts) >= 2:
+        return f"{parts[0]}_{parts[1]}"
+    return Path(mail_path).stem
+
+def _sort_key(mail_path: Path):
+    try:
+        return datetime.strptime(mail_timestamp(mail_path), '%Y%m%d_%H%M%S')
+    except ValueError:
+        return datetime.fromtimestamp(mail_path.stat().st_mtime)
+
+class FlatLayout:
+    """One directory per state, artifacts in classified/ and processed/"""
+    name = 'flat'
+
+    STATE_DIRS = {
+        'new': 'mails',
+        'processed': 'processed',
+        'failed': 'failed',
+        'sent': 'sent',
+        'archived': 'archived'
+    }
+
+    def __init__(self, base_path: Path):
+        self.base_path = Path(base_path)
+
+    def ensure_directories(self):
+        for folder in list(self.STATE_DIRS.values()) + ['classified']:
+            (self.base_path / folder).mkdir(parents=True, exist_ok=True)
+
+    def store_mail(self, source_path: Path, filename: str, message_id: str = None) -> Path:
+        """Move a new mail (e.g. from the spool) into storage"""
+        dest = self.base_path / 'mails' / filename
+        os.replace(source_path, dest)
+        return dest
+
+    def store_mail_bytes(self, content: bytes, filename: str, message_id: str = None) -> Path:
+        dest = self.base_path / 'mails' / filename
+        with open(dest, 'wb') as f:
+            f.write(content)
+        return dest
+
+    def mails(self, state: Optional[str] = 'new', with_artifact: str = None,
+              without_artifact: str = None) -> List[Path]:
+        """Mails in a state (None: all), oldest first, optionally only with/without an artifact"""
+        states = [state] if state else list(STATES)
+        found = []
+        for name in states:
+            folder = self.base_path / self.STATE_DIRS[name]
+            if folder.exists():
+                found.extend(folder.glob('*.eml'))
+        return _filter_by_artifact(self, sorted(found, key=_sort_key), with_artifact, without_artifact)
+
+    def mail_path(self, mail_file: str, state: str = 'new') -> Path:
+        """Where a mail in this state is stored"""
+        return self.base_path / self.STATE_DIRS[state] / Path(mail_file).name
+
+    def state_of(self, mail_path: Path) -> Optional[str]:
+        for state, folder in self.STATE_DIRS.items():
+            if Path(mail_path).parent == self.base_path / folder:
+                return state
+        return None
+
+    def set_state(self, mail_path: Path, state: str) -> Path:
+        """Move the mail to the state's folder, returns the new path"""
+        dest_dir = self.base_path / self.STATE_DIRS[state]
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        dest = dest_dir / Path(mail_path).name
+        if Path(mail_path) != dest:
+            shutil.move(str(mail_path), str(dest))
+        return dest
+
+    def artifact_path(self, mail_path: Path, kind: str) -> Path:
+        folder = {'identifier': 'classified', 'receipt': 'sent'}.get(kind, 'processed')
+        return self.base_path / folder / f"{mail_timestamp(mail_path)}_{ARTIFACTS[kind]}.json"
+
+    def record_artifact(self, mail_path: Path, kind: str, status: str = 'ok'):
+        """Nothing to record - existence of the file is the state"""
+
+    def has_artifact(self, mail_path: Path, kind: str) -> bool:
+        return self.artifact_path(mail_path, kind).exists()
+
+    def find_mail(self, timestamp: str, state: Optional[str] = None) -> Optional[Path]:
+        """Mail file for a YYYYMMDD_HHMMSS timestamp"""
+        states = [state] if state else list(STATES)
+        for name in states:
+            matches = sorted((self.base_path / self.STATE_DIRS[name]).glob(f"{timestamp}_*.eml"))
+            if matches:
+                return matches[0]
+        return None
+
+class BundleLayout:
+    """One directory per mail under bundles/YYYY/MM/DD/, state in bundle.json"""
+    name = 'bundle'
+
+    def __init__(self, base_path: Path):
+        self.base_path = Path(base_path)
+        self.root = self.base_path / 'bundles'
+
+    def ensure_directories(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    # === Paths (computed, no directory scans) ===
+
+    def bundle_dir(self, mail_file: str) -> Path:
+        """bundles/YYYY/MM/DD/<mail file stem>"""
+        stem = Path(mail_file).stem
+        day = stem[:8]
+        if len(day) == 8 and day.isdigit():
+            return self.root / day[:4] / day[4:6] / day[6:8] / stem
+        return self.root / 'undated' / stem
+
+    def _day_dir(self, timestamp: str) -> Path:
+        return self.bundle_dir(f"{timestamp}_x").parent
+
+    def manifest_path(self, mail_path: Path) -> Path:
+        return Path(mail_path).parent / BUNDLE_MANIFEST
+
+    # === Manifest ===
+
+    def read_manifest(self, mail_path: Path) -> Dict[str, Any]:
+        manifest_path = self.manifest_path(mail_path)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Could not read {manifest_path}: {e}")
+            return {}
+
+    def _write_manifest(self, mail_path: Path, manifest: Dict[str, Any]):
+        """Write atomically (tmp file + rename)"""
+        manifest['updated_at'] = datetime.now().isoformat()
+        manifest_path = self.manifest_path(mail_path)
+        tmp_path = manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def _new_manifest(self, mail_path: Path, state: str = 'new', message_id: str = None) -> Dict[str, Any]:
+        now = datetime.now().isoformat()
+        return {
+            'mail_file': Path(mail_path).name,
+            'message_id': message_id,
+            'timestamp': mail_timestamp(mail_path),
+            'state': state,
+            'artifacts': {},
+            'history': [{'state': state, 'at': now}],
+            'created_at': now
+        }
+
+    # === Layout interface ===
+
+    def store_mail(self, source_path: Path, filename: str, message_id: str = None) -> Path:
+        bundle = self.bundle_dir(filename)
+        bundle.mkdir(parents=True, exist_ok=True)
+        dest = bundle / filename
+        os.replace(source_path, dest)
+        self._write_manifest(dest, self._new_manifest(dest, message_id=message_id))
+        return dest
+
+    def store_mail_bytes(self, content: bytes, filename: str, message_id: str = None) -> Path:
+        bundle = self.bundle_dir(filename)
+        bundle.mkdir(parents=True, exist_ok=True)
+        dest = bundle / filename
+        with open(dest, 'wb') as f:
+            f.write(content)
+        self._write_manifest(dest, self._new_manifest(dest, message_id=message_id))
+        return dest
+
+    def mails(self, state: Optional[str] = 'new', with_artifact: str = None,
+              without_artifact: str = None) -> List[Path]:
+        """Mails in a state (None: all), oldest first - reads the manifests"""
+        found = []
+        manifests = list(self.root.glob(f"*/*/*/*/{BUNDLE_MANIFEST}"))
+        manifests += self.root.glob(f"undated/*/{BUNDLE_MANIFEST}")
+        for manifest_path in manifests:
+            mail_path = manifest_path.parent / f"{manifest_path.parent.name}.eml"
+            if state is None or self.read_manifest(mail_path).get('state') == state:
+                if mail_path.exists():
+                    found.append(mail_path)
+        return _filter_by_artifact(self, sorted(found, key=_sort_key), with_artifact, without_artifact)
+
+    def mail_path(self, mail_file: str, state: str = 'new') -> Path:
+        """Where the mail is stored (same in every state)"""
+        return self.bundle_dir(mail_file) / Path(mail_file).name
+
+    def state_of(self, mail_path: Path) -> Optional[str]:
+        return self.read_manifest(mail_path).get('state')
+
+    def set_state(self, mail_path: Path, state: str) -> Path:
+        """Record the new state - the mail stays where it is"""
+        manifest = self.read_manifest(mail_path) or self._new_manifest(mail_path, state)
+        if manifest.get('state') != state:
+            manifest['state'] = state
+            manifest.setdefault('history', []).append({'state': state, 'at': datetime.now().isoformat()})
+        self._write_manifest(mail_path, manifest)
+        return Path(mail_path)
+
+    def artifact_path(self, mail_path: Path, kind: str) -> Path:
+        return Path(mail_path).parent / f"{mail_timestamp(mail_path)}_{ARTIFACTS[kind]}.json"
+
+    def record_artifact(self, mail_path: Path, kind: str, status: str = 'ok'):
+        if status != 'ok':
+            return
+        manifest = self.read_manifest(mail_path) or self._new_manifest(mail_path)
+        manifest.setdefault('artifacts', {})[kind] = self.artifact_path(mail_path, kind).name
+        self._write_manifest(mail_path, manifest)
+
+    def has_artifact(self, mail_path: Path, kind: str) -> bool:
+        return self.artifact_path(mail_path, kind).exists()
+
+    def find_mail(self, timestamp: str, state: Optional[str] = None) -> Optional[Path]:
+        """Mail file for a YYYYMMDD_HHMMSS timestamp (looks into one day directory)"""
+        for bundle in sorted(self._day_dir(timestamp).glob(f"{timestamp}_*")):
+            mail_path = bundle / f"{bundle.name}.eml"
+            if mail_path.exists() and (state is None or self.state_of(mail_path) == state):
+                return mail_path
+        return None
+
+def _filter_by_artifact(layout, mails: List[Path], with_artifact: str = None,
+                        without_artifact: str = None) -> List[Path]:
+    if with_artifact:
+        mails = [mail for mail in mails if layout.artifact_path(mail, with_artifact).exists()]
+    if without_artifact:
+        mails = [mail for mail in mails if not layout.artifact_path(mail, without_artifact).exists()]
+    return mails
+
+def create_layout(base_path: Path, name: str = 'flat', registry: bool = True):
+    """
+    Layout for a storage base path ('flat' or 'bundle')
+
+    Args:
+        registry: Record every change in the mail registry and answer
+                  lookups from it (utils.mail_registry) instead of scanning
+    """
+    if name not in LAYOUTS:
+        logger.warning(f"Unknown storage layout '{name}', using 'flat'")
+        name = 'flat'
+    layout = BundleLayout(base_path) if name == 'bundle' else FlatLayout(base_path)
+    if not registry:
+        return layout
+
+    from utils.mail_registry import MailRegistry, RegisteredLayout, default_registry_path
+    return RegisteredLayout(layout, MailRegistry(default_registry_path(base_path)))
+
+def migrate_to_bundles(base_path: Path, apply: bool = False) -> Dict[str, int]:
+    """
+    Move a flat storage into bundles: each mail, its classification,
+    extractions and send receipt go into the mail's bundle directory, the
+    folder it was found in becomes the manifest state
+
+    Artifacts without a mail (e.g. of deleted mails) stay where they are.
+    """
+    flat = FlatLayout(base_path)
+    bundles = BundleLayout(base_path)
+    stats = {'mails': 0, 'artifacts': 0, 'skipped': 0}
+
+    thread_index = None
+    if apply and (Path(base_path) / 'index' / 'threads.db').exists():
+        from utils.thread_index import ThreadIndex, default_index_path
+        thread_index = ThreadIndex(default_index_path(base_path))
+
+    for state in STATES:
+        for mail_path in flat.mails(state):
+            dest = bundles.bundle_dir(mail_path.name) / mail_path.name
+            if dest.exists():
+                logger.warning(f"Already migrated, skipping: {mail_path.name}")
+                stats['skipped'] += 1
+                continue
+
+            artifacts = {kind: flat.artifact_path(mail_path, kind) for kind in ARTIFACTS}
+            artifacts = {kind: path for kind, path in artifacts.items() if path.exists()}
+            stats['mails'] += 1
+            stats['artifacts'] += len(artifacts)
+            if not apply:
+                continue
+
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(mail_path), str(dest))
+            manifest = bundles._new_manifest(dest, state)
+            for kind, path in artifacts.items():
+                target = bundles.artifact_path(dest, kind)
+                shutil.move(str(path), str(target))
+                manifest['artifacts'][kind] = target.name
+                if thread_index:
+                    thread_index.relocate_artifact(path, target)
+            bundles._write_manifest(dest, manifest)
+
+    if thread_index:
+        thread_index.close()
+
+    # Registered paths point into the old folders
+    if apply and stats['mails']:
+        from utils.mail_registry import MailRegistry, default_registry_path, cold_mail_files
+        registry = MailRegistry(default_registry_path(base_path))
+        registry.sync(bundles, keep=set(cold_mail_files(base_path)))
+        registry.close()
+    return stats
+
+def main():
+    from run_agent import load_config
+
+    parser = argparse.ArgumentParser(description='Nice2Know storage layout')
+    parser.add_argument('--migrate', action='store_true', help='Move flat storage into per-mail bundles')
+    parser.add_argument('--apply', action='store_true', help='Actually move files (default: dry run)')
+    args = parser.parse_args()
+
+    if not args.migrate:
+        parser.print_help()
+        return 0
+
+    config = load_config()
+    base_path = Path(config['storage']['base_path'])
+    stats = migrate_to_bundles(base_path, apply=args.apply)
+
+    action = 'Migrated' if args.apply else 'Would migrate'
+    print(f"{action} {stats['mails']} mail(s) with {stats['artifacts']} artifact(s) "
+          f"into {base_path / 'bundles'} ({stats['skipped']} already migrated)")
+    if args.apply and config['storage'].get('layout') != 'bundle':
+        print('Set "storage": {"layout": "bundle"} in config/connections/application.json')
+    elif not args.apply:
+        print('Dry run - use --apply to move the files')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - IMAP Sync State
+Persists UIDVALIDITY and the highest processed UID per mailbox, plus the
+UIDs below it that failed processing and are retried
+"""
+import os
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process locking only
+    fcntl = None
+
+logger = get_logger()
+
+# One store per state file and process (see SyncStateStore.shared)
+_shared_stores: Dict[Path, 'SyncStateStore'] = {}
+_shared_lock = threading.Lock()
+
+class SyncStateStore:
+    """
+    Small JSON-backed checkpoint store
+
+    Layout of the state file:
+        {
+            "user@mail.example.com/INBOX": {
+                "uidvalidity": 1700000000,
+                "last_uid": 4711,
+                "failed_uids": {"4709": 1},
+                "updated_at": "2025-11-20T10:00:00"
+            }
+        }
+
+    failed_uids maps a UID to its number of failed attempts
+
+    Several fetchers (accounts, backfill connections) share the file: use
+    shared() for one instance per file, and every write re-reads the file
+    under a lock and only replaces its own key.
+    """
+
+    def __init__(self, state_file: Path):
+        self.state_file = Path(state_file)
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    @classmethod
+    def shared(cls, state_file: Path) -> 'SyncStateStore':
+        """Store instance for a state file, shared within the process"""
+        path = Path(state_file).resolve()
+        with _shared_lock:
+            if path not in _shared_stores:
+                _shared_stores[path] = cls(path)
+            return _shared_stores[path]
+
+    def _load(self) -> Dict[str, Any]:
+        """Load state file (empty state if missing or unreadable)"""
+        if not self.state_file.exists():
+            return {}
+
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read sync state {self.state_file}: {e}")
+            return {}
+
+    def _save(self, key: str):
+        """
+        Write one key atomically (tmp file + rename), merged into the
+        current file content so other writers' keys survive
+        """
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = self.state_file.with_suffix(self.state_file.suffix + '.lock')
+        tmp_file = self.state_file.with_suffix(
+            f"{self.state_file.suffix}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+        with open(lock_file, 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self._load()
+                if key in self._state:
+                    state[key] = self._state[key]
+                else:
+                    state.pop(key, None)
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, indent=2)
+                os.replace(tmp_file, self.state_file)
+                self._state = state
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, key: str) -> Dict[str, Any]:
+        """Get checkpoint for a mailbox key (empty dict if unknown)"""
+        with self._lock:
+            return dict(self._state.get(key, {}))
+
+    def reset(self, key: str, uidvalidity: int):
+        """Start over for a mailbox (new UIDVALIDITY)"""
+        with self._lock:
+            self._state[key] = {
+                'uidvalidity': uidvalidity,
+                'last_uid': 0,
+                'updated_at': datetime.now().isoformat()
+            }
+            self._save(key)
+
+    def advance(self, key: str, uidvalidity: int, uid: int) -> bool:
+        """
+        Move the high-water mark forward
+
+        Returns:
+            True if the checkpoint changed
+        """
+        with self._lock:
+            entry = self._state.get(key, {})
+            same = entry.get('uidvalidity') == uidvalidity
+            failed = dict(entry.get('failed_uids', {})) if same else {}
+            retried = failed.pop(str(uid), None) is not None
+            if same and entry.get('last_uid', 0) >= uid:
+                if retried:
+                    entry['failed_uids'] = failed
+                    self._save(key)
+                return False
+
+            self._state[key] = {
+                'uidvalidity': uidvalidity,
+                'last_uid': uid,
+                'updated_at': datetime.now().isoformat()
+            }
+            if failed:
+                self._state[key]['failed_uids'] = failed
+            self._save(key)
+            return True
+
+    def mark_failed(self, key: str, uidvalidity: int, uid: int) -> int:
+        """
+        Remember a UID whose processing failed, so it is fetched again even
+        after the high-water mark moved past it
+
+        Returns:
+            Number of failed attempts so far (0 if the UIDVALIDITY is stale)
+        """
+        with self._lock:
+            entry = self._state.get(key)
+            if not entry or entry.get('uidvalidity') != uidvalidity:
+                return 0
+
+            failed = entry.setdefault('failed_uids', {})
+            failed[str(uid)] = failed.get(str(uid), 0) + 1
+            self._save(key)
+            return failed[str(uid)]
+
+    def drop_failed(self, key: str, uids: List[int]):
+        """Stop retrying UIDs (expunged, or too many attempts)"""
+        with self._lock:
+            failed = self._state.get(key, {}).get('failed_uids')
+            if not failed:
+                return
+
+            for uid in uids:
+                failed.pop(str(uid), None)
+            self._save(key)
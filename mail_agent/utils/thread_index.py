@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Nice2Know Mail Agent - Thread Index
+Maps every message to its conversation (thread root) using Message-ID,
+In-Reply-To and References. Built at ingest time, stored in SQLite so the
+classifier and the extractors can look up earlier mails and results of a
+thread without scanning storage.
+
+Usage:
+  python utils/thread_index.py --rebuild           # index all stored mails
+  python utils/thread_index.py --show <message-id> # thread of a message
+"""
+import re
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from utils.logger import get_logger
+
+logger = get_logger()
+
+# <id> tokens in References / In-Reply-To
+_MSG_ID_RE = re.compile(r'<([^<>\s]+)>')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    message_id  TEXT PRIMARY KEY,
+    thread_id   TEXT NOT NULL,
+    parent_id   TEXT,
+    subject     TEXT,
+    date        TEXT,
+    mail_file   TEXT,
+    source      TEXT,
+    placeholder INTEGER NOT NULL DEFAULT 0,
+    added_at    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages(thread_id);
+CREATE INDEX IF NOT EXISTS idx_messages_file ON messages(mail_file);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    message_id  TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    path        TEXT NOT NULL,
+    created_at  TEXT,
+    PRIMARY KEY (message_id, kind)
+);
+"""
+
+def parse_references(*header_values: str) -> List[str]:
+    """
+    Message ids from References / In-Reply-To values, oldest first, unique
+
+    References lists the ancestors root-first; In-Reply-To is the direct parent.
+    """
+    ids = []
+    for value in header_values:
+        if not value:
+            continue
+        found = _MSG_ID_RE.findall(value)
+        if not found:
+            # Some clients omit the angle brackets
+            found = value.split()
+        for msg_id in found:
+            msg_id = msg_id.strip().strip('<>')
+            if msg_id and msg_id not in ids:
+                ids.append(msg_id)
+    return ids
+
+class ThreadIndex:
+    """
+    SQLite-backed message -> thread mapping
+
+    Every message row points to its thread_id (the Message-ID of the oldest
+    known ancestor). Referenced messages that were never ingested are kept
+    as placeholder rows, so a parent arriving after its reply joins the same
+    thread. Results produced per message (classification, extractions) are
+    recorded as artifacts and can be listed per thread.
+    """
+
+    def __init__(self, db_path: Path):
+        """
+        Args:
+            db_path: Database file, usually <storage>/index/threads.db
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Shared by the backfill worker threads - access is serialized by the lock
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Ingestion, classifier and extractors are separate processes
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # === Ingest ===
+
+    def add(self, message_id: str, in_reply_to: str = '', references: str = '',
+            subject: str = '', date: str = '', mail_file: str = None, source: str = '') -> str:
+        """
+        Register a message and return its thread_id
+
+        Args:
+            in_reply_to / references: Raw header values
+            mail_file: File name of the stored .eml (None if not saved)
+        """
+        refs = [ref for ref in parse_references(references, in_reply_to) if ref != message_id]
+        parent_id = None
+        if in_reply_to:
+            parents = parse_references(in_reply_to)
+            parent_id = parents[-1] if parents else None
+        elif refs:
+            parent_id = refs[-1]
+
+        with self._lock, self._conn:
+            existing = self._conn.execute(
+                'SELECT thread_id FROM messages WHERE message_id = ?', (message_id,)
+            ).fetchone()
+
+            # Threads this message touches: own placeholder row and known ancestors
+            threads = []
+            if existing:
+                threads.append(existing['thread_id'])
+            for ref in refs:
+                row = self._conn.execute(
+                    'SELECT thread_id FROM messages WHERE message_id = ?', (ref,)
+                ).fetchone()
+                if row and row['thread_id'] not in threads:
+                    threads.append(row['thread_id'])
+
+            if threads:
+                thread_id = threads[0]
+            else:
+                thread_id = refs[0] if refs else message_id
+
+            # A reply connecting two known threads merges them
+            for other in threads[1:]:
+                self._conn.execute(
+                    'UPDATE messages SET thread_id = ? WHERE thread_id = ?', (thread_id, other)
+                )
+                logger.debug(f"Merged thread {other} into {thread_id}")
+
+            now = datetime.now().isoformat()
+            self._conn.execute(
+                """
+                INSERT INTO messages (message_id, thread_id, parent_id, subject, date,
+                                      mail_file, source, placeholder, added_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)
+                ON CONFLICT(message_id) DO UPDATE SET
+                    thread_id = excluded.thread_id,
+                    parent_id = excluded.parent_id,
+                    subject = excluded.subject,
+                    date = excluded.date,
+                    mail_file = COALESCE(excluded.mail_file, messages.mail_file),
+                    source = excluded.source,
+                    placeholder = 0
+                """,
+                (message_id, thread_id, parent_id, subject, date, mail_file, source, now)
+            )
+
+            # Ancestors not seen yet
+            previous = None
+            for ref in refs:
+                self._conn.execute(
+                    """
+                    INSERT OR IGNORE INTO messages (message_id, thread_id, parent_id, placeholder, added_at)
+                    VALUES (?, ?, ?, 1, ?)
+                    """,
+                    (ref, thread_id, previous, now)
+                )
+                previous = ref
+
+        logger.debug(f"Thread index: {message_id} -> {thread_id}")
+        return thread_id
+
+    def add_parsed(self, parsed, mail_file: str = None) -> str:
+        """Register a MailParser result (ParsedMail, parse_headers() or parse-cache dict)"""
+        if hasattr(parsed, 'header'):
+            in_reply_to = parsed.header('In-Reply-To')
+            references = parsed.header('References')
+        else:
+            headers = parsed.get('headers') or {}
+            in_reply_to = str(headers.get('In-Reply-To') or '')
+            references = str(headers.get('References') or '')
+
+        return self.add(
+            parsed['message_id'],
+            in_reply_to=in_reply_to,
+            references=references,
+            subject=parsed['subject'],
+            date=parsed['date'],
+            mail_file=mail_file,
+            source=parsed.get('source', '')
+        )
+
+    def ensure_indexed(self, mail_path: Path) -> Optional[Dict[str, Any]]:
+        """Index row of a stored .eml, indexing it from its headers if missing"""
+        row = self.get_by_file(mail_path)
+        if row:
+            return row
+
+        from agents.mail_parser import MailParser
+        headers = MailParser().parse_headers(mail_path)
+        if not headers:
+            return None
+        self.add_parsed(headers, Path(mail_path).name)
+        return self.get(headers['message_id'])
+
+    # === Lookup ===
+
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Index row of a message, None if unknown"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM messages WHERE message_id = ?', (message_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_by_file(self, mail_file: str) -> Optional[Dict[str, Any]]:
+        """Index row of a stored .eml (by file name)"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM messages WHERE mail_file = ?', (Path(mail_file).name,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def thread_of(self, message_id: str) -> Optional[str]:
+        row = self.get(message_id)
+        return row['thread_id'] if row else None
+
+    def thread_messages(self, thread_id: str, include_placeholders: bool = False) -> List[Dict[str, Any]]:
+        """Messages of a thread, oldest first"""
+        query = 'SELECT * FROM messages WHERE thread_id = ?'
+        if not include_placeholders:
+            query += ' AND placeholder = 0'
+        query += ' ORDER BY date, added_at'
+        with self._lock:
+            rows = self._conn.execute(query, (thread_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def thread_context(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Position of a message in its thread
+
+        Returns:
+            {'thread_id', 'position' (1-based), 'count', 'is_follow_up',
+             'earlier': [rows of the ingested messages before this one]}
+            or None if the message is not indexed
+        """
+        row = self.get(message_id)
+        if not row:
+            return None
+
+        messages = self.thread_messages(row['thread_id'])
+        ids = [message['message_id'] for message in messages]
+        position = ids.index(message_id) + 1 if message_id in ids else len(ids)
+        earlier = messages[:position - 1]
+        return {
+            'thread_id': row['thread_id'],
+            'position': position,
+            'count': len(messages),
+            'is_follow_up': bool(earlier) or row['parent_id'] is not None,
+            'earlier': earlier
+        }
+
+    # === Artifacts ===
+
+    def record_artifact(self, message_id: str, kind: str, path: Path):
+        """Remember a result file of a message (e.g. kind='problem')"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO artifacts (message_id, kind, path, created_at) VALUES (?, ?, ?, ?)',
+                (message_id, kind, str(path), datetime.now().isoformat())
+            )
+
+    def relocate_artifact(self, old_path: Path, new_path: Path):
+        """A result file was moved (e.g. storage layout migration)"""
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE artifacts SET path = ? WHERE path = ?', (str(new_path), str(old_path)))
+
+    def thread_artifacts(self, thread_id: str, kind: str = None) -> List[Dict[str, Any]]:
+        """Artifacts of all messages in a thread, oldest message first"""
+        query = """
+            SELECT a.message_id, a.kind, a.path, a.created_at, m.date
+            FROM artifacts a JOIN messages m ON m.message_id = a.message_id
+            WHERE m.thread_id = ?
+        """
+        params = [thread_id]
+        if kind:
+            query += ' AND a.kind = ?'
+            params.append(kind)
+        query += ' ORDER BY m.date, a.created_at'
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            messages = self._conn.execute(
+                'SELECT COUNT(*) FROM messages WHERE placeholder = 0').fetchone()[0]
+            threads = self._conn.execute(
+                'SELECT COUNT(DISTINCT thread_id) FROM messages WHERE placeholder = 0').fetchone()[0]
+        return {'messages': messages, 'threads': threads}
+
+def default_index_path(storage_base: Path) -> Path:
+    return Path(storage_base) / 'index' / 'threads.db'
+
+def rebuild(index: ThreadIndex, layout) -> int:
+    """(Re-)index all stored mails from their headers (layout: utils.storage_layout)"""
+    from agents.mail_parser import MailParser
+
+    parser = MailParser()
+    count = 0
+    # Oldest first
+    for mail_file in layout.mails(None):
+        headers = parser.parse_headers(mail_file)
+        if not headers:
+            continue
+        index.add_parsed(headers, mail_file.name)
+        count += 1
+    return count
+
+def main():
+    from run_agent import load_config
+
+    parser = argparse.ArgumentParser(description='Nice2Know thread index')
+    parser.add_argument('--rebuild', action='store_true', help='Index all stored mails')
+    parser.add_argument('--show', metavar='MESSAGE_ID', help='Print the thread of a message')
+    args = parser.parse_args()
+
+    config = load_config()
+    index = ThreadIndex(default_index_path(config['storage']['base_path']))
+
+    if args.rebuild:
+        from utils.storage_layout import create_layout
+        layout = create_layout(config['storage']['base_path'], config['storage'].get('layout', 'flat'))
+        count = rebuild(index, layout)
+        stats = index.stats()
+        print(f"Indexed {count} mail(s): {stats['messages']} message(s) in {stats['threads']} thread(s)")
+
+    if args.show:
+        context = index.thread_context(args.show.strip('<>'))
+        if not context:
+            print(f"Unknown message: {args.show}")
+            return 1
+        print(f"Thread {context['thread_id']} (message {context['position']}/{context['count']})")
+        for message in index.thread_messages(context['thread_id']):
+            print(f"  {message['date']}  {message['subject']}  [{message['mail_file'] or '-'}]")
+        for artifact in index.thread_artifacts(context['thread_id']):
+            print(f"  {artifact['kind']:<14} {artifact['path']}")
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
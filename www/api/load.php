@@ -95,15 +95,16 @@ if ($has_export) {
 debug_log("Loading from processed files (original version)");
 
 // Build file paths using timestamp
-$problem_file = PROCESSED_DIR . "/{$timestamp}_problem.json";
-$solution_file = PROCESSED_DIR . "/{$timestamp}_solution.json";
-$asset_file = PROCESSED_DIR . "/{$timestamp}_asset.json";
+$artifact_dir = artifact_dir_for_timestamp($timestamp);
+$problem_file = $artifact_dir . "/{$timestamp}_problem.json";
+$solution_file = $artifact_dir . "/{$timestamp}_solution.json";
+$asset_file = $artifact_dir . "/{$timestamp}_asset.json";
 
 // Check if files exist
 $files_status = [
-    'problem' => file_exists($problem_file),
-    'solution' => file_exists($solution_file),
-    'asset' => file_exists($asset_file)
+    'problem' => stored_file_exists($problem_file),
+    'solution' => stored_file_exists($solution_file),
+    'asset' => stored_file_exists($asset_file)
 ];
 
 debug_log("Files status", $files_status);
@@ -120,7 +121,7 @@ if (!$files_status['asset']) {
 $data = [];
 
 // Load problem.json (required)
-$problem_content = file_get_contents($problem_file);
+$problem_content = read_stored_file($problem_file);
 $data['problem'] = json_decode($problem_content, true);
 
 if (json_last_error() !== JSON_ERROR_NONE) {
@@ -129,7 +130,7 @@ if (json_last_error() !== JSON_ERROR_NONE) {
 
 // Load solution.json (optional - might not exist for all cases)
 if ($files_status['solution']) {
-    $solution_content = file_get_contents($solution_file);
+    $solution_content = read_stored_file($solution_file);
     $data['solution'] = json_decode($solution_content, true);
     
     if (json_last_error() !== JSON_ERROR_NONE) {
@@ -141,7 +142,7 @@ if ($files_status['solution']) {
 }
 
 // Load asset.json (required)
-$asset_content = file_get_contents($asset_file);
+$asset_content = read_stored_file($asset_file);
 $data['asset'] = json_decode($asset_content, true);
 
 if (json_last_error() !== JSON_ERROR_NONE) {
@@ -104,6 +104,17 @@ define('PROCESSED_DIR', STORAGE_DIR . '/processed');
 define('SENT_DIR', STORAGE_DIR . '/sent');
 define('MAILS_DIR', STORAGE_DIR . '/mails');
 
+// Storage layout: 'flat' (state folders) or 'bundle' (one folder per mail, sharded by date)
+define('STORAGE_LAYOUT', $app_config['storage']['layout'] ?? 'flat');
+define('BUNDLES_DIR', STORAGE_DIR . '/bundles');
+
+// Mail registry (SQLite, maintained by the mail agent - utils/mail_registry.py)
+define('REGISTRY_DB', STORAGE_DIR . '/index/registry.db');
+
+// Cold storage: packed old mails/JSONs (utils/cold_storage.py)
+define('COLD_DIR', STORAGE_DIR . '/cold');
+define('COLD_DB', STORAGE_DIR . '/index/cold.db');
+
 // Application settings from config
 define('APP_NAME', $app_config['app_name'] ?? 'Nice2Know Editor');
 define('APP_VERSION', $app_config['version'] ?? '1.0.0');
@@ -239,10 +250,140 @@ function get_safe_mail_id($param_name = 'mail_id') {
     return $mail_id;
 }
 
+// Query an SQLite database of the mail agent - null if it is not available (no pdo_sqlite, not created yet)
+function sqlite_query($db_file, $sql, $params = []) {
+    static $connections = [];
+    
+    if (!isset($connections[$db_file])) {
+        $connections[$db_file] = false;
+        if (file_exists($db_file) && class_exists('PDO') && in_array('sqlite', PDO::getAvailableDrivers())) {
+            try {
+                $pdo = new PDO('sqlite:' . $db_file);
+                $pdo->setAttribute(PDO::ATTR_ERRMODE, PDO::ERRMODE_EXCEPTION);
+                $connections[$db_file] = $pdo;
+            } catch (Exception $e) {
+                error_log("Could not open $db_file: " . $e->getMessage());
+            }
+        }
+    }
+    
+    $pdo = $connections[$db_file];
+    if ($pdo === false) {
+        return null;
+    }
+    
+    try {
+        $stmt = $pdo->prepare($sql);
+        $stmt->execute($params);
+        return $stmt->fetchAll(PDO::FETCH_ASSOC);
+    } catch (Exception $e) {
+        error_log("Query on $db_file failed: " . $e->getMessage());
+        return null;
+    }
+}
+
+// Query the mail registry
+function registry_query($sql, $params = []) {
+    return sqlite_query(REGISTRY_DB, $sql, $params);
+}
+
+// Cold storage entry of a packed file (by file name) - null if not packed
+function cold_member($filepath) {
+    $rows = sqlite_query(
+        COLD_DB,
+        "SELECT pack, offset, length, codec FROM members WHERE name = ? ORDER BY packed_at DESC LIMIT 1",
+        [basename($filepath)]
+    );
+    return empty($rows) ? null : $rows[0];
+}
+
+// Decompress a packed file: one seek + read in the month's pack
+function cold_read($filepath) {
+    $member = cold_member($filepath);
+    if ($member === null) {
+        return null;
+    }
+    
+    $handle = fopen(COLD_DIR . '/' . basename($member['pack']), 'rb');
+    if ($handle === false) {
+        error_log("Cold storage pack not readable: " . $member['pack']);
+        return null;
+    }
+    fseek($handle, (int)$member['offset']);
+    $frame = fread($handle, (int)$member['length']);
+    fclose($handle);
+    
+    if ($member['codec'] === 'gzip') {
+        $content = gzdecode($frame);
+    } elseif (function_exists('zstd_uncompress')) {
+        $content = zstd_uncompress($frame);
+    } else {
+        // No php-zstd: let the mail agent decompress it
+        $cmd = 'python3 ' . escapeshellarg(MAIL_AGENT_ROOT . '/utils/cold_storage.py')
+             . ' --cat ' . escapeshellarg(basename($filepath)) . ' 2>/dev/null';
+        $content = shell_exec($cmd);
+    }
+    
+    if ($content === false || $content === null) {
+        error_log("Could not decompress from cold storage: " . basename($filepath));
+        return null;
+    }
+    debug_log("Read from cold storage", basename($filepath));
+    return $content;
+}
+
+// Stored mail/JSON exists on disk or in cold storage
+function stored_file_exists($filepath) {
+    return file_exists($filepath) || cold_member($filepath) !== null;
+}
+
+// Read a stored mail/JSON - transparently from cold storage if it has been packed
+function read_stored_file($filepath) {
+    if (file_exists($filepath)) {
+        return file_get_contents($filepath);
+    }
+    return cold_read($filepath);
+}
+
+// Directory holding the JSONs of a mail (YYYYMMDD_HHMMSS timestamp)
+function artifact_dir_for_timestamp($timestamp) {
+    if (STORAGE_LAYOUT !== 'bundle') {
+        return PROCESSED_DIR;
+    }
+    
+    $rows = registry_query("SELECT path FROM mails WHERE timestamp = ? ORDER BY mail_file LIMIT 1", [$timestamp]);
+    if (!empty($rows)) {
+        return dirname($rows[0]['path']);
+    }
+    
+    // Bundles: storage/bundles/YYYY/MM/DD/<timestamp>_<id>/ - only one day is scanned
+    $day_dir = BUNDLES_DIR . '/' . substr($timestamp, 0, 4) . '/' . substr($timestamp, 4, 2) . '/' . substr($timestamp, 6, 2);
+    $bundles = glob($day_dir . "/{$timestamp}_*", GLOB_ONLYDIR);
+    
+    return empty($bundles) ? $day_dir : $bundles[0];
+}
+
 // Find timestamp from mail_id by searching in processed directory
 function find_timestamp_from_mail_id($mail_id) {
-    // Search for files matching the mail_id in processed directory
-    $pattern = PROCESSED_DIR . '/*_problem.json';
+    // Indexed lookup in the mail registry
+    $rows = registry_query(
+        "SELECT m.timestamp FROM mails m
+         JOIN stages s ON s.mail_file = m.mail_file AND s.stage = 'problem' AND s.status = 'ok'
+         WHERE m.mail_id = ? ORDER BY m.timestamp DESC LIMIT 1",
+        [$mail_id]
+    );
+    if (!empty($rows)) {
+        debug_log("Found timestamp for mail_id (registry)", $mail_id . " → " . $rows[0]['timestamp']);
+        return $rows[0]['timestamp'];
+    }
+    
+    // Fallback (registry unavailable or mail not registered):
+    // Search for files matching the mail_id in processed directory (or all bundles)
+    if (STORAGE_LAYOUT === 'bundle') {
+        $pattern = BUNDLES_DIR . '/*/*/*/*/*_problem.json';
+    } else {
+        $pattern = PROCESSED_DIR . '/*_problem.json';
+    }
     $problem_files = glob($pattern);
     
     if (empty($problem_files)) {
@@ -272,12 +413,13 @@ function find_timestamp_from_mail_id($mail_id) {
 
 // Load JSON file safely
 function load_json_file($filepath) {
-    if (!file_exists($filepath)) {
+    $json_content = read_stored_file($filepath);
+    
+    if ($json_content === null || $json_content === false) {
         error_log("JSON file not found: $filepath");
         return null;
     }
-    
-    $json_content = file_get_contents($filepath);
+
     $data = json_decode($json_content, true);
     
     if (json_last_error() !== JSON_ERROR_NONE) {
@@ -290,15 +432,16 @@ function load_json_file($filepath) {
 
 // Get all JSON files for a timestamp
 function get_json_files_for_timestamp($timestamp) {
+    $dir = artifact_dir_for_timestamp($timestamp);
     $files = [
-        'problem' => PROCESSED_DIR . "/{$timestamp}_problem.json",
-        'solution' => PROCESSED_DIR . "/{$timestamp}_solution.json",
-        'asset' => PROCESSED_DIR . "/{$timestamp}_asset.json"
+        'problem' => $dir . "/{$timestamp}_problem.json",
+        'solution' => $dir . "/{$timestamp}_solution.json",
+        'asset' => $dir . "/{$timestamp}_asset.json"
     ];
     
     $result = [];
     foreach ($files as $type => $filepath) {
-        if (file_exists($filepath)) {
+        if (stored_file_exists($filepath)) {
             $result[$type] = $filepath;
         } else {
             debug_log("Warning: $type file not found", $filepath);
@@ -362,6 +505,7 @@ if (DEBUG_MODE) {
     error_log("MAIL_AGENT_ROOT: " . MAIL_AGENT_ROOT);
     error_log("STORAGE_DIR: " . STORAGE_DIR);
     error_log("PROCESSED_DIR: " . PROCESSED_DIR);
+    error_log("STORAGE_LAYOUT: " . STORAGE_LAYOUT);
     error_log("BASE_URL: " . BASE_URL);
     error_log("Config file: " . MAIL_AGENT_ROOT . '/config/connections/application.json');
     
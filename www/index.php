@@ -152,10 +152,11 @@ if ($timestamp === null) {
     exit;
 }
 
-$problem_file = PROCESSED_DIR . "/{$timestamp}_problem.json";
-$asset_file = PROCESSED_DIR . "/{$timestamp}_asset.json";
+$artifact_dir = artifact_dir_for_timestamp($timestamp);
+$problem_file = $artifact_dir . "/{$timestamp}_problem.json";
+$asset_file = $artifact_dir . "/{$timestamp}_asset.json";
 
-if (!file_exists($problem_file) || !file_exists($asset_file)) {
+if (!stored_file_exists($problem_file) || !stored_file_exists($asset_file)) {
     ?>
     <!DOCTYPE html>
     <html lang="de">